@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+o3 Enhanced Memory System - ベンチマーク
+偽OpenAIクライアント（固定遅延・決定的な合成埋め込み）で保存・検索・起動時コンテキストを計測し、
+結果をJSONで出力・比較する（APIキー・ネットワーク不要）
+"""
+
+import argparse
+import asyncio
+import hashlib
+import importlib.util
+import json
+import logging
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+
+SYSTEM_PATH = Path(__file__).with_name("o3-memory-system.py")
+
+# 指標 → 大きいほど良いか（比較時の回帰判定に使用）
+METRIC_DIRECTIONS = {
+    "save_throughput_per_s": True,
+    "save_single_p50_ms": False,
+    "save_single_p99_ms": False,
+    "search_cold_ms": False,
+    "search_p50_ms": False,
+    "search_p99_ms": False,
+    "startup_full_ms": False,
+    "startup_snapshot_ms": False,
+    "db_bytes": False,
+    "total_bytes": False,
+    "rss_peak_bytes": False,
+}
+
+CONTEXT_TYPES = ["task", "conversation", "mistake", "directive"]
+
+def load_memory_system():
+    """o3-memory-system.py をモジュールとして読み込み（ハイフン付きファイル名のため importlib）"""
+    spec = importlib.util.spec_from_file_location("o3_memory_system", SYSTEM_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class FakeOpenAIClient:
+    """AsyncOpenAI 互換の偽クライアント（固定遅延、入力から決定的に生成した応答）
+
+    埋め込みは先頭語（トピック）の重心＋本文ハッシュのノイズ。同一トピック間のコサイン類似度は約0.75で、
+    検索の類似度閾値0.7を超える候補が実データ同様に得られる。
+    """
+
+    def __init__(self, latency: float = 0.02, dim: int = 1536, noise: float = 0.58):
+        self.latency = latency
+        self.dim = dim
+        self.noise = noise
+        self.calls = {"chat": 0, "embeddings": 0}
+        self._centroids: Dict[str, np.ndarray] = {}
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._chat_create))
+        self.embeddings = types.SimpleNamespace(create=self._embeddings_create)
+
+    @staticmethod
+    def _seed(text: str) -> int:
+        return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+
+    def _vector(self, text: str) -> List[float]:
+        topic = text.split(maxsplit=1)[0] if text.strip() else ""
+        centroid = self._centroids.get(topic)
+        if centroid is None:
+            centroid = np.random.default_rng(self._seed(topic)).standard_normal(self.dim, dtype=np.float32)
+            self._centroids[topic] = centroid
+        noise = np.random.default_rng(self._seed(text)).standard_normal(self.dim, dtype=np.float32)
+        return (centroid + self.noise * noise).tolist()
+
+    async def _embeddings_create(self, model: str, input, **kwargs):
+        self.calls["embeddings"] += 1
+        await asyncio.sleep(self.latency)
+        texts = [input] if isinstance(input, str) else input
+        return types.SimpleNamespace(
+            data=[types.SimpleNamespace(embedding=self._vector(text), index=i) for i, text in enumerate(texts)],
+            usage=types.SimpleNamespace(total_tokens=sum(len(text) // 4 + 1 for text in texts))
+        )
+
+    async def _chat_create(self, model: str, messages: List[Dict[str, str]], **kwargs):
+        self.calls["chat"] += 1
+        await asyncio.sleep(self.latency)
+        prompt = messages[-1]["content"]
+        if "Importance level" in prompt:
+            seed = self._seed(prompt)
+            content = json.dumps({
+                "importance": seed % 5 + 1,
+                "keywords": [f"kw{seed % 97}", f"kw{seed % 89}"],
+                "reasoning": "synthetic"
+            })
+        elif "continuation_points" in prompt:
+            content = json.dumps({"continuation_points": ["synthetic continuation"]})
+        else:
+            content = "synthetic summary"
+        return types.SimpleNamespace(
+            choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))],
+            usage=types.SimpleNamespace(total_tokens=len(prompt) // 4 + 20)
+        )
+
+class SyntheticCorpus:
+    """トピック語＋ランダム語列の合成記憶（近似重複にならない程度に語彙を分散）"""
+
+    def __init__(self, seed: int = 0, topics: int = 200, vocabulary: int = 5000):
+        self.rng = random.Random(seed)
+        syllables = ["ka", "ki", "ku", "ke", "ko", "sa", "shi", "su", "ta", "te", "to", "na", "ni",
+                     "no", "ha", "hi", "ma", "mi", "mo", "ra", "ri", "ro", "ya", "yo", "wa"]
+        self.topics = [f"topic{i:04d}" for i in range(topics)]
+        self.words = [
+            "".join(self.rng.choice(syllables) for _ in range(self.rng.randint(2, 4)))
+            for _ in range(vocabulary)
+        ]
+
+    def text(self, words: int = 12) -> str:
+        return " ".join([self.rng.choice(self.topics)] + self.rng.sample(self.words, words))
+
+    def memories(self, count: int) -> List[Dict[str, str]]:
+        return [
+            {"content": self.text(), "context_type": self.rng.choice(CONTEXT_TYPES)}
+            for _ in range(count)
+        ]
+
+def percentile_ms(samples: List[float], q: float) -> float:
+    return round(float(np.percentile(np.asarray(samples) * 1000, q)), 3) if samples else 0.0
+
+def directory_bytes(path: Path, pattern: str = "*") -> int:
+    return sum(f.stat().st_size for f in path.rglob(pattern) if f.is_file())
+
+def peak_rss_bytes() -> int:
+    """最大常駐メモリ（Linux は KB、macOS はバイト単位で返る）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SYSTEM_PATH.parent,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """計測用ディレクトリを用意して計測（--base-path 未指定時の一時ディレクトリは --keep がなければ削除）"""
+    if args.base_path:
+        return await measure(args, Path(args.base_path))
+    base_path = Path(tempfile.mkdtemp(prefix="o3-memory-bench-"))
+    try:
+        result = await measure(args, base_path)
+    finally:
+        if not args.keep:
+            shutil.rmtree(base_path, ignore_errors=True)
+    if not args.keep:
+        result["meta"]["base_path"] = None
+    return result
+
+async def measure(args: argparse.Namespace, base_path: Path) -> Dict[str, Any]:
+    """合成記憶の保存→検索→起動時コンテキストの順に計測"""
+    module = load_memory_system()
+    logging.getLogger(module.__name__).setLevel(logging.WARNING)
+    client = FakeOpenAIClient(latency=args.latency, dim=args.dim)
+    memory_system = module.O3EnhancedMemorySystem(
+        base_path=str(base_path),
+        openai_client=client,
+        embedding_backend=module.OpenAIEmbeddingBackend(client, model=f"fake-embedding-{args.dim}")
+    )
+    corpus = SyntheticCorpus(seed=args.seed)
+    sessions = [f"bench-session-{i:04d}" for i in range(args.sessions)]
+    metrics: Dict[str, Any] = {}
+
+    try:
+        # 1. 一括保存スループット
+        started = time.perf_counter()
+        saved = 0
+        while saved < args.memories:
+            batch = corpus.memories(min(args.batch_size, args.memories - saved))
+            await memory_system.save_memories_bulk(batch, sessions[(saved // args.batch_size) % len(sessions)])
+            saved += len(batch)
+            if args.verbose:
+                print(f"saved {saved}/{args.memories}", file=sys.stderr)
+        await memory_system.flush()
+        metrics["save_throughput_per_s"] = round(args.memories / (time.perf_counter() - started), 1)
+
+        # 2. 単発保存の応答時間
+        latencies = []
+        for _ in range(args.single_saves):
+            memory = corpus.memories(1)[0]
+            started = time.perf_counter()
+            await memory_system.save_memory_with_o3_enhancement(
+                memory["content"], sessions[-1], memory["context_type"]
+            )
+            latencies.append(time.perf_counter() - started)
+        await memory_system.flush()
+        metrics["save_single_p50_ms"] = percentile_ms(latencies, 50)
+        metrics["save_single_p99_ms"] = percentile_ms(latencies, 99)
+
+        # 3. 検索応答時間（初回はベクトル索引の読み込みを含む、半数はセッション指定）
+        started = time.perf_counter()
+        await memory_system.search_relevant_memories(corpus.text(6), limit=10)
+        metrics["search_cold_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        latencies = []
+        result_counts = []
+        for i in range(args.queries):
+            session_id = corpus.rng.choice(sessions) if i % 2 else None
+            started = time.perf_counter()
+            results = await memory_system.search_relevant_memories(corpus.text(6), session_id=session_id, limit=10)
+            latencies.append(time.perf_counter() - started)
+            result_counts.append(len(results))
+        metrics["search_p50_ms"] = percentile_ms(latencies, 50)
+        metrics["search_p99_ms"] = percentile_ms(latencies, 99)
+        metrics["search_mean_results"] = round(float(np.mean(result_counts)), 2) if result_counts else 0.0
+
+        # 4. 起動時コンテキスト（全再計算 / セッション終了時スナップショット）
+        started = time.perf_counter()
+        await memory_system.generate_startup_context("bench-startup-full", use_snapshot=False)
+        metrics["startup_full_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        await memory_system.close_session("bench-startup-full")
+        started = time.perf_counter()
+        await memory_system.generate_startup_context("bench-startup-snapshot")
+        metrics["startup_snapshot_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+        await memory_system.flush()
+    finally:
+        memory_system.close()
+
+    # 5. ディスク・メモリ使用量
+    metrics["db_bytes"] = directory_bytes(base_path, "enhanced_memory.db*")
+    metrics["total_bytes"] = directory_bytes(base_path)
+    metrics["rss_peak_bytes"] = peak_rss_bytes()
+    metrics["api_calls"] = dict(client.calls)
+
+    return {
+        "meta": {
+            "commit": current_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": sys.version.split()[0],
+            "base_path": str(base_path),
+            "params": {
+                "memories": args.memories,
+                "sessions": args.sessions,
+                "batch_size": args.batch_size,
+                "single_saves": args.single_saves,
+                "queries": args.queries,
+                "latency": args.latency,
+                "dim": args.dim,
+                "seed": args.seed,
+            },
+        },
+        "metrics": metrics,
+    }
+
+def compare_results(baseline: Dict[str, Any],
+                    current: Dict[str, Any],
+                    threshold: float) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """指標ごとの変化率を算出し、threshold を超えて悪化した指標を回帰として返す"""
+    rows, regressions = [], []
+    for metric, higher_is_better in METRIC_DIRECTIONS.items():
+        before = baseline["metrics"].get(metric)
+        after = current["metrics"].get(metric)
+        if not isinstance(before, (int, float)) or not isinstance(after, (int, float)) or before == 0:
+            continue
+        change = (after - before) / before
+        worse = -change if higher_is_better else change
+        regressed = worse > threshold
+        rows.append({"metric": metric, "baseline": before, "current": after,
+                     "change": round(change, 4), "regression": regressed})
+        if regressed:
+            regressions.append(metric)
+    return rows, regressions
+
+def print_comparison(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float, out=sys.stdout) -> bool:
+    """比較表を表示し、回帰がなければTrue"""
+    if baseline["meta"].get("params") != current["meta"].get("params"):
+        print("⚠️ 計測条件が異なります: "
+              f"{baseline['meta'].get('params')} vs {current['meta'].get('params')}", file=sys.stderr)
+    rows, regressions = compare_results(baseline, current, threshold)
+    print(f"baseline {baseline['meta'].get('commit')} → current {current['meta'].get('commit')} "
+          f"(threshold {threshold:.0%})", file=out)
+    for row in rows:
+        mark = "❌" if row["regression"] else "✅"
+        print(f"{mark} {row['metric']:<24} {row['baseline']:>14} → {row['current']:>14} ({row['change']:+.1%})",
+              file=out)
+    if regressions:
+        print(f"❌ 性能回帰: {', '.join(regressions)}", file=out)
+        return False
+    print("✅ 性能回帰なし", file=out)
+    return True
+
+def parse_args() -> argparse.Namespace:
+    """CLI引数解析"""
+    parser = argparse.ArgumentParser(description="o3 Enhanced Memory System benchmark")
+    parser.add_argument(
+        "--action",
+        default="run",
+        choices=["run", "compare"],
+        help="run: 計測してJSON出力（--baseline 指定時は比較も実施） / compare: 2つの結果JSONを比較"
+    )
+    parser.add_argument("--memories", type=int, default=10000, help="合成記憶の件数（10k〜1M）")
+    parser.add_argument("--sessions", type=int, default=100, help="記憶を振り分けるセッション数")
+    parser.add_argument("--batch-size", type=int, default=1000, help="一括保存1回あたりの件数")
+    parser.add_argument("--single-saves", type=int, default=100, help="単発保存の計測回数")
+    parser.add_argument("--queries", type=int, default=200, help="検索の計測回数")
+    parser.add_argument("--latency", type=float, default=0.02, help="偽APIの固定遅延（秒）")
+    parser.add_argument("--dim", type=int, default=1536, help="合成埋め込みの次元数")
+    parser.add_argument("--seed", type=int, default=0, help="合成データの乱数シード")
+    parser.add_argument("--base-path", help="記憶データディレクトリ（既定: 一時ディレクトリ、計測後に削除）")
+    parser.add_argument("--keep", action="store_true", help="一時ディレクトリを計測後も残す（パスは meta.base_path）")
+    parser.add_argument("--output", help="結果JSONの出力先（既定: 標準出力）")
+    parser.add_argument("--baseline", help="比較元の結果JSON")
+    parser.add_argument("--current", help="compare: 比較対象の結果JSON")
+    parser.add_argument("--threshold", type=float, default=0.15, help="回帰とみなす悪化率（既定 15%%）")
+    parser.add_argument("--verbose", action="store_true", help="保存の進捗を標準エラーへ表示")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    if args.action == "compare":
+        if not args.baseline or not args.current:
+            sys.exit("❌ compare には --baseline と --current が必要です")
+        baseline = json.loads(Path(args.baseline).read_text())
+        current = json.loads(Path(args.current).read_text())
+        sys.exit(0 if print_comparison(baseline, current, args.threshold) else 1)
+
+    result = asyncio.run(run_benchmark(args))
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        # 結果JSONを標準出力に出す場合は比較表を標準エラーへ
+        out = sys.stdout if args.output else sys.stderr
+        if not print_comparison(baseline, result, args.threshold, out):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
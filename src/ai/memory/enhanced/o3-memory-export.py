@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+"""
+o3 Enhanced Memory System - 記憶DBのエクスポート/インポート
+稼働中の SQLite（enhanced_memory.db・claude-memory/memory.db など）を一貫したスナップショットから
+行単位でストリーミングし、チャンク分割・gzip圧縮の行区切りJSON＋バイナリBLOB＋チェックサム付き
+マニフェストを1つのtarアーカイブへ書き出す。インポートは一括トランザクション挿入後に索引・トリガー・
+全文検索索引を作り直す（使用メモリはチャンク1つ分に比例）
+"""
+
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+import sys
+import tarfile
+import tempfile
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Any, Iterator, Tuple
+
+ARCHIVE_FORMAT = "o3-memory-export"
+ARCHIVE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+DEFAULT_CHUNK_ROWS = 50000
+COPY_BUFFER_SIZE = 1 << 20
+WRITE_BATCH_ROWS = 1000
+ROW_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+# インポート先へ引き継ぐDB設定（auto_vacuum・page_size はテーブル作成前に適用が必要）
+CARRIED_PRAGMAS = ("page_size", "auto_vacuum", "application_id", "user_version", "journal_mode")
+FTS5_SHADOW_SUFFIXES = ("_data", "_idx", "_content", "_docsize", "_config")
+FTS_CONTENT_OPTION = re.compile(r"\bcontent\s*=\s*'([^']*)'", re.IGNORECASE)
+# enhanced_memory.db のベクトル索引（DB横のサイドカー全世代・memory-vectors配下のIVF索引）
+VECTOR_OFFSET_TABLE = ("enhanced_memories", "vector_offset")
+VECTOR_CHANGE_LOG_TABLE = "vector_changes"
+IVF_INDEX_PATH = Path("memory-vectors") / "ivf_index.npz"
+
+class ArchiveError(Exception):
+    """アーカイブの形式不正・チェックサム不一致"""
+
+class HashingReader:
+    """読み出したバイト列のsha256と長さを計測するファイルラッパー"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        self.size += len(data)
+        return data
+
+    def drain(self):
+        while self.read(COPY_BUFFER_SIZE):
+            pass
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def read_pragmas(conn: sqlite3.Connection) -> Dict[str, Any]:
+    return {name: conn.execute(f"PRAGMA {name}").fetchone()[0] for name in CARRIED_PRAGMAS}
+
+def has_rowid(conn: sqlite3.Connection, table: str) -> bool:
+    """WITHOUT ROWID テーブルは rowid 列を参照できない"""
+    try:
+        conn.execute(f"SELECT rowid FROM {quote_identifier(table)} LIMIT 0")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def plan_tables(conn: sqlite3.Connection) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[str], List[str]]:
+    """スキーマ定義・行を書き出すテーブル・インポート後に再構築する全文検索索引・復元不可の索引を決定"""
+    schema = [
+        {"type": row[0], "name": row[1], "tbl_name": row[2], "sql": row[3]}
+        for row in conn.execute("""
+            SELECT type, name, tbl_name, sql FROM sqlite_master
+            WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+            ORDER BY rowid
+        """)
+    ]
+    virtual = {
+        entry["name"]: entry["sql"] for entry in schema
+        if entry["type"] == "table" and entry["sql"].upper().startswith("CREATE VIRTUAL TABLE")
+    }
+    # 仮想テーブルの影テーブルは CREATE VIRTUAL TABLE で再作成されるため定義・行とも除外
+    shadow = {
+        name + suffix for name, sql in virtual.items()
+        if "FTS5" in sql.upper() for suffix in FTS5_SHADOW_SUFFIXES
+    }
+    schema = [entry for entry in schema if entry["name"] not in shadow]
+
+    tables, rebuild, unrestorable = [], [], []
+    for entry in schema:
+        if entry["type"] != "table":
+            continue
+        name = entry["name"]
+        if name in virtual:
+            content = FTS_CONTENT_OPTION.search(virtual[name])
+            if content and content.group(1):
+                # 外部コンテンツ型: 元テーブルから 'rebuild' で再索引
+                rebuild.append(name)
+                continue
+            if content:
+                # contentless 型は本文を保持しないため索引を復元できない
+                unrestorable.append(name)
+                continue
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({quote_identifier(name)})")]
+        tables.append({"name": name, "columns": columns, "rowid": has_rowid(conn, name)})
+
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'").fetchone():
+        tables.append({"name": "sqlite_sequence", "columns": ["name", "seq"], "rowid": False})
+    return schema, tables, rebuild, unrestorable
+
+class ChunkWriter:
+    """1チャンク分の行（gzip行区切りJSON）とBLOB（gzipバイナリ）を一時ファイルへ書き出す"""
+
+    def __init__(self, prefix: str, compresslevel: int):
+        self.prefix = prefix
+        self.compresslevel = compresslevel
+        self.rows_file = tempfile.TemporaryFile()
+        self.blobs_file = tempfile.TemporaryFile()
+        self.rows = gzip.GzipFile(fileobj=self.rows_file, mode="wb", compresslevel=compresslevel, mtime=0)
+        self.blobs = gzip.GzipFile(fileobj=self.blobs_file, mode="wb", compresslevel=compresslevel, mtime=0)
+        self.count = 0
+        self.blob_columns = set()
+        self._lines: List[str] = []
+        self._blobs: List[bytes] = []
+
+    def write(self, row: tuple):
+        if bytes in map(type, row):
+            row = list(row)
+            for index, value in enumerate(row):
+                if isinstance(value, bytes):
+                    # BLOBはバイナリ側へ、行には長さのみ記録（読み出し順で対応付け）
+                    self._blobs.append(value)
+                    row[index] = {"b": len(value)}
+                    self.blob_columns.add(index)
+        self._lines.append(ROW_ENCODER.encode(row))
+        self.count += 1
+        if len(self._lines) >= WRITE_BATCH_ROWS:
+            self._flush()
+
+    def _flush(self):
+        """行単位のgzip書き込みは呼び出しコストが支配的なため一定行数ごとにまとめて圧縮"""
+        if self._lines:
+            self.rows.write(("\n".join(self._lines) + "\n").encode())
+            self._lines = []
+        if self._blobs:
+            self.blobs.write(b"".join(self._blobs))
+            self._blobs = []
+
+    def finish(self, tar: tarfile.TarFile) -> Dict[str, Any]:
+        """tarへ追加し、マニフェスト用のチャンク情報（件数・サイズ・sha256）を返す"""
+        self._flush()
+        self.rows.close()
+        self.blobs.close()
+        chunk = {"count": self.count, "blob_columns": sorted(self.blob_columns)}
+        members = [("rows", self.rows_file, ".jsonl.gz")]
+        if self.blob_columns:
+            members.append(("blobs", self.blobs_file, ".bin.gz"))
+        for key, fileobj, suffix in members:
+            size = fileobj.tell()
+            fileobj.seek(0)
+            info = tarfile.TarInfo(self.prefix + suffix)
+            info.size = size
+            info.mtime = int(time.time())
+            reader = HashingReader(fileobj)
+            tar.addfile(info, reader)
+            chunk[key] = {"name": info.name, "bytes": size, "sha256": reader.sha256.hexdigest()}
+        self.rows_file.close()
+        self.blobs_file.close()
+        return chunk
+
+def export_database(db_path: Path,
+                    output_path: Path,
+                    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                    compresslevel: int = 6,
+                    verbose: bool = False) -> Dict[str, Any]:
+    """DBを読み取り専用で開き、単一の読み取りトランザクション内で全テーブルをアーカイブへ書き出す"""
+    if not db_path.exists():
+        raise FileNotFoundError(db_path)
+    started = time.perf_counter()
+    conn = sqlite3.connect(f"{db_path.resolve().as_uri()}?mode=ro", uri=True, isolation_level=None)
+    tmp_output = output_path.with_name(output_path.name + ".partial")
+    try:
+        # WAL書き込み中でも全テーブルを同一時点のスナップショットから読む
+        conn.execute("BEGIN")
+        pragmas = read_pragmas(conn)
+        schema, tables, rebuild, unrestorable = plan_tables(conn)
+        for name in unrestorable:
+            print(f"⚠️ {name}: contentless 全文検索索引はインポート後に空になります", file=sys.stderr)
+
+        manifest = {
+            "format": ARCHIVE_FORMAT,
+            "version": ARCHIVE_VERSION,
+            "created_at": datetime.now().isoformat(),
+            "source": {"path": str(db_path), "name": db_path.name, "sqlite_version": sqlite3.sqlite_version},
+            "pragmas": pragmas,
+            "schema": schema,
+            "rebuild_fulltext": rebuild,
+            "unrestorable": unrestorable,
+            "tables": [],
+        }
+        with tarfile.open(tmp_output, "w") as tar:
+            for table_index, table in enumerate(tables):
+                columns = (["rowid"] if table["rowid"] else []) + table["columns"]
+                select_columns = ", ".join(quote_identifier(c) for c in columns)
+                order = " ORDER BY rowid" if table["rowid"] else ""
+                cursor = conn.execute(f"SELECT {select_columns} FROM {quote_identifier(table['name'])}{order}")
+                cursor.arraysize = 1000
+                chunks, total, writer = [], 0, None
+                for row in cursor:
+                    if writer is None:
+                        writer = ChunkWriter(f"chunks/{table_index:03d}.{len(chunks):05d}", compresslevel)
+                    writer.write(row)
+                    if writer.count >= chunk_rows:
+                        chunks.append(writer.finish(tar))
+                        total += writer.count
+                        writer = None
+                if writer is not None:
+                    chunks.append(writer.finish(tar))
+                    total += writer.count
+                manifest["tables"].append({
+                    "name": table["name"],
+                    "columns": columns,
+                    "row_count": total,
+                    "chunks": chunks,
+                })
+                if verbose:
+                    print(f"  {table['name']}: {total} rows, {len(chunks)} chunks", file=sys.stderr)
+
+            manifest_bytes = json.dumps(manifest, ensure_ascii=False, indent=2).encode()
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size = len(manifest_bytes)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(manifest_bytes))
+        conn.execute("COMMIT")
+        os.replace(tmp_output, output_path)
+    finally:
+        conn.close()
+        if tmp_output.exists():
+            tmp_output.unlink()
+
+    return {
+        "archive": str(output_path),
+        "tables": len(manifest["tables"]),
+        "rows": sum(t["row_count"] for t in manifest["tables"]),
+        "bytes": output_path.stat().st_size,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+def read_manifest(tar: tarfile.TarFile) -> Dict[str, Any]:
+    try:
+        manifest = json.load(tar.extractfile(MANIFEST_NAME))
+    except KeyError:
+        raise ArchiveError(f"{MANIFEST_NAME} がありません")
+    if manifest.get("format") != ARCHIVE_FORMAT:
+        raise ArchiveError(f"未対応のアーカイブ形式: {manifest.get('format')}")
+    if manifest.get("version", 0) > ARCHIVE_VERSION:
+        raise ArchiveError(f"未対応のアーカイブバージョン: {manifest.get('version')}")
+    return manifest
+
+def _verified_member(tar: tarfile.TarFile, entry: Dict[str, Any]) -> Tuple[HashingReader, gzip.GzipFile]:
+    try:
+        member = tar.extractfile(entry["name"])
+    except KeyError:
+        raise ArchiveError(f"チャンクがありません: {entry['name']}")
+    reader = HashingReader(member)
+    return reader, gzip.GzipFile(fileobj=reader, mode="rb")
+
+def _check_member(reader: HashingReader, entry: Dict[str, Any]):
+    reader.drain()
+    if reader.size != entry["bytes"] or reader.sha256.hexdigest() != entry["sha256"]:
+        raise ArchiveError(f"チェックサム不一致: {entry['name']}")
+
+def iterate_chunk_rows(tar: tarfile.TarFile, chunk: Dict[str, Any]) -> Iterator[list]:
+    """チャンクの行を復元しながら返し、読み終えた時点で件数とsha256を検証"""
+    try:
+        yield from _decode_chunk_rows(tar, chunk)
+    except (OSError, EOFError, zlib.error, ValueError, KeyError, IndexError) as e:
+        # 圧縮データ・行JSONの破損（チェックサム照合前に展開で失敗した場合）
+        raise ArchiveError(f"チャンク破損: {chunk['rows']['name']} ({e})") from e
+
+def _decode_chunk_rows(tar: tarfile.TarFile, chunk: Dict[str, Any]) -> Iterator[list]:
+    rows_reader, rows = _verified_member(tar, chunk["rows"])
+    blob_columns = chunk["blob_columns"]
+    blobs_reader = blobs = None
+    if blob_columns:
+        blobs_reader, blobs = _verified_member(tar, chunk["blobs"])
+
+    count = 0
+    pending = b""
+    while True:
+        # 行ごとの json.loads は呼び出しコストが支配的なため、ブロック内の完結した行を1つのJSON配列として解析
+        block = rows.read(COPY_BUFFER_SIZE)
+        if not block:
+            if pending:
+                raise ArchiveError(f"行の途中で終端: {chunk['rows']['name']}")
+            break
+        head, _, pending = (pending + block).rpartition(b"\n")
+        if not head:
+            continue
+        for values in json.loads(b"[" + head.replace(b"\n", b",") + b"]"):
+            for index in blob_columns:
+                marker = values[index]
+                if isinstance(marker, dict):
+                    blob = blobs.read(marker["b"])
+                    if len(blob) != marker["b"]:
+                        raise ArchiveError(f"BLOBの欠損: {chunk['blobs']['name']}")
+                    values[index] = blob
+            count += 1
+            yield values
+
+    if count != chunk["count"]:
+        raise ArchiveError(f"行数不一致: {chunk['rows']['name']} ({count} != {chunk['count']})")
+    _check_member(rows_reader, chunk["rows"])
+    if blobs_reader is not None:
+        if blobs.read(1):
+            raise ArchiveError(f"BLOBの余剰データ: {chunk['blobs']['name']}")
+        _check_member(blobs_reader, chunk["blobs"])
+
+def verify_archive(archive_path: Path) -> Dict[str, Any]:
+    """全チャンクを展開してチェックサム・行数を検証（DBへは書き込まない）"""
+    with tarfile.open(archive_path, "r:") as tar:
+        manifest = read_manifest(tar)
+        rows = 0
+        for table in manifest["tables"]:
+            for chunk in table["chunks"]:
+                rows += sum(1 for _ in iterate_chunk_rows(tar, chunk))
+    return {"archive": str(archive_path), "tables": len(manifest["tables"]), "rows": rows}
+
+def _remove_database_files(db_path: Path):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        path = db_path.with_name(db_path.name + suffix)
+        if path.exists():
+            path.unlink()
+
+def _has_vector_offsets(manifest: Dict[str, Any]) -> bool:
+    table_name, column = VECTOR_OFFSET_TABLE
+    return any(table["name"] == table_name and column in table["columns"] for table in manifest["tables"])
+
+def _remove_vector_files(db_path: Path) -> List[str]:
+    """DB横のベクトルサイドカー（全世代）とIVF索引を削除（元のDBの行オフセット・IDに対応しているため）"""
+    stem = db_path.name.rsplit(".", 1)[0]
+    paths = [db_path.with_name(f"{stem}.vectors"), *db_path.parent.glob(f"{stem}.*.vectors")]
+    ivf_path = db_path.parent / IVF_INDEX_PATH
+    paths += [ivf_path, ivf_path.with_name(ivf_path.name + ".tmp")]
+    removed = []
+    for path in paths:
+        if path.exists():
+            path.unlink()
+            removed.append(path.name)
+    return removed
+
+def import_archive(archive_path: Path,
+                   db_path: Path,
+                   force: bool = False,
+                   verbose: bool = False) -> Dict[str, Any]:
+    """一時DBへ単一トランザクションで一括挿入し、索引・トリガー・全文検索索引を最後に作成してから置換
+
+    チェックサム不一致などで中断した場合は一時DBを破棄し、既存DBには触れない。
+    enhanced_memory.db ではサイドカー行オフセットを消去し、置換後に既存のサイドカー・IVF索引を削除する
+    （次回起動時に埋め込みBLOBから補完される）。
+    """
+    if db_path.exists() and not force:
+        raise FileExistsError(f"{db_path} は既に存在します（置き換える場合は --force）")
+    started = time.perf_counter()
+    tmp_path = db_path.with_name(db_path.name + ".importing")
+    _remove_database_files(tmp_path)
+
+    conn = sqlite3.connect(str(tmp_path), isolation_level=None)
+    try:
+        with tarfile.open(archive_path, "r:") as tar:
+            manifest = read_manifest(tar)
+            pragmas = manifest["pragmas"]
+            # 1. 空DBの物理設定（テーブル作成前のみ有効）と一括投入向け設定
+            conn.execute(f"PRAGMA page_size = {int(pragmas['page_size'])}")
+            conn.execute(f"PRAGMA auto_vacuum = {int(pragmas['auto_vacuum'])}")
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute("PRAGMA cache_size = -65536")
+            conn.execute("BEGIN")
+
+            # 2. テーブル・仮想テーブルのみ作成（索引・トリガーは投入後）
+            deferred = []
+            for entry in manifest["schema"]:
+                if entry["type"] == "table":
+                    conn.execute(entry["sql"])
+                else:
+                    deferred.append(entry)
+
+            # 3. チャンク単位で一括挿入（トリガー未作成のため全文検索・版数更新は発火しない）
+            rows = 0
+            for table in manifest["tables"]:
+                placeholders = ", ".join("?" for _ in table["columns"])
+                columns = ", ".join(quote_identifier(c) for c in table["columns"])
+                sql = f"INSERT INTO {quote_identifier(table['name'])} ({columns}) VALUES ({placeholders})"
+                if table["name"] == "sqlite_sequence":
+                    # AUTOINCREMENT テーブルへの挿入で自動記録された値をエクスポート時点の値で置換
+                    conn.execute("DELETE FROM sqlite_sequence")
+                for chunk in table["chunks"]:
+                    conn.executemany(sql, iterate_chunk_rows(tar, chunk))
+                    rows += chunk["count"]
+                if verbose:
+                    print(f"  {table['name']}: {table['row_count']} rows", file=sys.stderr)
+
+            # 行オフセットは元環境のサイドカーを指すため消去（トリガー作成前なので変更ログは残らない）
+            reset_vectors = _has_vector_offsets(manifest)
+            if reset_vectors:
+                table_name, column = VECTOR_OFFSET_TABLE
+                conn.execute(f"UPDATE {quote_identifier(table_name)} SET {quote_identifier(column)} = NULL")
+                if any(table["name"] == VECTOR_CHANGE_LOG_TABLE for table in manifest["tables"]):
+                    conn.execute(f"DELETE FROM {quote_identifier(VECTOR_CHANGE_LOG_TABLE)}")
+
+        # 4. 索引・トリガーを作成し、外部コンテンツ型全文検索索引を再構築
+        for entry in deferred:
+            conn.execute(entry["sql"])
+        for name in manifest["rebuild_fulltext"]:
+            conn.execute(f"INSERT INTO {quote_identifier(name)}({quote_identifier(name)}) VALUES ('rebuild')")
+        conn.execute(f"PRAGMA application_id = {int(pragmas['application_id'])}")
+        conn.execute(f"PRAGMA user_version = {int(pragmas['user_version'])}")
+        conn.execute("COMMIT")
+
+        # 5. 統計更新と元のジャーナルモード（WAL等）を復元
+        conn.execute("PRAGMA optimize")
+        conn.execute(f"PRAGMA journal_mode = {pragmas['journal_mode']}")
+        conn.close()
+    except BaseException:
+        conn.close()
+        _remove_database_files(tmp_path)
+        raise
+
+    _remove_database_files(db_path)
+    os.replace(tmp_path, db_path)
+    removed_vector_files = _remove_vector_files(db_path) if reset_vectors else []
+    for name in manifest["unrestorable"]:
+        # enhanced_memory_archive.db の索引は MemoryArchive が次回起動時に圧縮本文から再構築する
+        print(f"⚠️ {name}: contentless 全文検索索引は空のまま復元されました", file=sys.stderr)
+    return {
+        "database": str(db_path),
+        "tables": len(manifest["tables"]),
+        "rows": rows,
+        "removed_vector_files": removed_vector_files,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+def parse_args() -> argparse.Namespace:
+    """CLI引数解析"""
+    parser = argparse.ArgumentParser(description="o3 Enhanced Memory System database export/import")
+    parser.add_argument(
+        "--action",
+        required=True,
+        choices=["export", "import", "verify"],
+        help="export: DB→アーカイブ / import: アーカイブ→DB / verify: アーカイブのチェックサム・行数検証"
+    )
+    parser.add_argument("--db", help="対象DB（例: enhanced_memory.db, claude-memory/memory.db）")
+    parser.add_argument("--archive", required=True, help="アーカイブファイル（例: enhanced_memory.o3export.tar）")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="1チャンクあたりの行数")
+    parser.add_argument("--compress-level", type=int, default=6, help="gzip圧縮レベル（1〜9）")
+    parser.add_argument("--force", action="store_true", help="import: 既存DBを置き換える")
+    parser.add_argument("--verbose", action="store_true", help="テーブルごとの進捗を標準エラーへ表示")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    archive_path = Path(args.archive)
+    if args.action in ("export", "import") and not args.db:
+        sys.exit(f"❌ {args.action} には --db が必要です")
+
+    try:
+        if args.action == "export":
+            result = export_database(Path(args.db), archive_path, args.chunk_rows, args.compress_level, args.verbose)
+        elif args.action == "import":
+            result = import_archive(archive_path, Path(args.db), args.force, args.verbose)
+        else:
+            result = verify_archive(archive_path)
+    except (ArchiveError, FileExistsError, FileNotFoundError, tarfile.TarError) as e:
+        sys.exit(f"❌ {e}")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -4,22 +4,55 @@ o3 Enhanced Memory System - セッション間記憶引き継ぎシステム
 最適化されたセッション記憶継続システム with o3 API integration
 """
 
+from __future__ import annotations
+
+import argparse
 import json
 import os
+import sys
 import asyncio
-import aiohttp
+import importlib.util
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Any, Optional, Tuple
+from typing import TYPE_CHECKING, Dict, List, Any, Optional, Tuple, Callable, AsyncIterator
 import sqlite3
+import subprocess
 import hashlib
+import zlib
+import fcntl
+import time
+import random
+import queue
+import tempfile
+import threading
+import types
+import concurrent.futures
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import logging
-from dataclasses import dataclass, asdict
 from enum import Enum
-import openai
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
+
+if TYPE_CHECKING:
+    from sklearn.linear_model import LogisticRegression
+
+def _lazy_import(name: str):
+    """初回の属性参照まで読み込みを遅延したモジュール（importlib.util.LazyLoader）"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+# 重量級依存は初回使用時に読み込む（スナップショットからの起動時コンテキスト読み取りでは不要）
+# scikit-learn は使用箇所で import する
+np = _lazy_import("numpy")
+openai = _lazy_import("openai")
 
 # ログ設定
 logging.basicConfig(
@@ -28,6 +61,66 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 既定の記憶データディレクトリとDBファイル名
+DEFAULT_BASE_PATH = "/Users/dd/Desktop/1_dev/coding-rule2/memory/enhanced"
+DATABASE_FILENAME = "enhanced_memory.db"
+# ベクトルサイドカー（世代0のファイル名、圧縮ごとに enhanced_memory.<世代>.vectors へ切替）
+VECTOR_SIDECAR_FILENAME = "enhanced_memory.vectors"
+
+# 記憶バージョンが一致する（以後記憶が変化していない）起動時スナップショット
+STARTUP_SNAPSHOT_QUERY = """
+    SELECT s.source_session_id, s.context, s.inherited_memories
+    FROM startup_snapshot s JOIN memory_state m ON m.id = 1
+    WHERE s.id = 1 AND s.memory_version = m.version
+"""
+
+# 継承記録（同一セッション組の再継承は上書き）
+INHERITANCE_INSERT_SQL = """
+    INSERT OR REPLACE INTO session_inheritance
+    (id, previous_session_id, current_session_id, inherited_memories, inheritance_timestamp, inheritance_score)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+def inheritance_row(previous_session_id: str, current_session_id: str, inherited_ids: List[str]) -> Tuple:
+    return (
+        hashlib.md5(f"{previous_session_id}-{current_session_id}".encode()).hexdigest(),
+        previous_session_id,
+        current_session_id,
+        json.dumps(inherited_ids),
+        datetime.now().isoformat(),
+        len(inherited_ids) / 10.0  # 正規化スコア
+    )
+
+def read_startup_snapshot(db_path: Path, current_session_id: str) -> Optional[Dict[str, Any]]:
+    """有効な起動時スナップショットを標準ライブラリのみで読み取り継承を記録（numpy・openai・sklearn不要）
+
+    スナップショットがない・記憶更新で無効・同一セッションから作成された場合はNone（通常経路で再計算）。
+    参照統計（access_count等）は更新しない。
+    """
+    if not db_path.exists():
+        return None
+    conn = sqlite3.connect(str(db_path), timeout=30)
+    try:
+        try:
+            row = conn.execute(STARTUP_SNAPSHOT_QUERY).fetchone()
+        except sqlite3.OperationalError:  # スナップショット導入前のスキーマ
+            return None
+        if row is None or row[0] == current_session_id:
+            return None
+        previous_session, context, inherited_memories = row
+        conn.execute(INHERITANCE_INSERT_SQL, inheritance_row(
+            previous_session, current_session_id, json.loads(inherited_memories)
+        ))
+        conn.commit()
+    finally:
+        conn.close()
+    logger.info(f"Startup context served from snapshot (light path): {previous_session} -> {current_session_id}")
+    return {
+        "session_id": current_session_id,
+        **json.loads(context),
+        "startup_timestamp": datetime.now().isoformat()
+    }
+
 class MemoryImportance(Enum):
     """記憶の重要度レベル"""
     CRITICAL = 5    # 必須継承（78回ミス記録、職務宣言等）
@@ -36,30 +129,1958 @@ class MemoryImportance(Enum):
     LOW = 2         # 参考情報
     ARCHIVE = 1     # アーカイブ候補
 
-@dataclass
+# MemoryRecord を構成する enhanced_memories の列（射影指定に使用可能な列名）
+MEMORY_COLUMNS = (
+    "id", "session_id", "timestamp", "content", "importance",
+    "keywords", "context_type", "embedding", "ai_source"
+)
+
 class MemoryRecord:
-    """記憶レコード構造"""
-    id: str
-    session_id: str
-    timestamp: datetime
-    content: str
-    importance: MemoryImportance
-    keywords: List[str]
-    context_type: str  # 'task', 'conversation', 'mistake', 'directive'
-    embedding: Optional[List[float]] = None
-    ai_source: str = "claude"  # 'claude', 'gemini', 'o3'
-    
+    """記憶レコード構造（__slots__、DB由来の timestamp・keywords・embedding は参照時に復号）
+
+    from_row() で構築したレコードはISO文字列・JSON文字列・float32バイナリをそのまま保持し、
+    属性の初回参照時に datetime・list・np.ndarray（バッファのビュー）へ変換してキャッシュする。
+    """
+
+    __slots__ = (
+        "id", "session_id", "content", "importance", "context_type", "ai_source",
+        "relevance_score", "_timestamp", "_keywords", "_embedding"
+    )
+
+    def __init__(self,
+                 id: str,
+                 session_id: str,
+                 timestamp: datetime,
+                 content: str,
+                 importance: MemoryImportance,
+                 keywords: List[str],
+                 context_type: str,  # 'task', 'conversation', 'mistake', 'directive'
+                 embedding: Optional[np.ndarray] = None,
+                 ai_source: str = "claude",  # 'claude', 'gemini', 'o3'
+                 relevance_score: float = 0.0):
+        self.id = id
+        self.session_id = session_id
+        self._timestamp = timestamp
+        self.content = content
+        self.importance = importance
+        self._keywords = keywords
+        self.context_type = context_type
+        self._embedding = embedding
+        self.ai_source = ai_source
+        self.relevance_score = relevance_score
+
+    @classmethod
+    def from_row(cls, row: Tuple, columns: Tuple[str, ...] = MEMORY_COLUMNS) -> "MemoryRecord":
+        """DB行から未復号のまま構築（射影されなかった埋め込みはNone）"""
+        values = dict(zip(columns, row))
+        return cls(
+            id=values["id"],
+            session_id=values["session_id"],
+            timestamp=values["timestamp"],
+            content=values["content"],
+            importance=MemoryImportance(values["importance"]),
+            keywords=values["keywords"],
+            context_type=values["context_type"],
+            embedding=values.get("embedding"),
+            ai_source=values["ai_source"]
+        )
+
+    @property
+    def timestamp(self) -> datetime:
+        if isinstance(self._timestamp, str):
+            self._timestamp = datetime.fromisoformat(self._timestamp)
+        return self._timestamp
+
+    @timestamp.setter
+    def timestamp(self, value: datetime):
+        self._timestamp = value
+
+    @property
+    def keywords(self) -> List[str]:
+        if isinstance(self._keywords, str):
+            self._keywords = json.loads(self._keywords)
+        return self._keywords
+
+    @keywords.setter
+    def keywords(self, value: List[str]):
+        self._keywords = value
+
+    @property
+    def embedding(self) -> Optional[np.ndarray]:
+        if isinstance(self._embedding, (bytes, str)):
+            self._embedding = decode_embedding(self._embedding)
+        return self._embedding
+
+    @embedding.setter
+    def embedding(self, value: Optional[np.ndarray]):
+        self._embedding = value
+
+    def __repr__(self) -> str:
+        return (f"MemoryRecord(id={self.id!r}, session_id={self.session_id!r}, "
+                f"importance={self.importance.name}, context_type={self.context_type!r})")
+
+# 埋め込みはリトルエンディアンfloat32のバイト列としてBLOB保存（numpyを読み込まないよう型文字列で保持）
+EMBEDDING_DTYPE = "<f4"
+EMBEDDING_ITEMSIZE = 4
+
+def encode_embedding(embedding) -> Optional[bytes]:
+    """埋め込みベクトル → float32バイナリ"""
+    if embedding is None or len(embedding) == 0:
+        return None
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+def decode_embedding(blob) -> Optional[np.ndarray]:
+    """float32バイナリ（旧形式のJSONテキストも可）→ 埋め込みベクトル"""
+    if not blob:
+        return None
+    if isinstance(blob, str):
+        return np.asarray(json.loads(blob), dtype=EMBEDDING_DTYPE)
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+
+class MinHashLSH:
+    """文字3-gramのMinHash署名とLSHバンド（近似重複検出、推定Jaccard類似度）
+
+    num_perm 個の最小ハッシュを bands 個のバンドに分け、いずれかのバンドが一致した記憶を候補とする。
+    既定の128/16（8行/バンド）では類似度0.8の組を約95%、0.5の組を約6%の確率で候補化する。
+    """
+
+    PRIME = 4294967291  # 2^32未満の最大素数（署名はuint32に収まる）
+
+    def __init__(self, num_perm: int = 128, bands: int = 16, seed: int = 1):
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.seed = seed
+        self._a: Optional[np.ndarray] = None
+        self._b: Optional[np.ndarray] = None
+
+    def _permutations(self) -> Tuple[np.ndarray, np.ndarray]:
+        """ハッシュ係数（初回使用時に生成）"""
+        if self._a is None:
+            rng = np.random.default_rng(self.seed)
+            self._a = rng.integers(1, 2 ** 31, size=(self.num_perm, 1), dtype=np.uint64)
+            self._b = rng.integers(0, 2 ** 31, size=(self.num_perm, 1), dtype=np.uint64)
+        return self._a, self._b
+
+    @staticmethod
+    def shingles(text: str, size: int = 3) -> set:
+        normalized = " ".join(text.lower().split())
+        if len(normalized) <= size:
+            return {normalized}
+        return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode()) for shingle in self.shingles(text)), dtype=np.uint64
+        )
+        a, b = self._permutations()
+        return ((a * hashes + b) % self.PRIME).min(axis=1).astype("<u4")
+
+    def buckets(self, signature: np.ndarray) -> List[int]:
+        """バンド毎のバケットキー（バンド番号込みの64bit符号付き整数）"""
+        keys = []
+        for band in range(self.bands):
+            chunk = signature[band * self.rows_per_band:(band + 1) * self.rows_per_band]
+            digest = hashlib.blake2b(bytes([band]) + chunk.tobytes(), digest_size=8).digest()
+            keys.append(int.from_bytes(digest, "little", signed=True))
+        return keys
+
+    @staticmethod
+    def similarity(signature: np.ndarray, other: np.ndarray) -> float:
+        """署名一致率（Jaccard類似度の推定値）"""
+        return float(np.mean(signature == other))
+
+    def store(self, conn: sqlite3.Connection, memory_id: str, signature: np.ndarray):
+        """バケット登録（書き込みスレッドで実行）"""
+        conn.executemany(
+            "INSERT OR IGNORE INTO memory_lsh_buckets (bucket, memory_id) VALUES (?, ?)",
+            [(bucket, memory_id) for bucket in self.buckets(signature)]
+        )
+
+# 近似重複検出の既定パラメータ（署名・バケットはDBに永続化されるため変更時は再計算が必要）
+MINHASH_LSH = MinHashLSH()
+
+class VectorSidecar:
+    """enhanced_memory.db横の追記専用float32ベクトルファイル（np.memmapで全プロセス共有）
+
+    既存行は書き換えない。圧縮は新しい世代のファイルへ書き出し、memory_state.vector_generation で切り替える。
+    """
+
+    MAGIC = b"O3VEC001"
+    HEADER_SIZE = 64
+
+    def __init__(self, path: Path, generation: int = 0):
+        self.path = path
+        self.generation = generation
+        self.dim = 0
+        self._view: Optional[np.memmap] = None
+        self._read_header()
+
+    @staticmethod
+    def generation_path(base_path: Path, generation: int) -> Path:
+        """世代別のファイルパス（世代0は従来の enhanced_memory.vectors）"""
+        if generation == 0:
+            return base_path / VECTOR_SIDECAR_FILENAME
+        stem, suffix = VECTOR_SIDECAR_FILENAME.rsplit(".", 1)
+        return base_path / f"{stem}.{generation}.{suffix}"
+
+    @classmethod
+    def remove_generations(cls, base_path: Path, below: int) -> int:
+        """below 未満の世代のファイルを削除（マップ中のプロセスは削除後も旧内容を読める）"""
+        stem, suffix = VECTOR_SIDECAR_FILENAME.rsplit(".", 1)
+        paths = [(0, base_path / VECTOR_SIDECAR_FILENAME)]
+        for path in base_path.glob(f"{stem}.*.{suffix}"):
+            generation = path.name[len(stem) + 1:-len(suffix) - 1]
+            if generation.isdigit():
+                paths.append((int(generation), path))
+        removed = 0
+        for generation, path in paths:
+            if generation < below and path.exists():
+                path.unlink()
+                removed += 1
+        return removed
+
+    def _read_header(self):
+        if not self.path.exists() or self.path.stat().st_size < self.HEADER_SIZE:
+            return
+        with open(self.path, "rb") as f:
+            header = f.read(self.HEADER_SIZE)
+        if header[:8] != self.MAGIC:
+            raise ValueError(f"Invalid vector sidecar: {self.path}")
+        self.dim = int(np.frombuffer(header[8:16], dtype="<i8")[0])
+
+    def refresh(self) -> int:
+        """次元未確定なら、開いた後に他プロセスが作成したファイルのヘッダを読み込み次元を返す"""
+        if not self.dim:
+            self._read_header()
+        return self.dim
+
+    @property
+    def rows(self) -> int:
+        """書き込み完了済みの行数"""
+        if not self.refresh() or not self.path.exists():
+            return 0
+        return (self.path.stat().st_size - self.HEADER_SIZE) // (self.dim * EMBEDDING_ITEMSIZE)
+
+    def append(self, vectors: np.ndarray) -> int:
+        """正規化済みベクトル (n, D) を追記し先頭行のオフセットを返す"""
+        vectors = np.ascontiguousarray(vectors, dtype=EMBEDDING_DTYPE)
+        with open(self.path, "a+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0, os.SEEK_END)
+                if f.tell() < self.HEADER_SIZE:
+                    f.truncate(0)
+                    f.write(self.MAGIC + np.int64(vectors.shape[1]).astype("<i8").tobytes())
+                    f.write(b"\0" * (self.HEADER_SIZE - 16))
+                    self.dim = vectors.shape[1]
+                elif not self.dim:
+                    self._read_header()
+                if vectors.shape[1] != self.dim:
+                    raise ValueError(f"Embedding dimension mismatch: {vectors.shape[1]} != {self.dim}")
+                row_bytes = self.dim * EMBEDDING_ITEMSIZE
+                offset = (f.tell() - self.HEADER_SIZE) // row_bytes
+                # 書き込み途中で落ちた端数行は上書き
+                f.truncate(self.HEADER_SIZE + offset * row_bytes)
+                f.write(vectors.tobytes())
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return offset
+
+    def view(self, min_rows: int = 0) -> np.ndarray:
+        """読み取り専用memmap（他プロセスの追記分が必要なら再マップ）"""
+        if self._view is None or len(self._view) < min_rows:
+            rows = self.rows
+            if rows == 0:
+                return np.zeros((0, self.dim), dtype=EMBEDDING_DTYPE)
+            self._view = np.memmap(
+                self.path, dtype=EMBEDDING_DTYPE, mode="r",
+                offset=self.HEADER_SIZE, shape=(rows, self.dim)
+            )
+        return self._view
+
+    def reset(self):
+        """サイドカー破棄（中断した圧縮の書き出し途中ファイル用）"""
+        self._view = None
+        self.dim = 0
+        if self.path.exists():
+            self.path.unlink()
+
+class EmbeddingMatrix:
+    """サイドカー上の正規化済み埋め込み行列 (N, D) と並行ID・フィルタ配列・セッション区画"""
+
+    # 連続配置したベクトルを保持するセッション区画数（LRU）
+    PARTITION_CACHE_SIZE = 8
+
+    def __init__(self, sidecar: VectorSidecar):
+        self.sidecar = sidecar
+        self.ids: List[str] = []
+        self.id_to_row: Dict[str, int] = {}
+        self.offsets = np.zeros(0, dtype=np.int64)
+        self.importance = np.zeros(0, dtype=np.int8)
+        self.session_codes = np.zeros(0, dtype=np.int32)
+        self.session_to_code: Dict[str, int] = {}
+        # セッションコード → 行番号リスト（区画）と、区画のベクトルを連続配置したキャッシュ
+        self.session_rows: Dict[int, List[int]] = {}
+        self._partition_cache: "OrderedDict[int, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def dim(self) -> int:
+        if self._count:
+            # 空のサイドカーで読み込んだ後に他プロセスの登録分を取り込んだ場合
+            return self.sidecar.refresh()
+        return self.sidecar.dim
+
+    def clear(self):
+        self.__init__(self.sidecar)
+
+    def add(self, memory_id: str, offset: int, importance: int, session_id: str) -> int:
+        """サイドカー行を登録（同一IDは上書き）、行番号を返す"""
+        code = self.session_to_code.setdefault(session_id, len(self.session_to_code))
+        row = self.id_to_row.get(memory_id)
+        if row is None:
+            row = self._count
+            self._reserve(row + 1)
+            self.ids.append(memory_id)
+            self.id_to_row[memory_id] = row
+            self._count += 1
+            self.session_rows.setdefault(code, []).append(row)
+        elif self.session_codes[row] != code:
+            previous_code = int(self.session_codes[row])
+            self.session_rows[previous_code].remove(row)
+            self._partition_cache.pop(previous_code, None)
+            self.session_rows.setdefault(code, []).append(row)
+        self.offsets[row] = offset
+        self.importance[row] = importance
+        self.session_codes[row] = code
+        self._partition_cache.pop(code, None)
+        return row
+
+    def _reserve(self, size: int):
+        """償却O(1)追加のための容量確保"""
+        capacity = len(self.offsets)
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2, 64)
+        self.offsets = self._grow(self.offsets, new_capacity)
+        self.importance = self._grow(self.importance, new_capacity)
+        self.session_codes = self._grow(self.session_codes, new_capacity)
+
+    def _grow(self, array: np.ndarray, capacity: int) -> np.ndarray:
+        grown = np.zeros(capacity, dtype=array.dtype)
+        grown[:self._count] = array[:self._count]
+        return grown
+
+    def row_vectors(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """指定行のベクトル（コピー）"""
+        offsets = self.offsets[:self._count] if rows is None else self.offsets[rows]
+        if len(offsets) == 0:
+            return np.zeros((0, self.dim), dtype=EMBEDDING_DTYPE)
+        return self.sidecar.view(int(offsets.max()) + 1)[offsets]
+
+    def partition(self, session_id: str) -> Tuple[np.ndarray, np.ndarray]:
+        """セッション区画の (行番号, 連続配置ベクトル)（更新のあった区画のみ再構築）"""
+        code = self.session_to_code.get(session_id)
+        if code is None:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.dim), dtype=EMBEDDING_DTYPE)
+        cached = self._partition_cache.get(code)
+        if cached is not None:
+            self._partition_cache.move_to_end(code)
+            return cached
+        rows = np.asarray(self.session_rows.get(code, []), dtype=np.int64)
+        cached = (rows, self.row_vectors(rows))
+        self._partition_cache[code] = cached
+        if len(self._partition_cache) > self.PARTITION_CACHE_SIZE:
+            self._partition_cache.popitem(last=False)
+        return cached
+
+    def session_top_k(self,
+                      query_vector: np.ndarray,
+                      k: int,
+                      session_id: str,
+                      importance_levels: Optional[List["MemoryImportance"]] = None) -> List[Tuple[str, float]]:
+        """セッション区画のみを走査する上位k件 (id, コサイン類似度)"""
+        rows, vectors = self.partition(session_id)
+        if importance_levels and len(rows):
+            keep = np.isin(self.importance[rows], [imp.value for imp in importance_levels])
+            rows, vectors = rows[keep], vectors[keep]
+        if len(rows) == 0:
+            return []
+        return self._select_top(vectors @ query_vector, k, rows)
+
+    def mask(self,
+             session_id: Optional[str] = None,
+             importance_levels: Optional[List["MemoryImportance"]] = None) -> Optional[np.ndarray]:
+        """セッション・重要度フィルタのブールマスク（条件なしならNone）"""
+        mask = None
+        if session_id is not None:
+            code = self.session_to_code.get(session_id, -1)
+            mask = self.session_codes[:self._count] == code
+        if importance_levels:
+            importance_mask = np.isin(self.importance[:self._count], [imp.value for imp in importance_levels])
+            mask = importance_mask if mask is None else mask & importance_mask
+        return mask
+
+    def top_k(self,
+              query_vector: np.ndarray,
+              k: int,
+              rows: Optional[np.ndarray] = None,
+              mask: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """行列ベクトル積1回 + argpartitionで上位k件 (id, コサイン類似度)"""
+        if self._count == 0:
+            return []
+        if rows is None:
+            rows = np.nonzero(mask)[0] if mask is not None else None
+        elif mask is not None:
+            rows = rows[mask[rows]]
+
+        if rows is None:
+            # 全件はmemmapを直接スキャン（プロセス毎のコピーなし）
+            offsets = self.offsets[:self._count]
+            scores = (self.sidecar.view(int(offsets.max()) + 1) @ query_vector)[offsets]
+        else:
+            scores = self.row_vectors(rows) @ query_vector
+        if len(scores) == 0:
+            return []
+        return self._select_top(scores, k, rows)
+
+    def _select_top(self, scores: np.ndarray, k: int, rows: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """argpartitionで上位k件を選び降順に並べる（rows指定時はscoresの添字→行番号）"""
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if rows is not None:
+            return [(self.ids[rows[i]], float(scores[i])) for i in top]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+    def mmr(self,
+            candidates: List[Tuple[str, float]],
+            k: int,
+            lambda_: float = 0.7) -> List[Tuple[str, float]]:
+        """Maximal Marginal Relevance による候補の選択（選択順）
+
+        λ・関連度 − (1−λ)・選択済み候補との最大コサイン類似度 が最大の候補を逐次選ぶ。
+        類似度行列は1回の行列積で求め、最大類似度は選択ごとに np.maximum で更新する。
+        行列に未登録の候補（埋め込みなし）は他候補との類似度0として扱う。
+        """
+        if k >= len(candidates) or len(candidates) < 2:
+            return candidates[:k]
+        relevance = np.asarray([score for _, score in candidates], dtype=np.float32)
+        vectors = np.zeros((len(candidates), self.dim), dtype=EMBEDDING_DTYPE)
+        known = [i for i, (memory_id, _) in enumerate(candidates) if memory_id in self.id_to_row]
+        if known:
+            rows = np.asarray([self.id_to_row[candidates[i][0]] for i in known], dtype=np.int64)
+            vectors[known] = self.row_vectors(rows)
+        similarity = vectors @ vectors.T
+
+        max_similarity = np.zeros(len(candidates), dtype=np.float32)
+        available = np.ones(len(candidates), dtype=bool)
+        selected = []
+        for _ in range(k):
+            marginal = lambda_ * relevance - (1 - lambda_) * max_similarity
+            marginal[~available] = -np.inf
+            choice = int(np.argmax(marginal))
+            selected.append(choice)
+            available[choice] = False
+            np.maximum(max_similarity, similarity[choice], out=max_similarity)
+        return [candidates[i] for i in selected]
+
+    def score_ids(self, query_vector: np.ndarray, memory_ids: List[str]) -> Dict[str, float]:
+        """指定IDのみのコサイン類似度（未登録IDは除外）"""
+        known = [memory_id for memory_id in memory_ids if memory_id in self.id_to_row]
+        if not known:
+            return {}
+        rows = np.fromiter((self.id_to_row[memory_id] for memory_id in known), dtype=np.int64, count=len(known))
+        scores = self.row_vectors(rows) @ query_vector
+        return dict(zip(known, scores.tolist()))
+
+    @staticmethod
+    def normalize(vector: np.ndarray) -> Optional[np.ndarray]:
+        if vector.ndim != 1 or vector.size == 0:
+            return None
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        return vector / norm
+
+class IVFVectorIndex:
+    """EmbeddingMatrix上のIVF近似最近傍インデックス（memory-vectors配下に永続化）"""
+
+    def __init__(self,
+                 matrix: EmbeddingMatrix,
+                 index_path: Path,
+                 n_probe: int = 16,
+                 train_threshold: int = 2048):
+        self.matrix = matrix
+        self.index_path = index_path
+        self.n_probe = n_probe
+        self.train_threshold = train_threshold  # これ未満は全件厳密探索
+
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.trained_size = 0
+        self._dirty = 0
+        self._retrain_rows: Optional[List[int]] = None  # 再学習中に追加・更新された行
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def needs_retrain(self) -> bool:
+        """リストが偏り過ぎる前の再学習が必要か（学習は呼び出し側が別スレッドで行う）"""
+        count = len(self.matrix)
+        return self._retrain_rows is None and count >= self.train_threshold and count >= 4 * self.trained_size
+
+    def load(self) -> bool:
+        """永続化済みの量子化器と割り当てを行列の行に対応付けて読み込み"""
+        self.centroids = None
+        self.assignments = np.zeros(len(self.matrix), dtype=np.int32)
+        if not self.index_path.exists():
+            return False
+        try:
+            with np.load(self.index_path, allow_pickle=False) as data:
+                ids = data["ids"].tolist()
+                assignments = data["assignments"]
+                centroids = data["centroids"]
+                self.trained_size = int(data["trained_size"])
+        except Exception as e:
+            logger.error(f"Vector index load failed: {e}")
+            return False
+        if not centroids.size or centroids.shape[1] != self.matrix.dim:
+            return False
+
+        self.centroids = centroids.astype(np.float32, copy=False)
+        known = np.zeros(len(self.matrix), dtype=bool)
+        for memory_id, assignment in zip(ids, assignments):
+            row = self.matrix.id_to_row.get(memory_id)
+            if row is not None:
+                self.assignments[row] = assignment
+                known[row] = True
+        # 永続化後に追加された行のみ割り当て
+        missing = np.nonzero(~known)[0]
+        if len(missing):
+            self.assignments[missing] = self._assign_rows(missing)
+            self._dirty += len(missing)
+        return True
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty > 0
+
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        """永続化する内容の複製（追加が続いても書き出し中の内容は変わらない）"""
+        count = len(self.matrix)
+        self._dirty = 0
+        return {
+            "ids": np.array(self.matrix.ids[:count], dtype=str),
+            "assignments": self.assignments[:count].copy(),
+            "centroids": self.centroids if self.centroids is not None else np.zeros((0, 0), dtype=np.float32),
+            "trained_size": np.int64(self.trained_size),
+        }
+
+    def write(self, snapshot: Dict[str, np.ndarray]):
+        """スナップショットを一時ファイル経由で置換保存（別スレッドから呼び出し可）"""
+        tmp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **snapshot)
+        os.replace(tmp_path, self.index_path)
+
+    def save(self):
+        """インデックス永続化"""
+        self.write(self.snapshot())
+
+    def flush(self):
+        """未保存の追加・再学習分を永続化"""
+        if self._dirty:
+            self.save()
+
+    def add(self, row: int):
+        """行列に追加された行をインクリメンタルに割り当て"""
+        count = len(self.matrix)
+        if len(self.assignments) < count:
+            grown = np.zeros(max(count, 2 * len(self.assignments), 64), dtype=np.int32)
+            grown[:len(self.assignments)] = self.assignments
+            self.assignments = grown
+        # 再学習（needs_retrain）までは既存のセントロイドへ割り当てる
+        if self.trained:
+            self.assignments[row] = self._assign_rows(np.array([row]))[0]
+        if self._retrain_rows is not None:
+            self._retrain_rows.append(row)
+        # 永続化は flush()/close() 時にまとめて行う（未保存分は load() で再割り当て）
+        self._dirty += 1
+
+    def train(self, iterations: int = 10, sample_size: int = 20000):
+        """球面k-meansで粗量子化器を学習して即時に反映"""
+        self.install(*self.fit(iterations, sample_size))
+
+    def begin_retrain(self):
+        """別スレッドでの fit() 開始前に呼び、学習中に追加・更新された行を記録する"""
+        self._retrain_rows = []
+
+    def end_retrain(self) -> List[int]:
+        """学習中に追加・更新された行を返して記録を終える"""
+        rows, self._retrain_rows = self._retrain_rows or [], None
+        return rows
+
+    def install(self, centroids: Optional[np.ndarray], assignments: np.ndarray, trained_size: int):
+        """fit() の結果を反映し、学習開始後に追加・更新された行を新しいセントロイドへ割り当て直す"""
+        changed = self.end_retrain()
+        if centroids is None:
+            self.centroids = None
+            return
+        count = len(self.matrix)
+        self.centroids = centroids
+        grown = np.zeros(max(count, len(self.assignments)), dtype=np.int32)
+        grown[:trained_size] = assignments
+        self.assignments = grown
+        rows = np.union1d(np.arange(trained_size, count), np.array(changed, dtype=np.int64))
+        if len(rows):
+            self.assignments[rows] = self._assign_rows(rows)
+        self.trained_size = trained_size
+        self._dirty += 1
+        logger.info(f"Vector index trained: {trained_size} vectors, {len(centroids)} lists")
+
+    def fit(self, iterations: int = 10, sample_size: int = 20000) -> Tuple[Optional[np.ndarray], np.ndarray, int]:
+        """球面k-meansで粗量子化器を学習し (セントロイド, 全行の割り当て, 学習時の行数) を返す（別スレッドから呼び出し可）"""
+        count = len(self.matrix)
+        if count < self.train_threshold:
+            return None, np.zeros(0, dtype=np.int32), 0
+        n_lists = max(1, int(np.sqrt(count)))
+        rng = np.random.default_rng(0)
+        sample = self.matrix.row_vectors(np.sort(rng.choice(count, min(sample_size, count), replace=False)))
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for list_id in range(n_lists):
+                members = sample[labels == list_id]
+                if len(members):
+                    centroids[list_id] = members.sum(axis=0)
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids /= np.where(norms == 0, 1.0, norms)
+
+        centroids = centroids.astype(np.float32)
+        return centroids, self._assign_rows(np.arange(count), centroids), count
+
+    def _assign_rows(self, rows: np.ndarray, centroids: Optional[np.ndarray] = None, chunk_size: int = 8192) -> np.ndarray:
+        """行ごとの最近傍セントロイド割り当て"""
+        if centroids is None:
+            centroids = self.centroids
+        labels = np.empty(len(rows), dtype=np.int32)
+        for start in range(0, len(rows), chunk_size):
+            chunk = self.matrix.row_vectors(rows[start:start + chunk_size])
+            labels[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+        return labels
+
+    def candidate_rows(self, query_vector: np.ndarray) -> Optional[np.ndarray]:
+        """クエリ近傍リストに属する行（未学習ならNone = 全件）"""
+        if not self.trained:
+            return None
+        n_probe = min(self.n_probe, len(self.centroids))
+        probe_lists = np.argpartition(-(self.centroids @ query_vector), n_probe - 1)[:n_probe]
+        return np.nonzero(np.isin(self.assignments[:len(self.matrix)], probe_lists))[0]
+
+class TokenBucket:
+    """毎分 per_minute 単位を補充するトークンバケット（容量は1分量、予約で残量を借り越す）"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        """amount を引き落とし、その分が補充されるまでの待ち秒数を返す（予約順に待つ）"""
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= min(amount, self.capacity)
+        return max(0.0, -self.level / self.rate)
+
+    def adjust(self, amount: float):
+        """予約量と実績の差を精算（正なら追加引き落とし、負なら返却）"""
+        self.level = min(self.capacity, self.level - amount)
+
+class RateLimitedOpenAIClient:
+    """OpenAIクライアントの共有ラッパー（RPM/TPMトークンバケット、同時実行上限、Retry-After対応の再試行）
+
+    AsyncOpenAI と同じ形の chat.completions.create / embeddings.create を提供する。
+    429・5xx・接続エラーは Retry-After（なければ指数バックオフ＋フルジッター）だけ待って再試行し、
+    429 を受けた間は後続の呼び出しも一時停止して再送の集中を防ぐ。
+    """
+
+    def __init__(self,
+                 client,
+                 requests_per_minute: int = 500,
+                 tokens_per_minute: int = 200000,
+                 max_in_flight: int = 8,
+                 max_retries: int = 5,
+                 base_delay: float = 0.5,
+                 max_delay: float = 60.0):
+        self.client = client
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._paused_until = 0.0
+        self.pending = 0
+        self.in_flight = 0
+        self.peak_queue_depth = 0
+        self.throttled = 0
+        self._endpoint_stats: Dict[str, Dict[str, Any]] = {}
+        # AsyncOpenAI と同じ呼び出し形
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._chat_create))
+        self.embeddings = types.SimpleNamespace(create=self._embeddings_create)
+
+    @classmethod
+    def from_env(cls, client) -> "RateLimitedOpenAIClient":
+        """環境変数 O3_MEMORY_OPENAI_RPM / _TPM / _MAX_IN_FLIGHT で上限を指定"""
+        return cls(
+            client,
+            requests_per_minute=int(os.getenv("O3_MEMORY_OPENAI_RPM", 500)),
+            tokens_per_minute=int(os.getenv("O3_MEMORY_OPENAI_TPM", 200000)),
+            max_in_flight=int(os.getenv("O3_MEMORY_OPENAI_MAX_IN_FLIGHT", 8))
+        )
+
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """概算トークン数（UTF-8 4バイト≒1トークン、日本語は1文字≒0.75トークン）"""
+        return len(text.encode()) // 4 + 1
+
+    async def _chat_create(self, **kwargs):
+        prompt_tokens = sum(self._estimate_tokens(str(m.get("content", ""))) for m in kwargs.get("messages", []))
+        completion_tokens = kwargs.get("max_tokens") or kwargs.get("max_completion_tokens") or 0
+        return await self._request(
+            "chat", self.client.chat.completions.create, prompt_tokens + completion_tokens, kwargs
+        )
+
+    async def _embeddings_create(self, **kwargs):
+        inputs = kwargs.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        tokens = sum(self._estimate_tokens(text) for text in inputs if isinstance(text, str))
+        return await self._request("embeddings", self.client.embeddings.create, tokens, kwargs)
+
+    async def _request(self, endpoint: str, create: Callable, estimated_tokens: int, kwargs: Dict[str, Any]):
+        stats = self._endpoint_stats.setdefault(endpoint, {
+            "requests": 0, "retries": 0, "rate_limited": 0, "failures": 0,
+            "latencies": deque(maxlen=1000)
+        })
+        self.pending += 1
+        self.peak_queue_depth = max(self.peak_queue_depth, self.pending - self.in_flight)
+        try:
+            for attempt in range(self.max_retries + 1):
+                # 1. レート上限・429停止期間の待機
+                await self._throttle(estimated_tokens)
+
+                # 2. 同時実行数を制限して送信
+                if self._semaphore is None:
+                    self._semaphore = asyncio.Semaphore(self.max_in_flight)
+                async with self._semaphore:
+                    self.in_flight += 1
+                    started = time.monotonic()
+                    try:
+                        response = await create(**kwargs)
+                    except self._retryable_errors() as e:
+                        error = e
+                    except Exception:
+                        stats["failures"] += 1
+                        raise
+                    else:
+                        stats["requests"] += 1
+                        stats["latencies"].append(time.monotonic() - started)
+                        self._settle_tokens(response, estimated_tokens)
+                        return response
+                    finally:
+                        self.in_flight -= 1
+
+                # 3. 再試行判定（Retry-After優先、429は全体を一時停止）
+                if attempt == self.max_retries:
+                    break
+                delay = self._retry_delay(error, attempt)
+                if isinstance(error, openai.RateLimitError):
+                    stats["rate_limited"] += 1
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                stats["retries"] += 1
+                logger.warning(
+                    f"OpenAI {endpoint} request failed ({type(error).__name__}), "
+                    f"retry {attempt + 1}/{self.max_retries} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+
+            stats["failures"] += 1
+            raise error
+        finally:
+            self.pending -= 1
+
+    @staticmethod
+    def _retryable_errors() -> Tuple[type, ...]:
+        """再試行対象の例外（openai は例外発生時に初めて参照）"""
+        return (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+    async def _throttle(self, estimated_tokens: int):
+        delay = max(
+            self.request_bucket.reserve(1),
+            self.token_bucket.reserve(estimated_tokens),
+            self._paused_until - time.monotonic()
+        )
+        if delay > 0:
+            self.throttled += 1
+            await asyncio.sleep(delay)
+
+    def _settle_tokens(self, response, estimated_tokens: int):
+        """応答の usage が分かれば予約トークンを実績で精算"""
+        total_tokens = getattr(getattr(response, "usage", None), "total_tokens", None)
+        if isinstance(total_tokens, int):
+            self.token_bucket.adjust(total_tokens - estimated_tokens)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        retry_after = self._retry_after(error)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after) + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        """Retry-After / retry-after-ms ヘッダー（秒）。HTTP日付形式は無視"""
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except (TypeError, ValueError):
+            pass
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """待ち行列の深さ・同時実行数・エンドポイント別の件数と応答時間"""
+        endpoints = {}
+        for endpoint, stats in self._endpoint_stats.items():
+            latencies = np.asarray(stats["latencies"], dtype=float) * 1000
+            endpoints[endpoint] = {
+                key: value for key, value in stats.items() if key != "latencies"
+            }
+            if latencies.size:
+                endpoints[endpoint]["latency_ms"] = {
+                    "mean": round(float(latencies.mean()), 1),
+                    "p50": round(float(np.percentile(latencies, 50)), 1),
+                    "p95": round(float(np.percentile(latencies, 95)), 1),
+                }
+        return {
+            "queue_depth": self.pending - self.in_flight,
+            "peak_queue_depth": self.peak_queue_depth,
+            "in_flight": self.in_flight,
+            "throttled": self.throttled,
+            "endpoints": endpoints,
+        }
+
+class EmbeddingBackend:
+    """埋め込みバックエンド基底（短時間に集まった要求を1回のバッチ符号化へ集約）
+
+    サブクラスは model・dim・cacheable・min_similarity を定義し、_encode(texts) を実装する。
+    """
+
+    model = ""
+    dim = 0  # 0 = 不明
+    cacheable = True  # 内容ハッシュキャッシュを使うか（高コストなリモート計算向け）
+    min_similarity = 0.7  # 関連記憶検索で候補とするコサイン類似度の下限（OpenAI埋め込みで調整）
+
+    def __init__(self, max_batch_size: int = 256, max_delay: float = 0.005):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay  # 秒
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    async def embed(self, text: str) -> List[float]:
+        """1件分の埋め込み（同時期の要求とまとめて符号化）"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """複数件の埋め込み（入力順）"""
+        return list(await asyncio.gather(*[self.embed(text) for text in texts]))
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._send(batch))
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]):
+        """まとめて符号化し結果を各呼び出し元へ振り分け"""
+        try:
+            embeddings = await self._encode([text for text, _ in batch])
+            if len(embeddings) != len(batch):
+                raise RuntimeError(f"Embedding count mismatch: {len(embeddings)} != {len(batch)}")
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def _encode(self, texts: List[str]) -> List[Any]:
+        raise NotImplementedError
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """OpenAI埋め込みAPI（集約した要求をリスト入力1リクエストで送信）"""
+
+    MODEL_DIMENSIONS = {
+        "text-embedding-3-small": 1536,
+        "text-embedding-3-large": 3072,
+        "text-embedding-ada-002": 1536,
+    }
+
+    def __init__(self,
+                 client,
+                 model: str = "text-embedding-3-small",
+                 max_batch_size: int = 256,
+                 max_delay: float = 0.005):
+        super().__init__(max_batch_size, max_delay)
+        self.client = client
+        self.model = model
+        self.dim = self.MODEL_DIMENSIONS.get(model, 0)
+
+    async def _encode(self, texts: List[str]) -> List[List[float]]:
+        response = await self.client.embeddings.create(model=self.model, input=texts)
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        for item in response.data:
+            embeddings[item.index] = item.embedding
+        if any(embedding is None for embedding in embeddings):
+            raise RuntimeError("Embedding missing from batch response")
+        return embeddings
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """ローカル決定的埋め込み（文字n-gramの特徴ハッシュ、ネットワーク・学習不要）
+
+    意味ではなく表記の重なりを捉える。分かち書き不要のため日本語もそのまま扱える。
+    """
+
+    cacheable = False  # 符号化の方がキャッシュ参照より速い
+    # 表記の重なりのみのため類似度は低めに出る（関連文は0.3〜0.7程度、無関係な英文同士でも0.1〜0.2）
+    min_similarity = 0.2
+
+    def __init__(self,
+                 dim: int = 512,
+                 ngram_range: Tuple[int, int] = (2, 4),
+                 max_batch_size: int = 1024,
+                 max_delay: float = 0.005):
+        super().__init__(max_batch_size, max_delay)
+        self.dim = dim
+        self.model = f"local-hashing-{dim}"
+        from sklearn.feature_extraction.text import HashingVectorizer
+        self.vectorizer = HashingVectorizer(
+            analyzer="char_wb",
+            ngram_range=ngram_range,
+            n_features=dim,
+            alternate_sign=True,
+            norm="l2"
+        )
+
+    def encode_batch(self, texts: List[str]) -> np.ndarray:
+        """(n, dim) のfloat32行列（同期・ベクトル化）"""
+        return self.vectorizer.transform(texts).astype(EMBEDDING_DTYPE).toarray()
+
+    async def _encode(self, texts: List[str]) -> List[np.ndarray]:
+        return list(await asyncio.to_thread(self.encode_batch, texts))
+
+# バックエンド名 → 生成関数（openai_client を受け取る）
+EMBEDDING_BACKENDS: Dict[str, Callable[[Any], EmbeddingBackend]] = {
+    "openai": lambda client: OpenAIEmbeddingBackend(client),
+    "local": lambda client: HashingEmbeddingBackend(),
+}
+
+class EmbeddingCache:
+    """内容ハッシュ→埋め込みの永続LRUキャッシュ（モデル名別、priority-cache配下）
+
+    LLMResponseCache と同様に書き込みは MemoryDatabase の書き込みスレッドでまとめてコミットする。
+    """
+
+    def __init__(self, db_path: Path, max_entries: int = 50000, evict_every: int = 256):
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._touched: Dict[str, float] = {}
+        self.db = MemoryDatabase(db_path, read_pool_size=1)
+        self.db.submit(self._create_schema).result()
+
+    @staticmethod
+    def _create_schema(conn: sqlite3.Connection):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                embedding BLOB,
+                last_used REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_lru ON embedding_cache(last_used)")
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode()).hexdigest()
+
+    async def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        """キャッシュ参照（ヒット時は最終利用時刻を更新予約）"""
+        key = self.make_key(model, text)
+        row = await self.db.fetchone("SELECT embedding FROM embedding_cache WHERE key = ?", (key,))
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched[key] = time.time()
+        return decode_embedding(row[0])
+
+    def put(self, model: str, text: str, embedding):
+        """キャッシュ登録を書き込みスレッドへ投入（一定件数ごとにLRU追い出し）"""
+        blob = encode_embedding(embedding)
+        if blob is None:
+            return
+        params = (self.make_key(model, text), model, blob, time.time())
+        self._submit(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO embedding_cache (key, model, embedding, last_used) VALUES (?, ?, ?, ?)",
+            params
+        ))
+        self._puts += 1
+        if self._puts % self.evict_every == 0:
+            self.evict()
+
+    def _submit(self, fn: Callable[[sqlite3.Connection], Any]) -> concurrent.futures.Future:
+        future = self.db.submit(fn)
+        future.add_done_callback(
+            lambda f: f.exception() and logger.error(f"Embedding cache write failed: {f.exception()}")
+        )
+        return future
+
+    def flush(self) -> Optional[concurrent.futures.Future]:
+        """最終利用時刻の更新を書き込みスレッドへ投入"""
+        if not self._touched:
+            return None
+        params = [(last_used, key) for key, last_used in self._touched.items()]
+        self._touched = {}
+        return self._submit(lambda conn: conn.executemany(
+            "UPDATE embedding_cache SET last_used = ? WHERE key = ?", params
+        ))
+
+    def evict(self) -> concurrent.futures.Future:
+        """最終利用が古いものから上限超過分の削除を投入（結果は削除件数）"""
+        self.flush()
+        return self._submit(self._evict)
+
+    def _evict(self, conn: sqlite3.Connection) -> int:
+        count = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return 0
+        conn.execute("""
+            DELETE FROM embedding_cache WHERE key IN (
+                SELECT key FROM embedding_cache ORDER BY last_used ASC LIMIT ?
+            )
+        """, (excess,))
+        return excess
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+class LLMResponseCache:
+    """プロンプトハッシュ→応答の永続キャッシュ（TTL・LRU上限付き、o3-insights配下）
+
+    書き込みは MemoryDatabase の書き込みスレッドへ投入してグループコミットし、
+    イベントループ上ではコミットしない。ヒット時の最終利用時刻は追い出し時にまとめて反映する。
+    """
+
+    def __init__(self,
+                 db_path: Path,
+                 ttl: float = 7 * 24 * 3600,
+                 max_entries: int = 5000,
+                 evict_every: int = 64):
+        self.ttl = ttl  # 秒
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._touched: Dict[str, float] = {}
+        self.db = MemoryDatabase(db_path, read_pool_size=1)
+        self.db.submit(self._create_schema).result()
+
+    @staticmethod
+    def _create_schema(conn: sqlite3.Connection):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_response_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                created REAL,
+                last_used REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_response_cache_lru ON llm_response_cache(last_used)")
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], max_tokens: int) -> str:
+        payload = json.dumps([model, max_tokens, messages], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get(self, model: str, messages: List[Dict[str, str]], max_tokens: int) -> Optional[str]:
+        """有効期限内の応答を返す（期限切れはミス扱い、削除は evict で行う）"""
+        key = self.make_key(model, messages, max_tokens)
+        row = await self.db.fetchone(
+            "SELECT response, created FROM llm_response_cache WHERE key = ?", (key,)
+        )
+        now = time.time()
+        if row is None or now - row[1] > self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched[key] = now
+        return row[0]
+
+    def put(self, model: str, messages: List[Dict[str, str]], max_tokens: int, response: str):
+        """応答登録を書き込みスレッドへ投入（一定件数ごとに期限切れ・上限超過分を追い出し）"""
+        now = time.time()
+        params = (self.make_key(model, messages, max_tokens), model, response, now, now)
+        self._submit(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO llm_response_cache (key, model, response, created, last_used) VALUES (?, ?, ?, ?, ?)",
+            params
+        ))
+        self._puts += 1
+        if self._puts % self.evict_every == 0:
+            self.evict()
+
+    def discard(self, model: str, messages: List[Dict[str, str]], max_tokens: int):
+        """応答の削除を書き込みスレッドへ投入（検証に失敗した応答用）"""
+        key = self.make_key(model, messages, max_tokens)
+        self._touched.pop(key, None)
+        self._submit(lambda conn: conn.execute("DELETE FROM llm_response_cache WHERE key = ?", (key,)))
+
+    def _submit(self, fn: Callable[[sqlite3.Connection], Any]) -> concurrent.futures.Future:
+        future = self.db.submit(fn)
+        future.add_done_callback(
+            lambda f: f.exception() and logger.error(f"LLM response cache write failed: {f.exception()}")
+        )
+        return future
+
+    def flush(self) -> Optional[concurrent.futures.Future]:
+        """ヒットした応答の最終利用時刻更新を書き込みスレッドへ投入"""
+        if not self._touched:
+            return None
+        params = [(last_used, key) for key, last_used in self._touched.items()]
+        self._touched = {}
+        return self._submit(lambda conn: conn.executemany(
+            "UPDATE llm_response_cache SET last_used = ? WHERE key = ?", params
+        ))
+
+    def evict(self) -> concurrent.futures.Future:
+        """期限切れと、最終利用が古いものから上限超過分の削除を投入（結果は削除件数）"""
+        self.flush()
+        return self._submit(self._evict)
+
+    def _evict(self, conn: sqlite3.Connection) -> int:
+        expired = conn.execute(
+            "DELETE FROM llm_response_cache WHERE created < ?", (time.time() - self.ttl,)
+        ).rowcount
+        count = conn.execute("SELECT COUNT(*) FROM llm_response_cache").fetchone()[0]
+        excess = max(0, count - self.max_entries)
+        if excess:
+            conn.execute("""
+                DELETE FROM llm_response_cache WHERE key IN (
+                    SELECT key FROM llm_response_cache ORDER BY last_used ASC LIMIT ?
+                )
+            """, (excess,))
+        return expired + excess
+
+    async def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        entries = await self.db.fetchone("SELECT COUNT(*) FROM llm_response_cache")
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries[0],
+        }
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+class ImportanceClassifier:
+    """o3判定結果から学習するローカル重要度分類器（文字n-gramハッシュ + ロジスティック回帰）
+
+    確信度が閾値以上ならローカル判定を採用し、それ以外はo3へ委譲する。
+    """
+
+    def __init__(self,
+                 confidence_threshold: float = 0.8,
+                 min_samples: int = 50,
+                 retrain_every: int = 100,
+                 audit_rate: float = 0.05):
+        self.confidence_threshold = confidence_threshold
+        self.min_samples = min_samples
+        self.retrain_every = retrain_every
+        self.audit_rate = audit_rate  # 確信時もo3で検証する割合（一致率計測用）
+        self._vectorizer = None
+        self.model: Optional[LogisticRegression] = None
+        self.training_samples = 0
+        self.new_samples = 0
+        # 運用指標
+        self.local_hits = 0
+        self.escalations = 0  # 実際にo3を呼んだ委譲のみ
+        self.cached_escalations = 0  # 応答キャッシュで済んだ委譲
+        self.compared = 0
+        self.agreed = 0
+        self.audited = 0
+        self.audit_agreed = 0
+
+    @property
+    def trained(self) -> bool:
+        return self.model is not None
+
+    @property
+    def vectorizer(self):
+        """文字n-gramハッシュ特徴（scikit-learn は初回の学習・推論時に読み込む）"""
+        if self._vectorizer is None:
+            from sklearn.feature_extraction.text import HashingVectorizer
+            self._vectorizer = HashingVectorizer(
+                analyzer="char_wb", ngram_range=(1, 3), n_features=2 ** 16, alternate_sign=False, norm="l2"
+            )
+        return self._vectorizer
+
+    @staticmethod
+    def _document(content: str, context_type: str) -> str:
+        return f"[{context_type}] {content}"
+
+    def fit(self, samples: List[Tuple[str, str, int]]) -> Optional[LogisticRegression]:
+        """(content, context_type, importance) から学習したモデル（件数・クラス不足ならNone）"""
+        if len(samples) < self.min_samples or len({label for _, _, label in samples}) < 2:
+            return None
+        from sklearn.linear_model import LogisticRegression
+        features = self.vectorizer.transform([self._document(c, t) for c, t, _ in samples])
+        model = LogisticRegression(max_iter=300, C=4.0)
+        model.fit(features, [label for _, _, label in samples])
+        return model
+
+    def train(self, samples: List[Tuple[str, str, int]]) -> bool:
+        model = self.fit(samples)
+        if model is None:
+            return False
+        self.model = model
+        self.training_samples = len(samples)
+        self.new_samples = 0
+        return True
+
+    def predict(self, content: str, context_type: str) -> Optional[Tuple[MemoryImportance, float]]:
+        """(重要度, 確信度)（未学習ならNone）"""
+        if self.model is None:
+            return None
+        probabilities = self.model.predict_proba(self.vectorizer.transform([self._document(content, context_type)]))[0]
+        best = int(np.argmax(probabilities))
+        return MemoryImportance(int(self.model.classes_[best])), float(probabilities[best])
+
+    def evaluate(self, samples: List[Tuple[str, str, int]], holdout_every: int = 5) -> Dict[str, Any]:
+        """5件に1件を検証用に分けた、確信判定の被覆率・正解率"""
+        train = [sample for i, sample in enumerate(samples) if i % holdout_every]
+        holdout = [sample for i, sample in enumerate(samples) if not i % holdout_every]
+        model = self.fit(train)
+        if model is None or not holdout:
+            return {"samples": len(samples), "evaluated": False}
+        probabilities = model.predict_proba(self.vectorizer.transform([self._document(c, t) for c, t, _ in holdout]))
+        predicted = model.classes_[probabilities.argmax(axis=1)]
+        labels = np.array([label for _, _, label in holdout])
+        confident = probabilities.max(axis=1) >= self.confidence_threshold
+        return {
+            "samples": len(samples),
+            "evaluated": True,
+            "holdout": len(holdout),
+            "accuracy": float((predicted == labels).mean()),
+            "confident_coverage": float(confident.mean()),
+            "confident_accuracy": float((predicted[confident] == labels[confident]).mean()) if confident.any() else None,
+        }
+
+    def record_comparison(self, local: MemoryImportance, remote: MemoryImportance, audit: bool):
+        self.compared += 1
+        self.agreed += local == remote
+        if audit:
+            self.audited += 1
+            self.audit_agreed += local == remote
+
+    def stats(self) -> Dict[str, Any]:
+        decisions = self.local_hits + self.escalations + self.cached_escalations
+        return {
+            "trained": self.trained,
+            "training_samples": self.training_samples,
+            "local_hits": self.local_hits,
+            "escalations": self.escalations,
+            "cached_escalations": self.cached_escalations,
+            "hit_rate": self.local_hits / decisions if decisions else 0.0,
+            "agreement": self.agreed / self.compared if self.compared else None,
+            "confident_agreement": self.audit_agreed / self.audited if self.audited else None,
+        }
+
+class MemoryArchive:
+    """低温記憶のアーカイブDB（本文・埋め込みをzlib圧縮、contentless FTS5で検索可能）"""
+
+    # MEMORY_COLUMNS に続くアーカイブ行の列
+    STAT_COLUMNS = ("access_count", "last_accessed", "relevance_score")
+
+    def __init__(self, db_path: Path):
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS archived_memories (
+                id TEXT PRIMARY KEY,
+                session_id TEXT,
+                timestamp TEXT,
+                importance INTEGER,
+                context_type TEXT,
+                ai_source TEXT,
+                access_count INTEGER,
+                last_accessed TEXT,
+                relevance_score REAL,
+                archived_at TEXT,
+                payload BLOB,
+                embedding BLOB
+            )
+        """)
+        try:
+            # 本文は圧縮payloadにのみ保持し、索引だけを持つ
+            self.conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS archived_memories_fts USING fts5(
+                    content, keywords, content='', tokenize='trigram'
+                )
+            """)
+            self.fulltext = True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Archive full-text index unavailable: {e}")
+            self.fulltext = False
+        if self.fulltext:
+            self._reindex_if_empty()
+        self.conn.commit()
+
+    def _reindex_if_empty(self, batch_size: int = 1000):
+        """索引が空でアーカイブ行がある場合（エクスポートからの復元直後）に圧縮本文から再索引"""
+        indexed = self.conn.execute("SELECT 1 FROM archived_memories_fts LIMIT 1").fetchone()
+        if indexed or not self.conn.execute("SELECT 1 FROM archived_memories LIMIT 1").fetchone():
+            return
+        last_rowid, total = 0, 0
+        while True:
+            rows = self.conn.execute("""
+                SELECT rowid, payload FROM archived_memories WHERE rowid > ? ORDER BY rowid LIMIT ?
+            """, (last_rowid, batch_size)).fetchall()
+            if not rows:
+                break
+            self.conn.executemany(
+                "INSERT INTO archived_memories_fts (rowid, content, keywords) VALUES (?, ?, ?)",
+                [(rowid, *self._unpack(payload)) for rowid, payload in rows]
+            )
+            last_rowid = rows[-1][0]
+            total += len(rows)
+        logger.info(f"Archive full-text index rebuilt: {total} memories")
+
+    @staticmethod
+    def _pack(content: str, keywords: str) -> bytes:
+        return zlib.compress(json.dumps([content, keywords], ensure_ascii=False).encode(), 6)
+
+    @staticmethod
+    def _unpack(payload: bytes) -> Tuple[str, str]:
+        content, keywords = json.loads(zlib.decompress(payload))
+        return content, keywords
+
+    def add(self, rows: List[Tuple]):
+        """MEMORY_COLUMNS + STAT_COLUMNS 順の行を圧縮して格納（同一IDは置換）"""
+        self.remove([row[0] for row in rows], commit=False)
+        archived_at = datetime.now().isoformat()
+        with self._lock:
+            for row in rows:
+                values = dict(zip(MEMORY_COLUMNS + self.STAT_COLUMNS, row))
+                embedding = values["embedding"]
+                if isinstance(embedding, str):
+                    embedding = encode_embedding(decode_embedding(embedding))
+                cursor = self.conn.execute("""
+                    INSERT INTO archived_memories
+                    (id, session_id, timestamp, importance, context_type, ai_source,
+                     access_count, last_accessed, relevance_score, archived_at, payload, embedding)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    values["id"], values["session_id"], values["timestamp"], values["importance"],
+                    values["context_type"], values["ai_source"], values["access_count"],
+                    values["last_accessed"], values["relevance_score"], archived_at,
+                    self._pack(values["content"], values["keywords"]),
+                    zlib.compress(embedding) if embedding else None
+                ))
+                if self.fulltext:
+                    self.conn.execute(
+                        "INSERT INTO archived_memories_fts (rowid, content, keywords) VALUES (?, ?, ?)",
+                        (cursor.lastrowid, values["content"], values["keywords"])
+                    )
+            self.conn.commit()
+
+    def remove(self, memory_ids: List[str], commit: bool = True):
+        """アーカイブから削除（contentless索引は元の本文を渡して削除）"""
+        with self._lock:
+            for start in range(0, len(memory_ids), 500):
+                chunk = memory_ids[start:start + 500]
+                rows = self.conn.execute(f"""
+                    SELECT rowid, payload FROM archived_memories
+                    WHERE id IN ({','.join(['?'] * len(chunk))})
+                """, chunk).fetchall()
+                for rowid, payload in rows:
+                    if self.fulltext:
+                        content, keywords = self._unpack(payload)
+                        self.conn.execute("""
+                            INSERT INTO archived_memories_fts (archived_memories_fts, rowid, content, keywords)
+                            VALUES ('delete', ?, ?, ?)
+                        """, (rowid, content, keywords))
+                    self.conn.execute("DELETE FROM archived_memories WHERE rowid = ?", (rowid,))
+            if commit:
+                self.conn.commit()
+
+    def get(self, memory_ids: List[str]) -> List[Tuple]:
+        """MEMORY_COLUMNS + STAT_COLUMNS 順の行（展開済み）"""
+        results = []
+        with self._lock:
+            for start in range(0, len(memory_ids), 500):
+                chunk = memory_ids[start:start + 500]
+                results.extend(self._expand(row) for row in self.conn.execute(f"""
+                    SELECT id, session_id, timestamp, payload, importance, context_type, embedding, ai_source,
+                           access_count, last_accessed, relevance_score
+                    FROM archived_memories WHERE id IN ({','.join(['?'] * len(chunk))})
+                """, chunk))
+        return results
+
+    def _expand(self, row: Tuple) -> Tuple:
+        (memory_id, session_id, timestamp, payload, importance, context_type, embedding, ai_source,
+         access_count, last_accessed, relevance_score) = row
+        content, keywords = self._unpack(payload)
+        return (memory_id, session_id, timestamp, content, importance, keywords, context_type,
+                zlib.decompress(embedding) if embedding else None, ai_source,
+                access_count, last_accessed, relevance_score)
+
+    def search(self,
+               match_expression: Optional[str],
+               query_vector: Optional[np.ndarray],
+               k: int,
+               session_id: str = None,
+               importance_values: List[int] = None,
+               alpha: float = 0.5,
+               min_score: float = 0.0) -> List[Tuple[str, float]]:
+        """オンデマンド検索: BM25（全文索引）＋全件コサイン類似度の融合スコアが min_score を超える上位k件
+
+        alpha=1.0 ではコサイン類似度のみ（全文索引は引かない）。
+        """
+        conditions, params = [], []
+        if session_id is not None:
+            conditions.append("a.session_id = ?")
+            params.append(session_id)
+        if importance_values:
+            conditions.append(f"a.importance IN ({','.join(['?'] * len(importance_values))})")
+            params.extend(importance_values)
+
+        lexical: Dict[str, float] = {}
+        vector: Dict[str, float] = {}
+        with self._lock:
+            if match_expression and self.fulltext and (alpha < 1.0 or query_vector is None):
+                rows = self.conn.execute(f"""
+                    SELECT a.id, -bm25(archived_memories_fts) AS score
+                    FROM archived_memories_fts JOIN archived_memories a ON a.rowid = archived_memories_fts.rowid
+                    WHERE {' AND '.join(['archived_memories_fts MATCH ?'] + conditions)}
+                    ORDER BY score DESC LIMIT ?
+                """, [match_expression] + params + [max(k * 5, 50)]).fetchall()
+                max_score = max((score for _, score in rows), default=0.0) or 1.0
+                lexical = {memory_id: score / max_score for memory_id, score in rows}
+            if query_vector is not None:
+                for memory_id, embedding in self.conn.execute(f"""
+                    SELECT a.id, a.embedding FROM archived_memories a
+                    WHERE a.embedding IS NOT NULL {''.join(' AND ' + c for c in conditions)}
+                """, params):
+                    vector_embedding = np.frombuffer(zlib.decompress(embedding), dtype=EMBEDDING_DTYPE)
+                    if vector_embedding.shape == query_vector.shape:
+                        norm = np.linalg.norm(vector_embedding)
+                        if norm:
+                            vector[memory_id] = float(vector_embedding @ query_vector / norm)
+
+        if query_vector is None:
+            alpha = 0.0
+        fused = {
+            memory_id: alpha * max(vector.get(memory_id, 0.0), 0.0) + (1 - alpha) * lexical.get(memory_id, 0.0)
+            for memory_id in set(lexical) | set(vector)
+        }
+        matches = [(memory_id, score) for memory_id, score in fused.items() if score > min_score]
+        return sorted(matches, key=lambda item: item[1], reverse=True)[:k]
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM archived_memories").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+class MemoryDatabase:
+    """SQLiteアクセス層（専用書き込みスレッド + 読み取り接続プール、awaitable API）
+
+    書き込みは単一スレッドが件数・経過時間の閾値でまとめてコミットし（グループコミット）、
+    呼び出し元のFutureはコミット確定後に完了する。読み取りはスレッド毎の接続で並行実行する。
+    """
+
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self,
+                 db_path: Path,
+                 read_pool_size: int = 4,
+                 max_batch: int = 100,
+                 max_delay: float = 0.005):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.max_delay = max_delay  # 秒
+        self._write_queue: "queue.Queue" = queue.Queue()
+        self._read_executor = ThreadPoolExecutor(
+            max_workers=read_pool_size, thread_name_prefix="memory-db-read"
+        )
+        self._local = threading.local()
+        self._read_connections: List[sqlite3.Connection] = []
+        self._read_connections_lock = threading.Lock()
+        self._writer_thread = threading.Thread(
+            target=self._writer_loop, name="memory-db-writer", daemon=True
+        )
+        self._writer_thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+        # 新規DBはアーカイブ後の空き領域を incremental_vacuum で返却できるようにする（WAL化より前に設定）
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WALで書き込み中も読み取りをブロックしない（fsyncはチェックポイント時のみ）
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # INSERT OR REPLACE の暗黙削除でもDELETEトリガー（全文検索索引の同期）を発火させる
+        conn.execute("PRAGMA recursive_triggers=ON")
+        return conn
+
+    # --- 書き込み（専用スレッド） ---
+
+    def submit(self, fn: Callable[[sqlite3.Connection], Any]) -> concurrent.futures.Future:
+        """書き込みスレッドで fn(conn) を実行（コミット後に結果確定）"""
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._write_queue.put((fn, future))
+        return future
+
+    async def run_write(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        return await asyncio.wrap_future(self.submit(fn))
+
+    async def execute(self, sql: str, params=()) -> int:
+        return await self.run_write(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def executemany(self, sql: str, seq_of_params) -> int:
+        params = list(seq_of_params)
+        return await self.run_write(lambda conn: conn.executemany(sql, params).rowcount)
+
+    async def flush(self):
+        """保留中の書き込みをコミット"""
+        await self.run_write(self._FLUSH)
+
+    def _writer_loop(self):
+        conn = self._connect()
+        pending: List[Tuple[concurrent.futures.Future, Any]] = []
+        deadline = 0.0
+        while True:
+            try:
+                timeout = max(0.0, deadline - time.monotonic()) if pending else None
+                fn, future = self._write_queue.get(timeout=timeout)
+            except queue.Empty:
+                self._commit(conn, pending)
+                continue
+
+            if fn is self._STOP:
+                self._commit(conn, pending)
+                future.set_result(None)
+                break
+            if fn is self._FLUSH:
+                self._commit(conn, pending)
+                future.set_result(None)
+                continue
+
+            try:
+                result = self._run_in_savepoint(conn, fn)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+                continue
+            if not pending:
+                deadline = time.monotonic() + self.max_delay
+            pending.append((future, result))
+            if len(pending) >= self.max_batch:
+                self._commit(conn, pending)
+        conn.close()
+
+    @staticmethod
+    def _run_in_savepoint(conn: sqlite3.Connection, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """fn(conn) をセーブポイント内で実行し、例外時はその操作の途中までの変更のみ取り消す
+
+        同じバッチの他の操作は残してまとめてコミットする。読み取り後の書き込みで
+        スナップショット競合にならないよう、トランザクションは書き込みロックを取って開始する。
+        """
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        conn.execute("SAVEPOINT memory_write")
+        try:
+            result = fn(conn)
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK TO memory_write")
+                conn.execute("RELEASE memory_write")
+            raise
+        # fn 内で確定済み（VACUUM前のコミット等）ならセーブポイントは残っていない
+        if conn.in_transaction:
+            conn.execute("RELEASE memory_write")
+        return result
+
+    @staticmethod
+    def _commit(conn: sqlite3.Connection, pending: List[Tuple[concurrent.futures.Future, Any]]):
+        if not pending:
+            return
+        try:
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            for future, _ in pending:
+                if not future.cancelled():
+                    future.set_exception(e)
+        else:
+            # 待機側のタスクが取り消された書き込みは結果を通知しない
+            for future, result in pending:
+                if not future.cancelled():
+                    future.set_result(result)
+        pending.clear()
+
+    # --- 読み取り（接続プール） ---
+
+    def _connect_reader(self) -> sqlite3.Connection:
+        conn = self._connect()
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def _read_connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect_reader()
+            self._local.conn = conn
+            with self._read_connections_lock:
+                self._read_connections.append(conn)
+        return conn
+
+    def _run_read(self, fn: Callable, args: Tuple) -> Any:
+        return fn(self._read_connection(), *args)
+
+    async def read(self, fn: Callable, *args) -> Any:
+        """読み取りスレッドで fn(conn, *args) を実行"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, self._run_read, fn, args)
+
+    async def fetchall(self, sql: str, params=(), row_factory: Callable = None) -> List[Any]:
+        def query(conn):
+            rows = conn.execute(sql, params).fetchall()
+            return [row_factory(row) for row in rows] if row_factory else rows
+        return await self.read(query)
+
+    async def fetchone(self, sql: str, params=()) -> Optional[Tuple]:
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def iterate(self,
+                      sql: str,
+                      params=(),
+                      row_factory: Callable = None,
+                      batch_size: int = 256) -> AsyncIterator[Any]:
+        """カーソルを batch_size 件ずつ読み進めるストリーミング取得
+
+        反復中は専用の読み取り接続を保持する（プール接続を長時間占有しない）。
+        """
+        loop = asyncio.get_running_loop()
+        conn = await loop.run_in_executor(self._read_executor, self._connect_reader)
+        try:
+            cursor = await loop.run_in_executor(self._read_executor, conn.execute, sql, params)
+            while True:
+                rows = await loop.run_in_executor(self._read_executor, cursor.fetchmany, batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row_factory(row) if row_factory else row
+        finally:
+            conn.close()
+
+    def close(self):
+        """書き込み確定後にスレッド・接続を終了"""
+        if self._writer_thread.is_alive():
+            self.submit(self._STOP).result()
+            self._writer_thread.join()
+        self._read_executor.shutdown(wait=True)
+        with self._read_connections_lock:
+            for conn in self._read_connections:
+                conn.close()
+            self._read_connections.clear()
+
+def _migrate_vector_offset_column(conn: sqlite3.Connection):
+    """v1: サイドカー行オフセット列"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(enhanced_memories)")}
+    if "vector_offset" not in columns:
+        conn.execute("ALTER TABLE enhanced_memories ADD COLUMN vector_offset INTEGER")
+
+def _migrate_query_indexes(conn: sqlite3.Connection):
+    """v2: 主要クエリ用の複合インデックス"""
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_enhanced_memories_session_importance
+        ON enhanced_memories(session_id, importance, timestamp)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_enhanced_memories_context_type
+        ON enhanced_memories(context_type, timestamp)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_enhanced_memories_importance
+        ON enhanced_memories(importance, timestamp)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_enhanced_memories_timestamp
+        ON enhanced_memories(timestamp)
+    """)
+
+def _migrate_fulltext_index(conn: sqlite3.Connection):
+    """v3: content・keywordsの全文検索索引（FTS5 trigram、トリガー同期）"""
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS enhanced_memories_fts USING fts5(
+                content, keywords,
+                content='enhanced_memories', content_rowid='rowid',
+                tokenize='trigram'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        # FTS5/trigram非対応のSQLite（3.34未満）ではベクトル検索のみで動作
+        logger.warning(f"Full-text index unavailable: {e}")
+        return
+
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS enhanced_memories_fts_insert
+        AFTER INSERT ON enhanced_memories BEGIN
+            INSERT INTO enhanced_memories_fts(rowid, content, keywords)
+            VALUES (new.rowid, new.content, new.keywords);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS enhanced_memories_fts_delete
+        AFTER DELETE ON enhanced_memories BEGIN
+            INSERT INTO enhanced_memories_fts(enhanced_memories_fts, rowid, content, keywords)
+            VALUES ('delete', old.rowid, old.content, old.keywords);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS enhanced_memories_fts_update
+        AFTER UPDATE OF content, keywords ON enhanced_memories BEGIN
+            INSERT INTO enhanced_memories_fts(enhanced_memories_fts, rowid, content, keywords)
+            VALUES ('delete', old.rowid, old.content, old.keywords);
+            INSERT INTO enhanced_memories_fts(rowid, content, keywords)
+            VALUES (new.rowid, new.content, new.keywords);
+        END
+    """)
+    # 既存記憶を索引化
+    conn.execute("INSERT INTO enhanced_memories_fts(enhanced_memories_fts) VALUES ('rebuild')")
+
+def _migrate_importance_learning_context(conn: sqlite3.Connection):
+    """v4: 重要度学習データの文脈種別列"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(importance_learning)")}
+    if "context_type" not in columns:
+        conn.execute("ALTER TABLE importance_learning ADD COLUMN context_type TEXT")
+
+def _migrate_startup_snapshot(conn: sqlite3.Connection):
+    """v5: 起動時コンテキストのスナップショットと記憶更新バージョン"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS memory_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO memory_state (id, version) VALUES (1, 0)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS startup_snapshot (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            source_session_id TEXT,
+            memory_version INTEGER,
+            context TEXT,
+            inherited_memories TEXT,
+            created_at TEXT
+        )
+    """)
+    # 起動時コンテキストに影響する変更でバージョンを進める（スナップショット無効化）
+    for name, event in [
+        ("memory_state_insert", "INSERT ON enhanced_memories"),
+        ("memory_state_update", "UPDATE OF session_id, timestamp, content, importance, context_type ON enhanced_memories"),
+        ("memory_state_delete", "DELETE ON enhanced_memories"),
+        ("memory_state_collaboration", "INSERT ON ai_collaborations"),
+    ]:
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {name}
+            AFTER {event} BEGIN
+                UPDATE memory_state SET version = version + 1 WHERE id = 1;
+            END
+        """)
+
+def _migrate_session_summaries(conn: sqlite3.Connection):
+    """v6: セッション別ローリング要約（要約済み行の位置を保持）"""
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_enhanced_memories_session
+        ON enhanced_memories(session_id)
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS session_summaries (
+            session_id TEXT PRIMARY KEY,
+            summary TEXT,
+            summarized_rowid INTEGER,
+            memory_count INTEGER,
+            updated_at TEXT
+        )
+    """)
+
+def _migrate_near_duplicate_index(conn: sqlite3.Connection, batch_size: int = 1000):
+    """v7: 近似重複検出用MinHash署名とLSHバケット（既存記憶も署名付与）"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(enhanced_memories)")}
+    if "minhash" not in columns:
+        conn.execute("ALTER TABLE enhanced_memories ADD COLUMN minhash BLOB")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS memory_lsh_buckets (
+            bucket INTEGER,
+            memory_id TEXT,
+            PRIMARY KEY (bucket, memory_id)
+        ) WITHOUT ROWID
+    """)
+    last_rowid = 0
+    while True:
+        rows = conn.execute("""
+            SELECT rowid, id, content FROM enhanced_memories
+            WHERE minhash IS NULL AND rowid > ?
+            ORDER BY rowid LIMIT ?
+        """, (last_rowid, batch_size)).fetchall()
+        if not rows:
+            break
+        for _, memory_id, content in rows:
+            signature = MINHASH_LSH.signature(content or "")
+            conn.execute("UPDATE enhanced_memories SET minhash = ? WHERE id = ?", (signature.tobytes(), memory_id))
+            MINHASH_LSH.store(conn, memory_id, signature)
+        last_rowid = rows[-1][0]
+
+def _migrate_vector_generation(conn: sqlite3.Connection):
+    """v8: ベクトルサイドカーの世代番号（圧縮時に進め、他プロセスの再読み込みを促す）"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(memory_state)")}
+    if "vector_generation" not in columns:
+        conn.execute("ALTER TABLE memory_state ADD COLUMN vector_generation INTEGER NOT NULL DEFAULT 0")
+
+def _migrate_vector_change_log(conn: sqlite3.Connection):
+    """v9: ベクトル登録の変更ログ（他プロセスが保存した記憶を検索時に差分で取り込む）"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS vector_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            memory_id TEXT NOT NULL
+        )
+    """)
+    for name, event in [
+        ("vector_changes_insert", "INSERT ON enhanced_memories"),
+        ("vector_changes_update", "UPDATE OF vector_offset, importance, session_id ON enhanced_memories"),
+    ]:
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {name}
+            AFTER {event} WHEN new.vector_offset IS NOT NULL BEGIN
+                INSERT INTO vector_changes (memory_id) VALUES (new.id);
+            END
+        """)
+
+# スキーマバージョン管理（PRAGMA user_version = 適用済みマイグレーション数）
+SCHEMA_MIGRATIONS: List[Callable[[sqlite3.Connection], None]] = [
+    _migrate_vector_offset_column,
+    _migrate_query_indexes,
+    _migrate_fulltext_index,
+    _migrate_importance_learning_context,
+    _migrate_startup_snapshot,
+    _migrate_session_summaries,
+    _migrate_near_duplicate_index,
+    _migrate_vector_generation,
+    _migrate_vector_change_log,
+]
+
 class O3EnhancedMemorySystem:
     """o3 API統合記憶システム"""
     
     def __init__(self, 
-                 base_path: str = "/Users/dd/Desktop/1_dev/coding-rule2/memory/enhanced",
-                 openai_api_key: str = None):
+                 base_path: str = DEFAULT_BASE_PATH,
+                 openai_api_key: str = None,
+                 embedding_backend=None,
+                 dedupe_threshold: Optional[float] = 0.8,
+                 openai_client=None):
+        """embedding_backend: EmbeddingBackend インスタンスまたは EMBEDDING_BACKENDS のキー
+        （未指定時は環境変数 O3_MEMORY_EMBEDDING_BACKEND、既定 openai）
+        dedupe_threshold: 同一文脈種別の既存記憶とのJaccard類似度がこれ以上なら新規保存しない（Noneで無効）
+        openai_client: AsyncOpenAI 互換クライアント（共有の RateLimitedOpenAIClient やベンチマーク用の偽クライアント）"""
         self.base_path = Path(base_path)
-        self.openai_client = openai.AsyncOpenAI(api_key=openai_api_key or os.getenv("OPENAI_API_KEY"))
+        if openai_client is None:
+            # 再試行はラッパー側で行う（SDKの再試行と重ねない）
+            openai_client = RateLimitedOpenAIClient.from_env(
+                openai.AsyncOpenAI(api_key=openai_api_key or os.getenv("OPENAI_API_KEY"), max_retries=0)
+            )
+        self.openai_client = openai_client
+        if not isinstance(embedding_backend, EmbeddingBackend):
+            backend_name = embedding_backend or os.getenv("O3_MEMORY_EMBEDDING_BACKEND", "openai")
+            embedding_backend = EMBEDDING_BACKENDS[backend_name](self.openai_client)
+        self.embedding_backend = embedding_backend
         self.setup_directories()
+        self.embedding_cache = EmbeddingCache(self.base_path / "priority-cache" / "embedding_cache.db")
+        self.llm_cache = LLMResponseCache(self.base_path / "o3-insights" / "response_cache.db")
+        self.archive = MemoryArchive(self.base_path / "enhanced_memory_archive.db")
         self.init_database()
-        self.vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
+        generation = self.db.submit(self._vector_generation).result()
+        self.vector_sidecar = VectorSidecar(VectorSidecar.generation_path(self.base_path, generation), generation)
+        if self.vector_sidecar.dim and self.embedding_backend.dim not in (0, self.vector_sidecar.dim):
+            logger.warning(
+                f"Embedding backend {self.embedding_backend.model} ({self.embedding_backend.dim}d) differs from "
+                f"stored vectors ({self.vector_sidecar.dim}d); run --action reembed"
+            )
+        self.embedding_matrix = EmbeddingMatrix(self.vector_sidecar)
+        self.vector_index = IVFVectorIndex(
+            self.embedding_matrix, self.base_path / "memory-vectors" / "ivf_index.npz"
+        )
+        self._vector_index_ready = False
+        self._vector_index_loading = False
+        self._vector_index_lock: Optional[asyncio.Lock] = None
+        self._vector_change_seq = 0  # 行列へ反映済みの vector_changes.seq
+        self._pending_vectors: List[Tuple[str, int, int, str, int]] = []
+        self._fulltext_ready: Optional[bool] = None
+        self.importance_classifier = ImportanceClassifier()
+        self._importance_training: Optional[asyncio.Task] = None
+        self.dedupe_threshold = dedupe_threshold
+        self._access_updates: Dict[str, Tuple[int, str, Optional[float]]] = {}
+        self._summary_pending: Dict[str, int] = {}
+        self._summary_tasks: Dict[str, asyncio.Task] = {}
+        self._summary_locks: Dict[str, asyncio.Lock] = {}
+        self._enrichment_queue: Optional[asyncio.Queue] = None
+        self._enrichment_workers: List[asyncio.Task] = []
         
         # 重要度別記憶容量制限
         self.memory_limits = {
@@ -86,11 +2107,14 @@ class O3EnhancedMemorySystem:
             
     def init_database(self):
         """拡張データベース初期化"""
-        db_path = self.base_path / "enhanced_memory.db"
-        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
-        
+        db_path = self.base_path / DATABASE_FILENAME
+        self.db = MemoryDatabase(db_path)
+        self.db.submit(self._create_schema).result()
+
+    def _create_schema(self, conn: sqlite3.Connection):
+        """スキーマ作成（書き込みスレッドで実行）"""
         # 拡張記憶テーブル
-        self.conn.execute("""
+        conn.execute("""
             CREATE TABLE IF NOT EXISTS enhanced_memories (
                 id TEXT PRIMARY KEY,
                 session_id TEXT,
@@ -108,7 +2132,7 @@ class O3EnhancedMemorySystem:
         """)
         
         # セッション継承テーブル
-        self.conn.execute("""
+        conn.execute("""
             CREATE TABLE IF NOT EXISTS session_inheritance (
                 id TEXT PRIMARY KEY,
                 previous_session_id TEXT,
@@ -120,7 +2144,7 @@ class O3EnhancedMemorySystem:
         """)
         
         # AI連携記録テーブル
-        self.conn.execute("""
+        conn.execute("""
             CREATE TABLE IF NOT EXISTS ai_collaborations (
                 id TEXT PRIMARY KEY,
                 session_id TEXT,
@@ -134,7 +2158,7 @@ class O3EnhancedMemorySystem:
         """)
         
         # 重要度学習テーブル
-        self.conn.execute("""
+        conn.execute("""
             CREATE TABLE IF NOT EXISTS importance_learning (
                 id TEXT PRIMARY KEY,
                 content_pattern TEXT,
@@ -143,45 +2167,444 @@ class O3EnhancedMemorySystem:
                 learning_timestamp TEXT
             )
         """)
-        
-        self.conn.commit()
+
+        self._apply_schema_migrations(conn)
+
+    def _apply_schema_migrations(self, conn: sqlite3.Connection):
+        """未適用のスキーママイグレーションを順に適用"""
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target_version, migration in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {target_version}")
+            logger.info(f"Schema migrated: {migration.__doc__}")
         
     async def save_memory_with_o3_enhancement(self, 
                                             content: str,
                                             session_id: str,
                                             context_type: str = "conversation",
-                                            ai_source: str = "claude") -> str:
-        """o3強化記憶保存"""
+                                            ai_source: str = "claude",
+                                            enrich_in_background: bool = False) -> str:
+        """o3強化記憶保存
+
+        enrich_in_background=True の場合はフォールバック分析で即時保存し、
+        o3分析と埋め込みはバックグラウンドワーカーで後から反映する。
+        """
+        duplicate_id = (await self._find_near_duplicates([(content, context_type)]))[0]
+        if duplicate_id is not None:
+            await self._touch_memories([duplicate_id])
+            logger.info(f"Near-duplicate memory, existing record touched: {duplicate_id}")
+            return duplicate_id
+
+        if enrich_in_background:
+            return await self._save_with_deferred_enrichment(content, session_id, context_type, ai_source)
+
+        memory_record = await self._build_memory_record(content, session_id, context_type, ai_source)
         
-        # 1. 基本記憶レコード作成
-        memory_id = hashlib.md5(f"{content}{datetime.now().isoformat()}".encode()).hexdigest()
+        # 4. 記憶レコード保存
+        await self._save_memory_record(memory_record)
         
-        # 2. o3による重要度・キーワード分析
-        importance, keywords = await self._analyze_with_o3(content, context_type)
+        logger.info(f"Memory saved with o3 enhancement: {memory_record.id} (importance: {memory_record.importance.name})")
+        return memory_record.id
+
+    async def save_memories_bulk(self,
+                                 memories: List[Dict[str, str]],
+                                 session_id: str) -> List[str]:
+        """一括記憶保存（埋め込みはバッチャーで1リクエストに集約）
+
+        memories: [{"content": ..., "context_type": ..., "ai_source": ...}, ...]
+        近似重複（既存記憶・同一バッチ内の先行要素）は保存せず、既存側のIDを返す。
+        """
+        duplicates = await self._find_near_duplicates([
+            (memory["content"], memory.get("context_type", "conversation")) for memory in memories
+        ])
+        new_indices = [i for i, duplicate in enumerate(duplicates) if duplicate is None]
+        memory_records = await asyncio.gather(*[
+            self._build_memory_record(
+                memories[i]["content"],
+                session_id,
+                memories[i].get("context_type", "conversation"),
+                memories[i].get("ai_source", "claude")
+            )
+            for i in new_indices
+        ])
         
-        # 3. 埋め込みベクトル生成
-        embedding = await self._generate_embedding(content)
+        # 書き込みはまとめてキュー投入しグループコミット
+        await asyncio.gather(*[self._save_memory_record(memory_record) for memory_record in memory_records])
         
-        # 4. 記憶レコード保存
+        memory_ids: List[Optional[str]] = [None] * len(memories)
+        for i, memory_record in zip(new_indices, memory_records):
+            memory_ids[i] = memory_record.id
+        existing_ids = []
+        for i, duplicate in enumerate(duplicates):
+            if isinstance(duplicate, int):  # 同一バッチ内の先行要素
+                memory_ids[i] = memory_ids[duplicate]
+            elif duplicate is not None:
+                memory_ids[i] = duplicate
+                existing_ids.append(duplicate)
+        await self._touch_memories(existing_ids + [memory_ids[d] for d in duplicates if isinstance(d, int)])
+        
+        logger.info(
+            f"Bulk memories saved with o3 enhancement: {len(memory_records)} records "
+            f"({len(memories) - len(memory_records)} near-duplicates merged)"
+        )
+        return memory_ids
+
+    async def _find_near_duplicates(self, items: List[Tuple[str, str]]) -> List[Any]:
+        """(content, context_type) 毎の近似重複先
+
+        既存記憶ならそのID、同一リスト内の先行要素ならその添字(int)、重複なしはNone。
+        """
+        results: List[Any] = [None] * len(items)
+        if self.dedupe_threshold is None or not items:
+            return results
+
+        signatures = [MINHASH_LSH.signature(content) for content, _ in items]
+        item_buckets = [MINHASH_LSH.buckets(signature) for signature in signatures]
+        all_buckets = list({bucket for buckets in item_buckets for bucket in buckets})
+
+        # 1. 全要素のバケットをまとめて引き、候補の署名を取得
+        candidates: Dict[int, List[Tuple[str, str]]] = {}
+        stored_signatures: Dict[str, np.ndarray] = {}
+        for start in range(0, len(all_buckets), 500):
+            chunk = all_buckets[start:start + 500]
+            rows = await self.db.fetchall(f"""
+                SELECT b.bucket, m.id, m.context_type, m.minhash
+                FROM memory_lsh_buckets b JOIN enhanced_memories m ON m.id = b.memory_id
+                WHERE b.bucket IN ({','.join(['?'] * len(chunk))}) AND m.minhash IS NOT NULL
+            """, chunk)
+            for bucket, memory_id, context_type, minhash in rows:
+                candidates.setdefault(bucket, []).append((memory_id, context_type))
+                if memory_id not in stored_signatures:
+                    stored_signatures[memory_id] = np.frombuffer(minhash, dtype="<u4")
+
+        # 2. 同一文脈種別の候補を署名一致率で検証（同一リスト内の先行要素も対象）
+        batch_buckets: Dict[int, List[int]] = {}
+        for i, ((_, context_type), signature, buckets) in enumerate(zip(items, signatures, item_buckets)):
+            existing = list(dict.fromkeys(
+                memory_id for bucket in buckets
+                for memory_id, candidate_type in candidates.get(bucket, []) if candidate_type == context_type
+            ))
+            earlier = list(dict.fromkeys(
+                j for bucket in buckets for j in batch_buckets.get(bucket, []) if items[j][1] == context_type
+            ))
+            best_score, best = self.dedupe_threshold, None
+            for keys, matrix in [
+                (existing, [stored_signatures[memory_id] for memory_id in existing]),
+                (earlier, [signatures[j] for j in earlier]),
+            ]:
+                if not keys:
+                    continue
+                scores = (np.stack(matrix) == signature).mean(axis=1)
+                top = int(scores.argmax())
+                if scores[top] >= best_score:
+                    best_score, best = float(scores[top]), keys[top]
+            results[i] = best
+            if best is None:
+                for bucket in buckets:
+                    batch_buckets.setdefault(bucket, []).append(i)
+        return results
+
+    async def _touch_memories(self, memory_ids: List[str]):
+        """再保存された記憶の参照回数・最終参照時刻を更新"""
+        self._record_access(memory_ids)
+
+    # 参照統計の書き込みをまとめる件数
+    ACCESS_FLUSH_THRESHOLD = 256
+
+    def _record_access(self, memory_ids: List[str], relevance_scores: Dict[str, float] = None):
+        """参照回数・最終参照時刻・関連度（指数移動平均）の更新を蓄積し、一定件数でまとめて書き込み"""
+        now = datetime.now().isoformat()
+        relevance_scores = relevance_scores or {}
+        for memory_id in memory_ids:
+            count, _, relevance = self._access_updates.get(memory_id, (0, now, None))
+            self._access_updates[memory_id] = (count + 1, now, relevance_scores.get(memory_id, relevance))
+        if len(self._access_updates) >= self.ACCESS_FLUSH_THRESHOLD:
+            self._flush_access_stats()
+
+    def _flush_access_stats(self) -> Optional[concurrent.futures.Future]:
+        """蓄積した参照統計を書き込みスレッドへ投入（グループコミット）"""
+        if not self._access_updates:
+            return None
+        updates, self._access_updates = self._access_updates, {}
+        params = [
+            (count, last_accessed, relevance, relevance, memory_id)
+            for memory_id, (count, last_accessed, relevance) in updates.items()
+        ]
+        future = self.db.submit(lambda conn: conn.executemany("""
+            UPDATE enhanced_memories
+            SET access_count = COALESCE(access_count, 0) + ?,
+                last_accessed = ?,
+                relevance_score = CASE WHEN ? IS NULL THEN relevance_score
+                                       ELSE COALESCE(relevance_score, 0) * 0.8 + ? * 0.2 END
+            WHERE id = ?
+        """, params).rowcount)
+        future.add_done_callback(
+            lambda f: f.exception() and logger.error(f"Access stats update failed: {f.exception()}")
+        )
+        return future
+
+    async def near_duplicate_report(self, sample_limit: int = 20) -> Dict[str, Any]:
+        """既存記憶の近似重複クラスタ報告（LSHバケット共有の組のみ検証）"""
+        threshold = self.dedupe_threshold if self.dedupe_threshold is not None else 0.8
+        groups = await self.db.fetchall("""
+            SELECT group_concat(memory_id, ' ') FROM memory_lsh_buckets
+            GROUP BY bucket HAVING COUNT(*) > 1
+        """)
+        candidate_groups = [group[0].split(" ") for group in groups]
+        candidate_ids = list({memory_id for group in candidate_groups for memory_id in group})
+
+        rows: Dict[str, Tuple[str, str, np.ndarray]] = {}
+        for start in range(0, len(candidate_ids), 500):
+            chunk = candidate_ids[start:start + 500]
+            for memory_id, context_type, content, minhash in await self.db.fetchall(f"""
+                SELECT id, context_type, content, minhash FROM enhanced_memories
+                WHERE id IN ({','.join(['?'] * len(chunk))}) AND minhash IS NOT NULL
+            """, chunk):
+                rows[memory_id] = (context_type, content, np.frombuffer(minhash, dtype="<u4"))
+
+        # Union-Findで近似重複をクラスタ化
+        parent = {memory_id: memory_id for memory_id in rows}
+
+        def find(memory_id):
+            while parent[memory_id] != memory_id:
+                parent[memory_id] = parent[parent[memory_id]]
+                memory_id = parent[memory_id]
+            return memory_id
+
+        checked = set()
+        for group in candidate_groups:
+            members = [memory_id for memory_id in group if memory_id in rows]
+            for a_index, a in enumerate(members):
+                for b in members[a_index + 1:]:
+                    pair = (a, b) if a < b else (b, a)
+                    if pair in checked:
+                        continue
+                    checked.add(pair)
+                    if rows[a][0] == rows[b][0] and MinHashLSH.similarity(rows[a][2], rows[b][2]) >= threshold:
+                        parent[find(a)] = find(b)
+
+        clusters: Dict[str, List[str]] = {}
+        for memory_id in rows:
+            clusters.setdefault(find(memory_id), []).append(memory_id)
+        duplicate_clusters = sorted(
+            (members for members in clusters.values() if len(members) > 1), key=len, reverse=True
+        )
+        total = (await self.db.fetchone("SELECT COUNT(*) FROM enhanced_memories"))[0]
+        return {
+            "threshold": threshold,
+            "total_memories": total,
+            "duplicate_clusters": len(duplicate_clusters),
+            "redundant_memories": sum(len(members) - 1 for members in duplicate_clusters),
+            "samples": [
+                {
+                    "context_type": rows[members[0]][0],
+                    "memory_ids": members,
+                    "contents": [rows[memory_id][1][:100] for memory_id in members[:5]],
+                }
+                for members in duplicate_clusters[:sample_limit]
+            ],
+        }
+
+    async def _save_with_deferred_enrichment(self,
+                                       content: str,
+                                       session_id: str,
+                                       context_type: str,
+                                       ai_source: str) -> str:
+        """フォールバック重要度・埋め込みなしで即時保存し、強化処理をキューへ投入"""
+        importance, keywords = self._fallback_analysis(content, context_type)
         memory_record = MemoryRecord(
-            id=memory_id,
+            id=hashlib.md5(f"{content}{datetime.now().isoformat()}".encode()).hexdigest(),
             session_id=session_id,
             timestamp=datetime.now(),
             content=content,
             importance=importance,
             keywords=keywords,
             context_type=context_type,
-            embedding=embedding,
+            embedding=None,
             ai_source=ai_source
         )
+        await self._save_memory_record(memory_record)
+        
+        self._ensure_enrichment_workers()
+        self._enrichment_queue.put_nowait((memory_record.id, content, context_type))
+        logger.info(f"Memory saved, enrichment deferred: {memory_record.id}")
+        return memory_record.id
+
+    def _ensure_enrichment_workers(self, worker_count: int = 4):
+        """強化ワーカーの遅延起動"""
+        if self._enrichment_queue is None:
+            self._enrichment_queue = asyncio.Queue()
+        self._enrichment_workers = [task for task in self._enrichment_workers if not task.done()]
+        while len(self._enrichment_workers) < worker_count:
+            self._enrichment_workers.append(asyncio.ensure_future(self._enrichment_worker()))
+
+    async def _enrichment_worker(self):
+        """キューから記憶を取り出しo3分析・埋め込みを反映"""
+        while True:
+            memory_id, content, context_type = await self._enrichment_queue.get()
+            try:
+                await self._enrich_memory(memory_id, content, context_type)
+            except Exception as e:
+                logger.error(f"Memory enrichment failed: {memory_id}: {e}")
+            finally:
+                self._enrichment_queue.task_done()
+
+    async def wait_for_enrichment(self):
+        """キュー投入済みの強化処理完了待ち"""
+        if self._enrichment_queue is not None:
+            await self._enrichment_queue.join()
+
+    async def _enrich_memory(self, memory_id: str, content: str, context_type: str):
+        """o3分析・埋め込み生成結果で既存行を更新"""
+        (importance, keywords), embedding = await asyncio.gather(
+            self._analyze_with_o3(content, context_type),
+            self._generate_embedding(content)
+        )
+        embedding_blob = encode_embedding(embedding)
+        sidecar = self.vector_sidecar
+        vector_offset = self._append_to_sidecar(embedding, sidecar) if embedding_blob else None
+
+        def update(conn: sqlite3.Connection) -> Optional[Tuple[Optional[int], str]]:
+            offset = self._current_offset(conn, sidecar, vector_offset)
+            updated = conn.execute("""
+                UPDATE enhanced_memories
+                SET importance = ?, keywords = ?,
+                    embedding = COALESCE(?, embedding), vector_offset = COALESCE(?, vector_offset)
+                WHERE id = ?
+            """, (importance.value, json.dumps(keywords), embedding_blob, offset, memory_id)).rowcount
+            if not updated:
+                # 強化待ちの間にアーカイブ・削除された記憶
+                return None
+            row = conn.execute("SELECT session_id FROM enhanced_memories WHERE id = ?", (memory_id,)).fetchone()
+            return offset, row[0]
+
+        stored = await self.db.run_write(update)
+        if stored is None or stored[0] is None:
+            return
+        self._register_vector(memory_id, stored[0], importance.value, stored[1], sidecar.generation)
+
+    async def backfill_missing_embeddings(self, concurrency: int = 8, batch_size: int = 1000) -> int:
+        """埋め込み未生成の記憶を並列で強化（書き込み遅延分・失敗分の回収）
+
+        対象は rowid 順に batch_size 件ずつ読み、全件を同時に保持しない。
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def enrich(memory_id, content, context_type):
+            async with semaphore:
+                await self._enrich_memory(memory_id, content, context_type)
+
+        last_rowid, attempted, remaining = 0, 0, 0
+        while True:
+            rows = await self.db.fetchall("""
+                SELECT rowid, id, content, context_type FROM enhanced_memories
+                WHERE rowid > ? AND embedding IS NULL
+                ORDER BY rowid LIMIT ?
+            """, (last_rowid, batch_size))
+            if not rows:
+                break
+            await asyncio.gather(*[enrich(*row[1:]) for row in rows])
+            await self.db.flush()
+            last_rowid = rows[-1][0]
+            attempted += len(rows)
+            remaining = (await self.db.fetchone(
+                "SELECT COUNT(*) FROM enhanced_memories WHERE rowid <= ? AND embedding IS NULL", (last_rowid,)
+            ))[0]
+            logger.info(f"Embedding backfill progress: {attempted - remaining}/{attempted} rows")
+        logger.info(f"Embedding backfill completed: {attempted - remaining}/{attempted} rows")
+        return attempted - remaining
+
+    async def reembed_memories(self, batch_size: int = 1024) -> int:
+        """全記憶を現在の埋め込みバックエンドで再計算し、ベクトル索引を再構築（バックエンド切替時）"""
+        reembedded = 0
+        batch: List[Dict[str, Any]] = []
+
+        async def flush_batch():
+            embeddings = await self.embedding_backend.embed_many([row["content"] for row in batch])
+            await self.db.executemany(
+                "UPDATE enhanced_memories SET embedding = ?, vector_offset = NULL WHERE id = ?",
+                [(encode_embedding(embedding), row["id"]) for row, embedding in zip(batch, embeddings)]
+            )
+
+        async for row in self.iter_memory_fields(("id", "content"), batch_size=batch_size):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                await flush_batch()
+                reembedded += len(batch)
+                batch = []
+                logger.info(f"Re-embedding progress: {reembedded} rows")
+        if batch:
+            await flush_batch()
+            reembedded += len(batch)
+
+        await self.rebuild_vector_index()
+        logger.info(f"Re-embedded with {self.embedding_backend.model}: {reembedded} rows")
+        return reembedded
+
+    async def _build_memory_record(self,
+                                   content: str,
+                                   session_id: str,
+                                   context_type: str,
+                                   ai_source: str) -> MemoryRecord:
+        """分析・埋め込み付き記憶レコード作成"""
+        # 1. 基本記憶レコード作成
+        memory_id = hashlib.md5(f"{content}{datetime.now().isoformat()}".encode()).hexdigest()
         
-        self._save_memory_record(memory_record)
+        # 2. o3による重要度・キーワード分析 / 3. 埋め込みベクトル生成（並行実行）
+        (importance, keywords), embedding = await asyncio.gather(
+            self._analyze_with_o3(content, context_type),
+            self._generate_embedding(content)
+        )
         
-        logger.info(f"Memory saved with o3 enhancement: {memory_id} (importance: {importance.name})")
-        return memory_id
+        return MemoryRecord(
+            id=memory_id,
+            session_id=session_id,
+            timestamp=datetime.now(),
+            content=content,
+            importance=importance,
+            keywords=keywords,
+            context_type=context_type,
+            embedding=embedding,
+            ai_source=ai_source
+        )
         
     async def _analyze_with_o3(self, content: str, context_type: str) -> Tuple[MemoryImportance, List[str]]:
-        """o3による内容分析"""
+        """内容分析（ローカル分類器が確信できればそれを採用、不確実なものだけo3へ委譲）
+
+        ローカル分類器は重要度のみを判定するため、その場合のキーワードはルールベース（_fallback_analysis）で抽出する。
+        """
+        classifier = self.importance_classifier
+        self._schedule_importance_training()
+        local = classifier.predict(content, context_type)
+        audit = False
+        if local is not None and local[1] >= classifier.confidence_threshold:
+            audit = random.random() < classifier.audit_rate
+            if not audit:
+                classifier.local_hits += 1
+                return local[0], self._fallback_analysis(content, context_type)[1]
+
+        model_calls = []
+        result = await self._analyze_with_o3_remote(
+            content, context_type, on_model_call=lambda: model_calls.append(True)
+        )
+        if model_calls:
+            classifier.escalations += 1
+        elif result is not None:
+            classifier.cached_escalations += 1
+        if result is None:
+            # o3失敗時: 低確信でもローカル判定があれば優先
+            importance, keywords = self._fallback_analysis(content, context_type)
+            return (local[0] if local else importance), keywords
+        if local is not None:
+            classifier.record_comparison(local[0], result[0], audit)
+        await self._record_importance_verdict(content, context_type, result[0])
+        return result
+
+    async def _analyze_with_o3_remote(self,
+                                      content: str,
+                                      context_type: str,
+                                      on_model_call: Callable[[], Any] = None) -> Optional[Tuple[MemoryImportance, List[str]]]:
+        """o3による内容分析（失敗時None）"""
         try:
             analysis_prompt = f"""
             Analyze the following content and provide:
@@ -206,25 +2629,126 @@ class O3EnhancedMemorySystem:
             }}
             """
             
-            response = await self.openai_client.chat.completions.create(
-                model="o3-mini",
-                messages=[
+            response_content = await self._chat_completion(
+                [
                     {"role": "system", "content": "You are an expert at analyzing content importance for AI memory systems."},
                     {"role": "user", "content": analysis_prompt}
                 ],
-                max_tokens=300
+                max_tokens=300,
+                validate=self._parse_analysis,
+                on_model_call=on_model_call
             )
             
-            analysis = json.loads(response.choices[0].message.content)
-            importance = MemoryImportance(analysis.get("importance", 3))
-            keywords = analysis.get("keywords", [])
-            
-            return importance, keywords
+            return self._parse_analysis(response_content)
             
         except Exception as e:
             logger.error(f"o3 analysis failed: {e}")
-            # フォールバック: 基本分析
-            return self._fallback_analysis(content, context_type)
+            return None
+
+    @staticmethod
+    def _parse_analysis(response_content: str) -> Tuple[MemoryImportance, List[str]]:
+        """o3の分析応答を (重要度, キーワード) に変換（JSON・重要度・キーワードが不正なら例外）"""
+        analysis = json.loads(response_content)
+        importance = MemoryImportance(analysis.get("importance", 3))
+        keywords = analysis.get("keywords", [])
+        if not isinstance(keywords, list):
+            raise ValueError(f"Invalid keywords: {keywords!r}")
+        return importance, keywords
+
+    async def _chat_completion(self,
+                               messages: List[Dict[str, str]],
+                               max_tokens: int,
+                               model: str = "o3-mini",
+                               validate: Callable[[str], Any] = None,
+                               on_model_call: Callable[[], Any] = None) -> str:
+        """チャット補完（同一プロンプトは応答キャッシュから返す、検証を通った応答のみ保存）
+
+        on_model_call はキャッシュに無く実際にモデルを呼ぶ直前に呼ばれる。
+        検証に失敗したキャッシュ済み応答は削除してモデルを呼び直す。
+        """
+        cached = await self.llm_cache.get(model, messages, max_tokens)
+        if cached is not None:
+            try:
+                if validate is not None:
+                    validate(cached)
+                return cached
+            except Exception as e:
+                logger.warning(f"Discarding invalid cached response: {e}")
+                self.llm_cache.discard(model, messages, max_tokens)
+        if on_model_call is not None:
+            on_model_call()
+        response = await self.openai_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens
+        )
+        content = response.choices[0].message.content
+        if validate is not None:
+            validate(content)
+        self.llm_cache.put(model, messages, max_tokens, content)
+        return content
+
+    def get_api_stats(self) -> Dict[str, Any]:
+        """OpenAI呼び出しの待ち行列・再試行・応答時間の統計"""
+        if isinstance(self.openai_client, RateLimitedOpenAIClient):
+            return self.openai_client.stats()
+        return {}
+
+    async def get_cache_stats(self) -> Dict[str, Any]:
+        """埋め込み・LLM応答キャッシュのヒット/ミス"""
+        return {
+            "embedding_cache": {"hits": self.embedding_cache.hits, "misses": self.embedding_cache.misses},
+            "llm_response_cache": await self.llm_cache.stats(),
+        }
+
+    async def _record_importance_verdict(self, content: str, context_type: str, importance: MemoryImportance):
+        """o3の判定を学習データとして記録"""
+        await self.db.execute("""
+            INSERT OR REPLACE INTO importance_learning
+            (id, content_pattern, context_type, learned_importance, confidence_score, learning_timestamp)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (
+            hashlib.md5(f"{context_type}\0{content}".encode()).hexdigest(),
+            content,
+            context_type,
+            importance.value,
+            1.0,
+            datetime.now().isoformat()
+        ))
+        self.importance_classifier.new_samples += 1
+
+    async def _load_importance_samples(self) -> List[Tuple[str, str, int]]:
+        return await self.db.fetchall("""
+            SELECT content_pattern, COALESCE(context_type, ''), learned_importance
+            FROM importance_learning
+            ORDER BY learning_timestamp
+        """)
+
+    def _schedule_importance_training(self):
+        """未学習または新規判定が一定件数たまったらバックグラウンドで再学習"""
+        classifier = self.importance_classifier
+        if self._importance_training is not None and not self._importance_training.done():
+            return
+        if self._importance_training is not None and classifier.new_samples < classifier.retrain_every:
+            return
+        self._importance_training = asyncio.ensure_future(self.train_importance_classifier())
+
+    async def train_importance_classifier(self) -> bool:
+        """importance_learningから分類器を学習（学習中も旧モデルで判定を継続）"""
+        classifier = self.importance_classifier
+        classifier.new_samples = 0
+        samples = await self._load_importance_samples()
+        trained = await asyncio.to_thread(classifier.train, samples)
+        if trained:
+            logger.info(f"Importance classifier trained: {len(samples)} samples")
+        return trained
+
+    async def get_importance_classifier_stats(self) -> Dict[str, Any]:
+        """ローカル判定率・o3一致率と、学習データでの検証結果"""
+        samples = await self._load_importance_samples()
+        stats = self.importance_classifier.stats()
+        stats["evaluation"] = await asyncio.to_thread(self.importance_classifier.evaluate, samples)
+        return stats
             
     def _fallback_analysis(self, content: str, context_type: str) -> Tuple[MemoryImportance, List[str]]:
         """o3失敗時のフォールバック分析"""
@@ -248,26 +2772,29 @@ class O3EnhancedMemorySystem:
         return importance, keywords
         
     async def _generate_embedding(self, content: str) -> List[float]:
-        """埋め込みベクトル生成"""
+        """埋め込みベクトル生成（リモートバックエンドは内容ハッシュキャッシュ優先）"""
+        backend = self.embedding_backend
+        if backend.cacheable:
+            cached = await self.embedding_cache.get(backend.model, content)
+            if cached is not None:
+                return cached
         try:
-            response = await self.openai_client.embeddings.create(
-                model="text-embedding-3-small",
-                input=content
-            )
-            return response.data[0].embedding
+            embedding = await backend.embed(content)
+            if backend.cacheable:
+                self.embedding_cache.put(backend.model, content, embedding)
+            return embedding
         except Exception as e:
             logger.error(f"Embedding generation failed: {e}")
             return []
             
-    def _save_memory_record(self, memory_record: MemoryRecord):
+    async def _save_memory_record(self, memory_record: MemoryRecord):
         """記憶レコードDB保存"""
-        embedding_blob = json.dumps(memory_record.embedding) if memory_record.embedding else None
+        embedding_blob = encode_embedding(memory_record.embedding)
+        sidecar = self.vector_sidecar
+        vector_offset = self._append_to_sidecar(memory_record.embedding, sidecar) if embedding_blob else None
         
-        self.conn.execute("""
-            INSERT OR REPLACE INTO enhanced_memories
-            (id, session_id, timestamp, content, importance, keywords, context_type, embedding, ai_source)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
+        signature = MINHASH_LSH.signature(memory_record.content)
+        params = (
             memory_record.id,
             memory_record.session_id,
             memory_record.timestamp.isoformat(),
@@ -276,9 +2803,455 @@ class O3EnhancedMemorySystem:
             json.dumps(memory_record.keywords),
             memory_record.context_type,
             embedding_blob,
-            memory_record.ai_source
-        ))
-        self.conn.commit()
+            memory_record.ai_source,
+        )
+
+        def insert(conn: sqlite3.Connection) -> Optional[int]:
+            offset = self._current_offset(conn, sidecar, vector_offset)
+            conn.execute("""
+                INSERT OR REPLACE INTO enhanced_memories
+                (id, session_id, timestamp, content, importance, keywords, context_type, embedding, ai_source,
+                 vector_offset, minhash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, params + (offset, signature.tobytes()))
+            MINHASH_LSH.store(conn, memory_record.id, signature)
+            return offset
+
+        vector_offset = await self.db.run_write(insert)
+
+        if vector_offset is not None:
+            self._register_vector(
+                memory_record.id,
+                vector_offset,
+                memory_record.importance.value,
+                memory_record.session_id,
+                sidecar.generation
+            )
+        self._schedule_session_summary(memory_record.session_id)
+
+    def _register_vector(self,
+                         memory_id: str,
+                         vector_offset: int,
+                         importance: int,
+                         session_id: str,
+                         generation: int):
+        """行列は初回検索時に読み込み、以降は保存ごとに追記（読み込み中は完了後に反映）
+
+        読み込み済みの世代と異なるオフセットは登録しない（世代切替後の再読み込みで反映される）。
+        """
+        if self._vector_index_ready:
+            if generation != self.vector_sidecar.generation:
+                return
+            row = self.embedding_matrix.add(memory_id, vector_offset, importance, session_id)
+            self.vector_index.add(row)
+        elif self._vector_index_loading:
+            self._pending_vectors.append((memory_id, vector_offset, importance, session_id, generation))
+
+    def _append_to_sidecar(self, embedding, sidecar: Optional[VectorSidecar] = None) -> Optional[int]:
+        """正規化ベクトルをサイドカーへ追記しオフセットを返す"""
+        vector = EmbeddingMatrix.normalize(np.asarray(embedding, dtype=np.float32))
+        if vector is None:
+            return None
+        try:
+            return (sidecar or self.vector_sidecar).append(vector[None, :])
+        except ValueError as e:
+            logger.warning(f"Vector sidecar append skipped: {e}")
+            return None
+
+    @staticmethod
+    def _append_many_to_sidecar(embeddings: List[Any], sidecar: VectorSidecar) -> List[Optional[int]]:
+        """正規化ベクトルを1回の追記でまとめて書き込み、各オフセットを返す（正規化不能・次元違いはNone）"""
+        vectors = [
+            None if embedding is None else EmbeddingMatrix.normalize(np.asarray(embedding, dtype=np.float32))
+            for embedding in embeddings
+        ]
+        dim = sidecar.dim or next((len(vector) for vector in vectors if vector is not None), 0)
+        keep = [i for i, vector in enumerate(vectors) if vector is not None and len(vector) == dim]
+        skipped = sum(vector is not None for vector in vectors) - len(keep)
+        if skipped:
+            logger.warning(f"Vector sidecar append skipped: {skipped} embeddings are not {dim}d")
+        offsets: List[Optional[int]] = [None] * len(vectors)
+        if keep:
+            start = sidecar.append(np.stack([vectors[i] for i in keep]))
+            for position, i in enumerate(keep):
+                offsets[i] = start + position
+        return offsets
+
+    @staticmethod
+    def _vector_generation(conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT vector_generation FROM memory_state WHERE id = 1").fetchone()[0]
+
+    def _current_offset(self,
+                        conn: sqlite3.Connection,
+                        sidecar: VectorSidecar,
+                        vector_offset: Optional[int]) -> Optional[int]:
+        """追記先の世代がDB上の現世代と一致する場合のみオフセットを返す（書き込みスレッドで実行）
+
+        追記後に他プロセスが圧縮した場合は旧世代のオフセットを保存せず、次回のサイドカー補完で追記し直す。
+        """
+        if vector_offset is None or self._vector_generation(conn) != sidecar.generation:
+            return None
+        return vector_offset
+
+    async def _ensure_vector_index(self) -> IVFVectorIndex:
+        """埋め込み行列とベクトルインデックスの遅延読み込み
+
+        読み込み後は検索ごとに変更ログを1回参照し、他プロセスが登録したベクトルを差分で取り込む。
+        他プロセスの圧縮（世代の変化）や、未反映分が変更ログから切り詰められた場合は読み込み直す。
+        """
+        async with self._get_vector_index_lock():
+            if self._vector_index_ready:
+                changes = await self.db.read(self._read_vector_changes, self._vector_change_seq)
+                if changes is None:
+                    self._vector_index_ready = False
+                else:
+                    self._apply_vector_changes(*changes)
+            if not self._vector_index_ready:
+                await self._reload_vector_state(retrain=False)
+            if self.vector_index.needs_retrain:
+                await self._retrain_vector_index()
+        return self.vector_index
+
+    async def _retrain_vector_index(self):
+        """IVFを別スレッドで再学習（インデックスロック内で呼ぶ。学習中の追加は旧セントロイドで割り当て、反映時に割り当て直す）"""
+        index = self.vector_index
+        index.begin_retrain()
+        try:
+            fitted = await asyncio.to_thread(index.fit)
+        except BaseException:
+            index.end_retrain()
+            raise
+        index.install(*fitted)
+
+    def _read_vector_changes(self,
+                             conn: sqlite3.Connection,
+                             after_seq: int) -> Optional[Tuple[int, List[Tuple]]]:
+        """after_seq より後に登録されたベクトル行と最新seq（読み込み直しが必要ならNone）
+
+        世代とログを同一の読み取りトランザクションで参照し、圧縮をまたいだオフセットを取り込まない。
+        最新seqは切り詰め後も残る sqlite_sequence から取る。
+        """
+        conn.execute("BEGIN")
+        try:
+            generation, min_seq, max_seq = conn.execute(f"""
+                SELECT vector_generation,
+                       (SELECT MIN(seq) FROM vector_changes),
+                       ({self.VECTOR_CHANGE_SEQ_SQL})
+                FROM memory_state WHERE id = 1
+            """).fetchone()
+            if generation != self.vector_sidecar.generation:
+                return None
+            if max_seq <= after_seq:
+                return after_seq, []
+            if min_seq is None or min_seq > after_seq + 1:
+                return None
+            rows = conn.execute("""
+                SELECT m.id, m.vector_offset, m.importance, m.session_id
+                FROM vector_changes c JOIN enhanced_memories m ON m.id = c.memory_id
+                WHERE c.seq > ? AND c.seq <= ? AND m.vector_offset IS NOT NULL
+                ORDER BY c.seq
+            """, (after_seq, max_seq)).fetchall()
+            return max_seq, rows
+        finally:
+            conn.rollback()
+
+    def _apply_vector_changes(self, seq: int, rows: List[Tuple]):
+        """変更ログの差分を行列・IVFへ反映（自プロセスで登録済みの行は飛ばす）"""
+        matrix = self.embedding_matrix
+        generation = self.vector_sidecar.generation
+        for memory_id, vector_offset, importance, session_id in rows:
+            row = matrix.id_to_row.get(memory_id)
+            if (row is not None and matrix.offsets[row] == vector_offset
+                    and matrix.importance[row] == importance
+                    and matrix.session_to_code.get(session_id) == matrix.session_codes[row]):
+                continue
+            self._register_vector(memory_id, vector_offset, importance, session_id, generation)
+        self._vector_change_seq = seq
+
+    def _get_vector_index_lock(self) -> asyncio.Lock:
+        if self._vector_index_lock is None:
+            self._vector_index_lock = asyncio.Lock()
+        return self._vector_index_lock
+
+    async def _reload_vector_state(self, retrain: bool):
+        """サイドカー補完→行列読み込み→IVF読み込み/学習（読み込み中の保存分は後から反映）"""
+        self._vector_index_ready = False
+        self._vector_index_loading = True
+        try:
+            await self.db.run_write(self._backfill_vector_offsets)
+            await self.db.read(self._load_vector_state, retrain)
+            self._vector_index_ready = True
+            for pending in self._pending_vectors:
+                self._register_vector(*pending)
+        finally:
+            self._pending_vectors = []
+            self._vector_index_loading = False
+
+    def _load_vector_state(self, conn: sqlite3.Connection, retrain: bool):
+        # 読み込み中に登録された分は次回の差分で重ねて反映される（同一IDは上書き）
+        self._vector_change_seq = conn.execute(self.VECTOR_CHANGE_SEQ_SQL).fetchone()[0]
+        self._load_embedding_matrix(conn)
+        if retrain or not self.vector_index.load():
+            self.vector_index.train()
+            self.vector_index.save()
+
+    def _load_embedding_matrix(self, conn: sqlite3.Connection):
+        """サイドカー行オフセットから埋め込み行列を構築（埋め込みBLOBは読まない）"""
+        self.embedding_matrix.clear()
+        cursor = conn.execute("""
+            SELECT id, vector_offset, importance, session_id FROM enhanced_memories
+            WHERE vector_offset IS NOT NULL
+        """)
+        for memory_id, vector_offset, importance, session_id in cursor:
+            self.embedding_matrix.add(memory_id, vector_offset, importance, session_id)
+
+    def _sync_vector_generation(self, conn: sqlite3.Connection):
+        """DB上の現世代のサイドカーへ切替（書き込みスレッドで実行、行列は直後に読み込み直す）"""
+        generation = self._vector_generation(conn)
+        if generation != self.vector_sidecar.generation:
+            self.vector_sidecar = VectorSidecar(VectorSidecar.generation_path(self.base_path, generation), generation)
+            self.embedding_matrix.sidecar = self.vector_sidecar
+
+    # ベクトル変更ログの保持件数（これより古い未反映分があるプロセスは全件読み込み直す）
+    VECTOR_CHANGE_LOG_SIZE = 100000
+    VECTOR_CHANGE_SEQ_SQL = "SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'vector_changes'"
+
+    def _backfill_vector_offsets(self, conn: sqlite3.Connection, batch_size: int = 1000) -> int:
+        """サイドカー未登録（または欠損）の埋め込みを追記しオフセット更新（書き込みスレッドで実行）
+
+        埋め込みBLOBは rowid 順に batch_size 件ずつ読み、全件を同時に保持しない。
+        """
+        self._sync_vector_generation(conn)
+        conn.execute(
+            "DELETE FROM vector_changes WHERE seq <= (SELECT MAX(seq) FROM vector_changes) - ?",
+            (self.VECTOR_CHANGE_LOG_SIZE,)
+        )
+        sidecar_rows = self.vector_sidecar.rows
+        last_rowid, total = 0, 0
+        while True:
+            rows = conn.execute("""
+                SELECT rowid, id, embedding FROM enhanced_memories
+                WHERE rowid > ? AND embedding IS NOT NULL AND (vector_offset IS NULL OR vector_offset >= ?)
+                ORDER BY rowid LIMIT ?
+            """, (last_rowid, sidecar_rows, batch_size)).fetchall()
+            if not rows:
+                break
+            offsets = self._append_many_to_sidecar([decode_embedding(blob) for _, _, blob in rows], self.vector_sidecar)
+            conn.executemany(
+                "UPDATE enhanced_memories SET vector_offset = ? WHERE id = ?",
+                [(offset, memory_id) for offset, (_, memory_id, _) in zip(offsets, rows)]
+            )
+            last_rowid = rows[-1][0]
+            total += len(rows)
+        if total:
+            logger.info(f"Vector sidecar backfilled: {total} rows")
+        return total
+
+    async def rebuild_vector_index(self) -> int:
+        """DBの全埋め込みからサイドカー・ベクトルインデックス・全文検索索引を再構築
+
+        サイドカーは新しい世代のファイルへ圧縮する。旧世代を読み込み済みの他プロセスは次回検索時に
+        世代の変化を検知して読み込み直すため、直前の世代のファイルは次回の圧縮まで残す。
+        """
+        await self.db.run_write(self._rebuild_fulltext_index)
+        async with self._get_vector_index_lock():
+            generation = await self.db.run_write(self._compact_vector_sidecar)
+            await self._reload_vector_state(retrain=True)
+        removed = VectorSidecar.remove_generations(self.base_path, generation - 1)
+        logger.info(
+            f"Vector index rebuilt: {len(self.embedding_matrix)} vectors "
+            f"(sidecar generation {generation}, {removed} old files removed)"
+        )
+        return len(self.embedding_matrix)
+
+    def _compact_vector_sidecar(self, conn: sqlite3.Connection, batch_size: int = 1000) -> int:
+        """全埋め込みを次世代のサイドカーへ詰めて書き出しオフセットを張り替え、新しい世代を返す（書き込みスレッドで実行）
+
+        世代番号の更新で書き込みロックを取ってから書き出すため、並行する保存は圧縮後の世代で判定される。
+        """
+        conn.execute("UPDATE memory_state SET vector_generation = vector_generation + 1 WHERE id = 1")
+        generation = self._vector_generation(conn)
+        sidecar = VectorSidecar(VectorSidecar.generation_path(self.base_path, generation), generation)
+        sidecar.reset()
+        conn.execute("UPDATE enhanced_memories SET vector_offset = NULL WHERE vector_offset IS NOT NULL")
+        last_rowid = 0
+        while True:
+            rows = conn.execute("""
+                SELECT rowid, id, embedding FROM enhanced_memories
+                WHERE rowid > ? AND embedding IS NOT NULL
+                ORDER BY rowid LIMIT ?
+            """, (last_rowid, batch_size)).fetchall()
+            if not rows:
+                break
+            offsets = self._append_many_to_sidecar([decode_embedding(blob) for _, _, blob in rows], sidecar)
+            conn.executemany(
+                "UPDATE enhanced_memories SET vector_offset = ? WHERE id = ?",
+                [(offset, memory_id) for offset, (_, memory_id, _) in zip(offsets, rows)]
+            )
+            last_rowid = rows[-1][0]
+        # 他プロセスは世代の変化で全件読み込み直すため、張り替え分のログは不要
+        conn.execute("DELETE FROM vector_changes")
+        return generation
+
+    async def _vector_search(self,
+                       query_embedding: List[float],
+                       k: int,
+                       session_id: str = None,
+                       importance_levels: List[MemoryImportance] = None) -> List[Tuple[str, float]]:
+        """埋め込み行列上の上位k件検索（フィルタはブールマスクで適用）"""
+        await self._ensure_vector_index()
+        query_vector = EmbeddingMatrix.normalize(np.asarray(query_embedding, dtype=np.float32))
+        if query_vector is None or query_vector.shape[0] != self.embedding_matrix.dim:
+            return []
+
+        # セッション指定時はその区画のみ厳密探索、それ以外はIVF候補に限定
+        if session_id is not None:
+            return self.embedding_matrix.session_top_k(query_vector, k, session_id, importance_levels)
+        mask = self.embedding_matrix.mask(None, importance_levels)
+        rows = self.vector_index.candidate_rows(query_vector)
+        return self.embedding_matrix.top_k(query_vector, k, rows=rows, mask=mask)
+
+    async def archive_cold_memories(self,
+                                    idle_days: int = 30,
+                                    max_importance: MemoryImportance = MemoryImportance.LOW,
+                                    batch_size: int = 500) -> int:
+        """低重要度かつ一定期間参照のない記憶をアーカイブDBへ移動し、領域とベクトル索引を縮小"""
+        self._flush_access_stats()
+        await self.db.flush()
+        cutoff = (datetime.now() - timedelta(days=idle_days)).isoformat()
+        columns = MEMORY_COLUMNS + MemoryArchive.STAT_COLUMNS
+        archived = 0
+        while True:
+            rows = await self.db.fetchall(f"""
+                SELECT {', '.join(columns)} FROM enhanced_memories
+                WHERE importance <= ? AND COALESCE(last_accessed, timestamp) < ?
+                LIMIT ?
+            """, (max_importance.value, cutoff, batch_size))
+            if not rows:
+                break
+            # アーカイブ確定後に本体から削除（中断時は両方に残り、再実行で置換される）
+            await asyncio.to_thread(self.archive.add, rows)
+            memory_ids = [row[0] for row in rows]
+            await self.db.run_write(lambda conn, ids=memory_ids: self._delete_memories(conn, ids))
+            archived += len(rows)
+            logger.info(f"Archive progress: {archived} memories")
+
+        if archived:
+            await self.rebuild_vector_index()
+            await self.db.run_write(self._incremental_vacuum)
+        logger.info(f"Archived cold memories: {archived} (idle > {idle_days} days, importance <= {max_importance.name})")
+        return archived
+
+    @staticmethod
+    def _delete_memories(conn: sqlite3.Connection, memory_ids: List[str]) -> int:
+        """記憶と付随するLSHバケットを削除（全文検索索引はトリガーで同期）"""
+        placeholders = ','.join(['?'] * len(memory_ids))
+        conn.execute(f"DELETE FROM memory_lsh_buckets WHERE memory_id IN ({placeholders})", memory_ids)
+        return conn.execute(f"DELETE FROM enhanced_memories WHERE id IN ({placeholders})", memory_ids).rowcount
+
+    @staticmethod
+    def _incremental_vacuum(conn: sqlite3.Connection):
+        """空きページをファイルシステムへ返却（既存DBは初回のみ全体VACUUMで incremental に切替）"""
+        conn.commit()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            logger.info("Database switched to incremental auto_vacuum")
+        # execute() は1ページ解放で止まるため、完了までステップする executescript を使う
+        conn.executescript("PRAGMA incremental_vacuum;")
+
+    async def search_archive(self,
+                             query: str,
+                             limit: int = 10,
+                             session_id: str = None,
+                             importance_levels: List[MemoryImportance] = None,
+                             query_embedding=None,
+                             alpha: float = 0.5,
+                             min_score: float = 0.0) -> List[MemoryRecord]:
+        """アーカイブ済み記憶のオンデマンド検索（BM25＋全件コサイン類似度、融合スコアが min_score 以下は除外）"""
+        if query_embedding is None:
+            query_embedding = await self._generate_embedding(query)
+        query_vector = None
+        if query_embedding is not None and len(query_embedding) > 0:
+            query_vector = EmbeddingMatrix.normalize(np.asarray(query_embedding, dtype=np.float32))
+
+        results = await asyncio.to_thread(
+            self.archive.search,
+            self._fulltext_match_expression(query),
+            query_vector,
+            limit,
+            session_id,
+            [imp.value for imp in importance_levels] if importance_levels else None,
+            alpha,
+            min_score
+        )
+        scores = dict(results)
+        rows = await asyncio.to_thread(self.archive.get, list(scores))
+        memories = []
+        for row in rows:
+            memory = self._row_to_memory_record(row[:len(MEMORY_COLUMNS)])
+            memory.relevance_score = scores[memory.id]
+            memories.append(memory)
+        memories.sort(key=lambda x: x.relevance_score, reverse=True)
+        return memories
+
+    async def restore_archived_memories(self, memory_ids: List[str]) -> int:
+        """アーカイブから本体へ戻す（埋め込み・索引も再登録）"""
+        rows = await asyncio.to_thread(self.archive.get, memory_ids)
+        for row in rows:
+            await self._save_memory_record(self._row_to_memory_record(row[:len(MEMORY_COLUMNS)]))
+        await asyncio.to_thread(self.archive.remove, [row[0] for row in rows])
+        # 復元は参照とみなし、直後の再アーカイブを防ぐ
+        self._record_access([row[0] for row in rows])
+        return len(rows)
+
+    async def migrate_embeddings_to_binary(self, batch_size: int = 500) -> int:
+        """旧JSON形式の埋め込みをfloat32バイナリへ一括変換"""
+        migrated = 0
+        while True:
+            rows = await self.db.fetchall("""
+                SELECT id, embedding FROM enhanced_memories
+                WHERE typeof(embedding) = 'text'
+                LIMIT ?
+            """, (batch_size,))
+            if not rows:
+                break
+            await self.db.executemany(
+                "UPDATE enhanced_memories SET embedding = ? WHERE id = ?",
+                [(encode_embedding(decode_embedding(blob)), memory_id) for memory_id, blob in rows]
+            )
+            migrated += len(rows)
+            logger.info(f"Embedding migration progress: {migrated} rows")
+        return migrated
+
+    async def flush(self):
+        """保留中の書き込み・インデックス・キャッシュを確定"""
+        self._flush_access_stats()
+        await self.db.flush()
+        if self._vector_index_ready and self.vector_index.needs_retrain:
+            async with self._get_vector_index_lock():
+                if self._vector_index_ready and self.vector_index.needs_retrain:
+                    await self._retrain_vector_index()
+        if self._vector_index_ready and self.vector_index.dirty:
+            # 複製はイベントループ上で取り、全ID分の書き出しは別スレッドで行う
+            await asyncio.to_thread(self.vector_index.write, self.vector_index.snapshot())
+        self.embedding_cache.flush()
+        self.llm_cache.flush()
+        running = [task for task in self._summary_tasks.values() if not task.done()]
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    def close(self):
+        """確定処理とDB接続クローズ（未完了の強化処理は backfill_embeddings で回収）"""
+        for task in self._enrichment_workers + list(self._summary_tasks.values()):
+            task.cancel()
+        if self._vector_index_ready:
+            self.vector_index.flush()
+        self._flush_access_stats()
+        self.embedding_cache.close()
+        self.llm_cache.close()
+        self.archive.close()
+        self.db.close()
         
     async def inherit_session_memory(self, 
                                    previous_session_id: str,
@@ -286,32 +3259,23 @@ class O3EnhancedMemorySystem:
         """セッション記憶継承"""
         logger.info(f"Inheriting memory from {previous_session_id} to {current_session_id}")
         
+        inheritance_context, inherited_ids = await self._build_inheritance_context(previous_session_id)
+        await self._record_inheritance(previous_session_id, current_session_id, inherited_ids)
+        
+        logger.info(f"Session inheritance completed: {len(inherited_ids)} memories inherited")
+        return inheritance_context
+
+    async def _build_inheritance_context(self, previous_session_id: str) -> Tuple[Dict[str, Any], List[str]]:
+        """継承コンテキストと継承記憶IDを構築（DB書き込みなし）"""
         # 1. 前回セッションの重要記憶取得
-        critical_memories = self._get_memories_by_importance(
+        critical_memories = await self._get_memories_by_importance(
             previous_session_id, [MemoryImportance.CRITICAL, MemoryImportance.HIGH]
         )
         
-        # 2. o3による記憶要約・再構成
-        memory_summary = await self._generate_memory_summary(critical_memories)
+        # 2. セッション要約（未要約の差分のみ追加要約）
+        memory_summary = await self.get_session_summary(previous_session_id)
         
-        # 3. 継承記録作成
-        inheritance_id = hashlib.md5(f"{previous_session_id}-{current_session_id}".encode()).hexdigest()
-        
-        self.conn.execute("""
-            INSERT INTO session_inheritance
-            (id, previous_session_id, current_session_id, inherited_memories, inheritance_timestamp, inheritance_score)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            inheritance_id,
-            previous_session_id,
-            current_session_id,
-            json.dumps([m.id for m in critical_memories]),
-            datetime.now().isoformat(),
-            len(critical_memories) / 10.0  # 正規化スコア
-        ))
-        self.conn.commit()
-        
-        # 4. 継承コンテキスト構築
+        # 3. 継承コンテキスト構築
         inheritance_context = {
             "previous_session_id": previous_session_id,
             "inherited_memories_count": len(critical_memories),
@@ -320,75 +3284,235 @@ class O3EnhancedMemorySystem:
             "high_priority_tasks": [m.content for m in critical_memories if m.importance == MemoryImportance.HIGH],
             "continuation_points": await self._identify_continuation_points(critical_memories)
         }
+        self._record_access([m.id for m in critical_memories])
+        return inheritance_context, [m.id for m in critical_memories]
+
+    async def _record_inheritance(self, previous_session_id: str, current_session_id: str, inherited_ids: List[str]):
+        """継承記録作成（同一セッション組の再継承は上書き）"""
+        await self.db.execute(
+            INHERITANCE_INSERT_SQL, inheritance_row(previous_session_id, current_session_id, inherited_ids)
+        )
         
-        logger.info(f"Session inheritance completed: {len(critical_memories)} memories inherited")
-        return inheritance_context
-        
-    def _get_memories_by_importance(self, 
-                                  session_id: str,
-                                  importance_levels: List[MemoryImportance]) -> List[MemoryRecord]:
-        """重要度別記憶取得"""
-        importance_values = [imp.value for imp in importance_levels]
-        placeholders = ','.join(['?'] * len(importance_values))
-        
-        cursor = self.conn.execute(f"""
-            SELECT * FROM enhanced_memories 
-            WHERE session_id = ? AND importance IN ({placeholders})
-            ORDER BY importance DESC, timestamp DESC
-        """, [session_id] + importance_values)
-        
-        memories = []
-        for row in cursor.fetchall():
-            memories.append(MemoryRecord(
-                id=row[0],
-                session_id=row[1],
-                timestamp=datetime.fromisoformat(row[2]),
-                content=row[3],
-                importance=MemoryImportance(row[4]),
-                keywords=json.loads(row[5]),
-                context_type=row[6],
-                embedding=json.loads(row[7]) if row[7] else None,
-                ai_source=row[8]
-            ))
-            
-        return memories
+    async def _get_memories_by_importance(self, 
+                                  session_id: Optional[str],
+                                  importance_levels: List[MemoryImportance],
+                                  limit: int = None) -> List[MemoryRecord]:
+        """重要度別記憶取得（session_id=None は全セッション対象、limit 指定時は重要度→新しい順の上位のみ、埋め込みは読まない）"""
+        return [
+            memory async for memory in self.iter_memories(
+                session_id=session_id, importance_levels=importance_levels, order_by="importance", limit=limit
+            )
+        ]
+
+    # 並び順（(session_id, importance, timestamp) / (importance, timestamp) / timestamp 索引に対応）
+    MEMORY_ORDERINGS = {
+        "timestamp": "timestamp DESC",
+        "importance": "importance DESC, timestamp DESC",
+    }
+
+    def _memory_query(self,
+                      columns: Tuple[str, ...] = MEMORY_COLUMNS,
+                      session_id: Optional[str] = None,
+                      importance_levels: List[MemoryImportance] = None,
+                      context_type: str = None,
+                      content_patterns: List[str] = None,
+                      order_by: str = "timestamp",
+                      limit: int = None) -> Tuple[str, List[Any]]:
+        """記憶クエリ構築（列射影・条件・並び順・件数をSQLへ押し下げ）"""
+        unknown = set(columns) - set(MEMORY_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown memory columns: {sorted(unknown)}")
+        if order_by not in self.MEMORY_ORDERINGS:
+            raise ValueError(f"Unknown memory ordering: {order_by}")
+
+        conditions: List[str] = []
+        params: List[Any] = []
+        if session_id is not None:
+            conditions.append("session_id = ?")
+            params.append(session_id)
+        if importance_levels:
+            conditions.append(f"importance IN ({','.join(['?'] * len(importance_levels))})")
+            params.extend(imp.value for imp in importance_levels)
+        if context_type is not None:
+            conditions.append("context_type = ?")
+            params.append(context_type)
+        if content_patterns:
+            # LIKEはASCII大文字小文字を区別しない
+            conditions.append("(" + " OR ".join(["content LIKE ?"] * len(content_patterns)) + ")")
+            params.extend(f"%{pattern}%" for pattern in content_patterns)
+
+        sql = f"SELECT {', '.join(columns)} FROM enhanced_memories"
+        if conditions:
+            sql += f" WHERE {' AND '.join(conditions)}"
+        sql += f" ORDER BY {self.MEMORY_ORDERINGS[order_by]}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return sql, params
+
+    async def iter_memories(self,
+                            session_id: Optional[str] = None,
+                            importance_levels: List[MemoryImportance] = None,
+                            context_type: str = None,
+                            content_patterns: List[str] = None,
+                            order_by: str = "timestamp",
+                            limit: int = None,
+                            include_embedding: bool = False,
+                            batch_size: int = 256) -> AsyncIterator[MemoryRecord]:
+        """記憶レコードのストリーミング取得（埋め込みは include_embedding=True の場合のみ読む）"""
+        columns = MEMORY_COLUMNS if include_embedding else tuple(
+            column for column in MEMORY_COLUMNS if column != "embedding"
+        )
+        sql, params = self._memory_query(
+            columns, session_id, importance_levels, context_type, content_patterns, order_by, limit
+        )
+        async for memory in self.db.iterate(
+            sql, params, lambda row: self._row_to_memory_record(row, columns), batch_size
+        ):
+            yield memory
+
+    async def iter_memory_fields(self,
+                                 columns: Tuple[str, ...],
+                                 session_id: Optional[str] = None,
+                                 importance_levels: List[MemoryImportance] = None,
+                                 context_type: str = None,
+                                 content_patterns: List[str] = None,
+                                 order_by: str = "timestamp",
+                                 limit: int = None,
+                                 batch_size: int = 256) -> AsyncIterator[Dict[str, Any]]:
+        """指定列のみのストリーミング取得（列名→値の辞書、デコードなし）"""
+        sql, params = self._memory_query(
+            columns, session_id, importance_levels, context_type, content_patterns, order_by, limit
+        )
+        async for row in self.db.iterate(sql, params, lambda row: dict(zip(columns, row)), batch_size):
+            yield row
         
-    async def _generate_memory_summary(self, memories: List[MemoryRecord]) -> str:
-        """記憶要約生成"""
-        if not memories:
-            return "前回セッションからの継承記憶なし"
-            
-        try:
-            content_summary = "\n".join([f"- {m.content[:200]}..." for m in memories[:10]])
-            
-            summary_prompt = f"""
-            以下の記憶内容から、次のセッションで必要な要約を作成してください：
+    # ローリング要約の設定（1回の要約に含める記憶数・1件あたり文字数・統合時の束ね数）
+    SUMMARY_CHUNK_SIZE = 20
+    SUMMARY_CONTENT_CHARS = 500
+    SUMMARY_MERGE_FAN_IN = 4
 
-            {content_summary}
+    def _schedule_session_summary(self, session_id: str):
+        """未要約の記憶が一定件数たまったらバックグラウンドで差分要約"""
+        pending = self._summary_pending.get(session_id, 0) + 1
+        self._summary_pending[session_id] = pending
+        task = self._summary_tasks.get(session_id)
+        if pending < self.SUMMARY_CHUNK_SIZE or (task is not None and not task.done()):
+            return
+        self._summary_tasks[session_id] = asyncio.ensure_future(self.update_session_summary(session_id))
 
-            要約要件：
-            1. 重要な指示・禁止事項
-            2. 未完了タスクの継続点
-            3. 重要な学習・決定事項
-            4. 避けるべきミスパターン
+    async def get_session_summary(self, session_id: str) -> str:
+        """セッション要約（未要約の差分を取り込んでから返す）"""
+        summary = await self.update_session_summary(session_id)
+        return summary or "前回セッションからの継承記憶なし"
 
-            簡潔で実用的な要約を提供してください。
-            """
-            
-            response = await self.openai_client.chat.completions.create(
-                model="o3-mini",
-                messages=[
-                    {"role": "system", "content": "You are an expert at creating concise, actionable memory summaries for AI systems."},
-                    {"role": "user", "content": summary_prompt}
-                ],
-                max_tokens=500
-            )
-            
-            return response.choices[0].message.content
-            
-        except Exception as e:
-            logger.error(f"Memory summary generation failed: {e}")
-            return "要約生成エラー - 手動確認が必要"
+    async def update_session_summary(self, session_id: str) -> Optional[str]:
+        """前回要約以降に保存された記憶だけを要約し、既存要約へ階層的に統合"""
+        lock = self._summary_locks.setdefault(session_id, asyncio.Lock())
+        async with lock:
+            self._summary_pending[session_id] = 0
+            row = await self.db.fetchone("""
+                SELECT summary, summarized_rowid, memory_count FROM session_summaries WHERE session_id = ?
+            """, (session_id,))
+            summary, summarized_rowid, memory_count = row if row else (None, 0, 0)
+
+            # 1. 差分をチャンク単位で要約（map）
+            chunk_summaries: List[str] = []
+            last_rowid = summarized_rowid
+            try:
+                while True:
+                    sql, params = self._summary_delta_query(session_id, last_rowid)
+                    chunk = await self.db.fetchall(sql, params)
+                    if not chunk:
+                        break
+                    chunk_summaries.append(await self._summarize_memory_chunk(chunk))
+                    last_rowid, memory_count = chunk[-1][0], memory_count + len(chunk)
+                if not chunk_summaries:
+                    return summary
+
+                # 2. 既存要約と差分要約を統合（reduce）
+                summary = await self._merge_summaries(([summary] if summary else []) + chunk_summaries)
+            except Exception as e:
+                logger.error(f"Session summary update failed: {session_id}: {e}")
+                return summary or "要約生成エラー - 手動確認が必要"
+
+            await self.db.execute("""
+                INSERT OR REPLACE INTO session_summaries
+                (session_id, summary, summarized_rowid, memory_count, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (session_id, summary, last_rowid, memory_count, datetime.now().isoformat()))
+            logger.info(f"Session summary updated: {session_id} ({memory_count} memories)")
+            return summary
+
+    def _summary_delta_query(self, session_id: str, after_rowid: int) -> Tuple[str, List[Any]]:
+        """未要約記憶の1チャンク分（session_id索引をrowid順に範囲走査）"""
+        return """
+            SELECT rowid, importance, context_type, content FROM enhanced_memories
+            WHERE session_id = ? AND rowid > ?
+            ORDER BY rowid
+            LIMIT ?
+        """, [session_id, after_rowid, self.SUMMARY_CHUNK_SIZE]
+
+    async def _summarize_memory_chunk(self, chunk: List[Tuple[int, int, str, str]]) -> str:
+        """記憶チャンクの要約"""
+        content_summary = "\n".join(
+            f"- [{context_type}/重要度{importance}] {content[:self.SUMMARY_CONTENT_CHARS]}"
+            for _, importance, context_type, content in chunk
+        )
+        summary_prompt = f"""
+        以下の記憶内容から、次のセッションで必要な要約を作成してください：
+
+        {content_summary}
+
+        要約要件：
+        1. 重要な指示・禁止事項
+        2. 未完了タスクの継続点
+        3. 重要な学習・決定事項
+        4. 避けるべきミスパターン
+
+        簡潔で実用的な要約を提供してください。
+        """
+        return await self._chat_completion(
+            [
+                {"role": "system", "content": "You are an expert at creating concise, actionable memory summaries for AI systems."},
+                {"role": "user", "content": summary_prompt}
+            ],
+            max_tokens=500
+        )
+
+    async def _merge_summaries(self, summaries: List[str]) -> str:
+        """要約を SUMMARY_MERGE_FAN_IN 件ずつ束ねて1つになるまで統合（古い順に並べる）"""
+        while len(summaries) > 1:
+            groups = [
+                summaries[i:i + self.SUMMARY_MERGE_FAN_IN]
+                for i in range(0, len(summaries), self.SUMMARY_MERGE_FAN_IN)
+            ]
+            summaries = list(await asyncio.gather(*[self._merge_summary_group(group) for group in groups]))
+        return summaries[0]
+
+    async def _merge_summary_group(self, group: List[str]) -> str:
+        if len(group) == 1:
+            return group[0]
+        sections = "\n\n".join(f"【要約{i + 1}】\n{summary}" for i, summary in enumerate(group))
+        merge_prompt = f"""
+        以下は同一セッションの記憶を時系列順に要約したものです。1つの要約に統合してください：
+
+        {sections}
+
+        統合要件：
+        1. 重要な指示・禁止事項は省略しない
+        2. 後の要約で完了・変更された事項は最新の状態に更新
+        3. 未完了タスクの継続点と避けるべきミスパターンを残す
+
+        簡潔で実用的な要約を提供してください。
+        """
+        return await self._chat_completion(
+            [
+                {"role": "system", "content": "You are an expert at creating concise, actionable memory summaries for AI systems."},
+                {"role": "user", "content": merge_prompt}
+            ],
+            max_tokens=500
+        )
             
     async def _identify_continuation_points(self, memories: List[MemoryRecord]) -> List[str]:
         """作業継続点の特定"""
@@ -418,91 +3542,238 @@ class O3EnhancedMemorySystem:
             }}
             """
             
-            response = await self.openai_client.chat.completions.create(
-                model="o3-mini",
-                messages=[
+            response_content = await self._chat_completion(
+                [
                     {"role": "system", "content": "You are an expert at identifying task continuation points."},
                     {"role": "user", "content": continuation_prompt}
                 ],
-                max_tokens=400
+                max_tokens=400,
+                validate=self._parse_continuation_points
             )
             
-            continuation_data = json.loads(response.choices[0].message.content)
-            return continuation_data.get("continuation_points", [])
+            return self._parse_continuation_points(response_content)
             
         except Exception as e:
             logger.error(f"Continuation point identification failed: {e}")
             return ["継続点特定エラー - 手動確認が必要"]
+
+    @staticmethod
+    def _parse_continuation_points(response_content: str) -> List[str]:
+        """継続点応答から continuation_points を取り出す（JSONオブジェクト・リストでなければ例外）"""
+        points = json.loads(response_content).get("continuation_points", [])
+        if not isinstance(points, list):
+            raise ValueError(f"Invalid continuation points: {points!r}")
+        return points
             
     async def search_relevant_memories(self, 
                                      query: str,
                                      session_id: str = None,
-                                     limit: int = 10) -> List[MemoryRecord]:
-        """関連記憶検索"""
-        # 1. クエリの埋め込み生成
+                                     limit: int = 10,
+                                     importance_levels: List[MemoryImportance] = None,
+                                     include_archive: bool = False,
+                                     mmr_lambda: Optional[float] = 0.7) -> List[MemoryRecord]:
+        """関連記憶検索（include_archive=True でアーカイブ済み記憶も検索）
+
+        mmr_lambda: 上位limit件の選択を MMR で多様化する関連度の重み（None で無効、1.0 で関連度のみ）
+        """
+        # 1. クエリの埋め込み生成（失敗時は全文検索のみで回答）
         query_embedding = await self._generate_embedding(query)
-        if not query_embedding:
-            return []
-            
-        # 2. 類似記憶検索
-        all_memories = self._get_all_memories(session_id)
-        relevant_memories = []
-        
-        for memory in all_memories:
-            if memory.embedding:
-                similarity = self._calculate_similarity(query_embedding, memory.embedding)
-                if similarity > 0.7:  # 類似度閾値
-                    memory.relevance_score = similarity
-                    relevant_memories.append(memory)
-                    
-        # 3. 重要度と類似度による並び替え
-        relevant_memories.sort(key=lambda x: (x.importance.value, x.relevance_score), reverse=True)
-        
-        return relevant_memories[:limit]
-        
-    def _get_all_memories(self, session_id: str = None) -> List[MemoryRecord]:
-        """全記憶取得"""
-        if session_id:
-            cursor = self.conn.execute("""
-                SELECT * FROM enhanced_memories 
-                WHERE session_id = ?
-                ORDER BY timestamp DESC
-            """, (session_id,))
+        if query_embedding is None or len(query_embedding) == 0:
+            relevant_memories = await self._hybrid_rank(
+                query, None, session_id, limit, importance_levels, mmr_lambda=mmr_lambda
+            )
+            sort_key = lambda x: x.relevance_score
         else:
-            cursor = self.conn.execute("""
-                SELECT * FROM enhanced_memories 
-                ORDER BY timestamp DESC
-            """)
-            
-        memories = []
-        for row in cursor.fetchall():
-            memories.append(MemoryRecord(
-                id=row[0],
-                session_id=row[1],
-                timestamp=datetime.fromisoformat(row[2]),
-                content=row[3],
-                importance=MemoryImportance(row[4]),
-                keywords=json.loads(row[5]),
-                context_type=row[6],
-                embedding=json.loads(row[7]) if row[7] else None,
-                ai_source=row[8]
+            # 2. 埋め込み行列で候補取得
+            candidates = await self._vector_search(
+                query_embedding, max(limit * 5, 50), session_id, importance_levels
+            )
+            threshold = self.embedding_backend.min_similarity
+            scores = {memory_id: score for memory_id, score in candidates if score > threshold}
+            if mmr_lambda is not None:
+                # 重要度を整数部に足した関連度でMMR（重要度の優先は保ち、同じ重要度内の重複を除く）
+                matrix = self.embedding_matrix
+                ranked = [
+                    (memory_id, int(matrix.importance[matrix.id_to_row[memory_id]]) + score)
+                    for memory_id, score in scores.items()
+                ]
+                scores = {memory_id: scores[memory_id] for memory_id, _ in matrix.mmr(ranked, limit, mmr_lambda)}
+
+            relevant_memories = await self._get_memories_by_ids(list(scores))
+            for memory in relevant_memories:
+                memory.relevance_score = scores[memory.id]
+            # 重要度と類似度による並び替え
+            sort_key = lambda x: (x.importance.value, x.relevance_score)
+
+        if include_archive:
+            # 本体の結果と同じ尺度で併合する（ベクトル検索時はコサイン類似度のみ・同じ類似度下限）
+            vector_only = query_embedding is not None and len(query_embedding) > 0
+            relevant_memories.extend(await self.search_archive(
+                query, limit, session_id, importance_levels, query_embedding=query_embedding,
+                alpha=1.0 if vector_only else 0.0,
+                min_score=self.embedding_backend.min_similarity if vector_only else 0.0
             ))
-            
-        return memories
         
-    def _calculate_similarity(self, embedding1: List[float], embedding2: List[float]) -> float:
-        """コサイン類似度計算"""
-        try:
-            vec1 = np.array(embedding1)
-            vec2 = np.array(embedding2)
-            return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
-        except Exception:
-            return 0.0
-            
-    async def generate_startup_context(self, current_session_id: str) -> Dict[str, Any]:
-        """起動時コンテキスト生成"""
+        # 3. 並び替え・参照統計の記録
+        relevant_memories.sort(key=sort_key, reverse=True)
+        relevant_memories = relevant_memories[:limit]
+        self._record_access(
+            [m.id for m in relevant_memories], {m.id: m.relevance_score for m in relevant_memories}
+        )
+        return relevant_memories
+        
+    async def hybrid_search(self,
+                            query: str,
+                            session_id: str = None,
+                            limit: int = 10,
+                            importance_levels: List[MemoryImportance] = None,
+                            alpha: float = 0.5,
+                            lexical_candidates: int = 300,
+                            mmr_lambda: Optional[float] = 0.7) -> List[MemoryRecord]:
+        """BM25＋ベクトル類似度のハイブリッド検索（relevance_score = 融合スコア）
+
+        全文検索索引で候補を数百件に絞り、その候補のみコサイン類似度を計算する。
+        語彙一致がない場合はベクトル検索、埋め込み生成失敗時はBM25のみで順位付け。
+        上位limit件は融合スコアを関連度とするMMRで選ぶ（mmr_lambda=None で無効）。
+        """
+        query_embedding = await self._generate_embedding(query)
+        return await self._hybrid_rank(
+            query, query_embedding, session_id, limit, importance_levels, alpha, lexical_candidates, mmr_lambda
+        )
+
+    async def _hybrid_rank(self,
+                           query: str,
+                           query_embedding,
+                           session_id: str = None,
+                           limit: int = 10,
+                           importance_levels: List[MemoryImportance] = None,
+                           alpha: float = 0.5,
+                           lexical_candidates: int = 300,
+                           mmr_lambda: Optional[float] = None) -> List[MemoryRecord]:
+        """BM25候補とコサイン類似度の線形融合"""
+        lexical_scores = dict(await self._lexical_search(query, lexical_candidates, session_id, importance_levels))
+
+        vector_scores: Dict[str, float] = {}
+        has_embedding = query_embedding is not None and len(query_embedding) > 0
+        if has_embedding:
+            if lexical_scores:
+                await self._ensure_vector_index()
+                query_vector = EmbeddingMatrix.normalize(np.asarray(query_embedding, dtype=np.float32))
+                if query_vector is not None and query_vector.shape[0] == self.embedding_matrix.dim:
+                    vector_scores = self.embedding_matrix.score_ids(query_vector, list(lexical_scores))
+            else:
+                vector_scores = dict(await self._vector_search(
+                    query_embedding, max(limit * 5, 50), session_id, importance_levels
+                ))
+        else:
+            alpha = 0.0
+
+        fused = {
+            memory_id: alpha * max(vector_scores.get(memory_id, 0.0), 0.0)
+            + (1 - alpha) * lexical_scores.get(memory_id, 0.0)
+            for memory_id in set(lexical_scores) | set(vector_scores)
+        }
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+        if mmr_lambda is not None:
+            ranked = self.embedding_matrix.mmr(ranked[:max(limit * 5, 50)], limit, mmr_lambda)
+        top_ids = [memory_id for memory_id, _ in ranked[:limit]]
+
+        memories = await self._get_memories_by_ids(top_ids)
+        for memory in memories:
+            memory.relevance_score = fused[memory.id]
+        memories.sort(key=lambda x: x.relevance_score, reverse=True)
+        self._record_access([m.id for m in memories], fused)
+        return memories
+
+    async def _lexical_search(self,
+                              query: str,
+                              k: int,
+                              session_id: str = None,
+                              importance_levels: List[MemoryImportance] = None) -> List[Tuple[str, float]]:
+        """全文検索索引のBM25上位k件 (id, 最大値で正規化したスコア)"""
+        match_expression = self._fulltext_match_expression(query)
+        if match_expression is None or not await self._fulltext_available():
+            return []
+
+        conditions = ["enhanced_memories_fts MATCH ?"]
+        params: List[Any] = [match_expression]
+        if session_id is not None:
+            conditions.append("m.session_id = ?")
+            params.append(session_id)
+        if importance_levels:
+            conditions.append(f"m.importance IN ({','.join(['?'] * len(importance_levels))})")
+            params.extend(imp.value for imp in importance_levels)
+        params.append(k)
+
+        # bm25() は小さいほど高関連（負値）
+        rows = await self.db.fetchall(f"""
+            SELECT m.id, -bm25(enhanced_memories_fts) AS score
+            FROM enhanced_memories_fts
+            JOIN enhanced_memories m ON m.rowid = enhanced_memories_fts.rowid
+            WHERE {' AND '.join(conditions)}
+            ORDER BY score DESC
+            LIMIT ?
+        """, params)
+        if not rows:
+            return []
+        max_score = max(score for _, score in rows) or 1.0
+        return [(memory_id, score / max_score) for memory_id, score in rows]
+
+    @staticmethod
+    def _fulltext_match_expression(query: str, max_terms: int = 64) -> Optional[str]:
+        """クエリ→FTS5 MATCH式（英数字語はフレーズ、分かち書きのない日本語はトライグラムのOR）"""
+        terms: List[str] = []
+        for word in query.split():
+            if len(word) < 3:  # trigramは3文字未満に一致しない
+                continue
+            if word.isascii():
+                terms.append(word)
+            else:
+                terms.extend(word[i:i + 3] for i in range(len(word) - 2))
+        terms = list(dict.fromkeys(terms))[:max_terms]
+        if not terms:
+            return None
+        return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+    async def _fulltext_available(self) -> bool:
+        """全文検索索引の有無（v3マイグレーションがFTS5非対応で省略された場合はFalse）"""
+        if self._fulltext_ready is None:
+            row = await self.db.fetchone(
+                "SELECT 1 FROM sqlite_master WHERE name = 'enhanced_memories_fts'"
+            )
+            self._fulltext_ready = row is not None
+        return self._fulltext_ready
+
+    def _rebuild_fulltext_index(self, conn: sqlite3.Connection):
+        """全文検索索引をenhanced_memoriesから再構築（書き込みスレッドで実行）"""
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'enhanced_memories_fts'").fetchone():
+            conn.execute("INSERT INTO enhanced_memories_fts(enhanced_memories_fts) VALUES ('rebuild')")
+
+    async def _get_memories_by_ids(self, memory_ids: List[str]) -> List[MemoryRecord]:
+        """ID指定記憶取得"""
+        if not memory_ids:
+            return []
+        placeholders = ','.join(['?'] * len(memory_ids))
+        return await self.db.fetchall(f"""
+            SELECT {', '.join(MEMORY_COLUMNS)} FROM enhanced_memories
+            WHERE id IN ({placeholders})
+        """, memory_ids, self._row_to_memory_record)
+
+    def _row_to_memory_record(self, row: Tuple, columns: Tuple[str, ...] = MEMORY_COLUMNS) -> MemoryRecord:
+        """DB行から記憶レコード構築（timestamp・keywords・embedding は参照時に復号）"""
+        return MemoryRecord.from_row(row, columns)
+
+    async def generate_startup_context(self,
+                                       current_session_id: str,
+                                       use_snapshot: bool = True) -> Dict[str, Any]:
+        """起動時コンテキスト生成（有効なスナップショットがあれば再計算せず返す）"""
+        if use_snapshot:
+            snapshot_context = await self._load_startup_snapshot(current_session_id)
+            if snapshot_context is not None:
+                return snapshot_context
+
         # 1. 前回セッションの特定
-        previous_session = self._get_latest_session(exclude_current=current_session_id)
+        previous_session = await self._get_latest_session(exclude_current=current_session_id)
         
         # 2. 記憶継承実行
         if previous_session:
@@ -512,82 +3783,165 @@ class O3EnhancedMemorySystem:
         else:
             inheritance_context = {"message": "初回セッション"}
             
-        # 3. 必須記憶の取得
-        critical_memories = self._get_memories_by_importance(
-            None, [MemoryImportance.CRITICAL]
-        )
-        
-        # 4. 未完了タスクの取得
-        pending_tasks = await self._get_pending_tasks()
-        
-        # 5. 起動時コンテキスト構築
+        # 3. 起動時コンテキスト構築
         startup_context = {
             "session_id": current_session_id,
             "inheritance": inheritance_context,
-            "critical_directives": [m.content for m in critical_memories],
-            "pending_tasks": pending_tasks,
-            "mistake_prevention_rules": self._get_mistake_prevention_rules(),
-            "ai_collaboration_history": self._get_ai_collaboration_summary(),
+            **await self._build_startup_sections(),
             "startup_timestamp": datetime.now().isoformat()
         }
         
         return startup_context
+
+    # 起動時コンテキストに含める必須記憶の上限（全セッション対象のため履歴に比例して増えないよう制限）
+    STARTUP_CRITICAL_LIMIT = 50
+
+    async def _build_startup_sections(self) -> Dict[str, Any]:
+        """セッションに依存しない起動時コンテキスト項目"""
+        # 必須記憶の取得（session_id=None は全セッション横断。新しい順に STARTUP_CRITICAL_LIMIT 件まで）
+        critical_memories = await self._get_memories_by_importance(
+            None, [MemoryImportance.CRITICAL], limit=self.STARTUP_CRITICAL_LIMIT
+        )
+        return {
+            "critical_directives": [m.content for m in critical_memories],
+            "pending_tasks": await self._get_pending_tasks(),
+            "mistake_prevention_rules": await self._get_mistake_prevention_rules(),
+            "ai_collaboration_history": await self._get_ai_collaboration_summary(),
+        }
+
+    async def close_session(self, session_id: str) -> bool:
+        """セッション終了フック: 次回起動用コンテキストを事前計算しスナップショット保存"""
+        # 1. 保留中の強化・書き込みを確定
+        await self.wait_for_enrichment()
+        await self.db.flush()
+        version = (await self.db.fetchone("SELECT version FROM memory_state WHERE id = 1"))[0]
+        
+        # 2. 次回起動時に選ばれる前回セッション（記憶のある最新セッション）
+        previous_session = await self._get_latest_session()
+        if previous_session is None:
+            return False
+        
+        # 3. 継承・起動時コンテキスト計算（計算中に記憶が増えた場合は次回起動時に無効）
+        inheritance_context, inherited_ids = await self._build_inheritance_context(previous_session)
+        context = {"inheritance": inheritance_context, **await self._build_startup_sections()}
+        await self.db.execute("""
+            INSERT OR REPLACE INTO startup_snapshot
+            (id, source_session_id, memory_version, context, inherited_memories, created_at)
+            VALUES (1, ?, ?, ?, ?, ?)
+        """, (
+            previous_session,
+            version,
+            json.dumps(context, ensure_ascii=False),
+            json.dumps(inherited_ids),
+            datetime.now().isoformat()
+        ))
+        logger.info(f"Startup snapshot saved at session close: {session_id} (memory version {version})")
+        return True
+
+    async def _load_startup_snapshot(self, current_session_id: str) -> Optional[Dict[str, Any]]:
+        """記憶バージョンが一致するスナップショットから起動時コンテキストを復元"""
+        row = await self.db.fetchone(STARTUP_SNAPSHOT_QUERY)
+        if row is None or row[0] == current_session_id:
+            return None
+        previous_session, context, inherited_memories = row
+        inherited_ids = json.loads(inherited_memories)
+        await self._record_inheritance(previous_session, current_session_id, inherited_ids)
+        self._record_access(inherited_ids)
+        logger.info(f"Startup context served from snapshot: {previous_session} -> {current_session_id}")
+        return {
+            "session_id": current_session_id,
+            **json.loads(context),
+            "startup_timestamp": datetime.now().isoformat()
+        }
         
-    def _get_latest_session(self, exclude_current: str = None) -> Optional[str]:
+    async def _get_latest_session(self, exclude_current: str = None) -> Optional[str]:
         """最新セッションID取得"""
+        sql, params = self._latest_session_query(exclude_current)
+        result = await self.db.fetchone(sql, params)
+        return result[0] if result else None
+
+    def _latest_session_query(self, exclude_current: str = None) -> Tuple[str, List[Any]]:
+        """最新記憶のセッションIDクエリ（timestamp索引を逆順走査）"""
         if exclude_current:
-            cursor = self.conn.execute("""
-                SELECT DISTINCT session_id FROM enhanced_memories 
+            return """
+                SELECT session_id FROM enhanced_memories 
                 WHERE session_id != ?
                 ORDER BY timestamp DESC 
                 LIMIT 1
-            """, (exclude_current,))
-        else:
-            cursor = self.conn.execute("""
-                SELECT DISTINCT session_id FROM enhanced_memories 
-                ORDER BY timestamp DESC 
-                LIMIT 1
-            """)
-            
-        result = cursor.fetchone()
-        return result[0] if result else None
+            """, [exclude_current]
+        return """
+            SELECT session_id FROM enhanced_memories 
+            ORDER BY timestamp DESC 
+            LIMIT 1
+        """, []
         
+    # 未完了タスク判定キーワード
+    PENDING_TASK_PATTERNS = ["未完了", "継続", "todo", "pending", "進行中"]
+
     async def _get_pending_tasks(self) -> List[str]:
         """未完了タスク取得"""
-        task_memories = self._get_memories_by_importance(
-            None, [MemoryImportance.HIGH, MemoryImportance.MEDIUM]
-        )
-        
         # タスク関連記憶から未完了項目を抽出
-        pending_tasks = []
-        for memory in task_memories:
-            if any(keyword in memory.content.lower() for keyword in 
-                   ["未完了", "継続", "todo", "pending", "進行中"]):
-                pending_tasks.append(memory.content)
-                
-        return pending_tasks[:10]  # 最大10個
-        
-    def _get_mistake_prevention_rules(self) -> List[str]:
-        """ミス防止ルール取得"""
-        mistake_memories = [m for m in self._get_all_memories() 
-                          if m.context_type == "mistake"]
+        return [
+            row["content"] async for row in self.iter_memory_fields(
+                ("content",),
+                importance_levels=[MemoryImportance.HIGH, MemoryImportance.MEDIUM],
+                content_patterns=self.PENDING_TASK_PATTERNS,
+                order_by="importance",
+                limit=10  # 最大10個
+            )
+        ]
         
-        rules = []
-        for memory in mistake_memories:
-            rules.append(f"【防止ルール】{memory.content}")
-            
-        return rules[:5]  # 最大5個
+    async def _get_mistake_prevention_rules(self) -> List[str]:
+        """ミス防止ルール取得"""
+        return [
+            f"【防止ルール】{row['content']}" async for row in self.iter_memory_fields(
+                ("content",), context_type="mistake", limit=5  # 最大5個
+            )
+        ]
+
+    def _hot_queries(self) -> Dict[str, Tuple[str, List[Any]]]:
+        """実行計画を検証する主要クエリ"""
+        levels = [MemoryImportance.CRITICAL, MemoryImportance.HIGH]
+        return {
+            "memories_by_session_importance": self._memory_query(
+                session_id="session", importance_levels=levels, order_by="importance"
+            ),
+            "memories_by_importance": self._memory_query(importance_levels=levels, order_by="importance"),
+            "pending_tasks": self._memory_query(
+                ("content",),
+                importance_levels=[MemoryImportance.HIGH, MemoryImportance.MEDIUM],
+                content_patterns=self.PENDING_TASK_PATTERNS,
+                order_by="importance",
+                limit=10
+            ),
+            "latest_session": self._latest_session_query("session"),
+            "mistake_rules": self._memory_query(("content",), context_type="mistake", limit=5),
+            "recent_memories": self._memory_query(limit=100),
+            "session_summary_delta": self._summary_delta_query("session", 0),
+        }
+
+    async def check_query_plans(self) -> Dict[str, Dict[str, Any]]:
+        """EXPLAIN QUERY PLANで主要クエリが索引を使うことを検証（全件走査・一時ソートを検出）"""
+        results = {}
+        for name, (sql, params) in self._hot_queries().items():
+            plan = [row[3] for row in await self.db.fetchall(f"EXPLAIN QUERY PLAN {sql}", params)]
+            regressions = [
+                detail for detail in plan
+                if (detail.startswith("SCAN") and "USING" not in detail) or "TEMP B-TREE" in detail
+            ]
+            results[name] = {"ok": not regressions, "plan": plan}
+        return results
         
-    def _get_ai_collaboration_summary(self) -> Dict[str, Any]:
+    async def _get_ai_collaboration_summary(self) -> Dict[str, Any]:
         """AI連携履歴要約"""
-        cursor = self.conn.execute("""
+        rows = await self.db.fetchall("""
             SELECT ai_source, COUNT(*) as count, AVG(usefulness_score) as avg_usefulness
             FROM ai_collaborations 
             GROUP BY ai_source
         """)
         
         collaboration_summary = {}
-        for row in cursor.fetchall():
+        for row in rows:
             collaboration_summary[row[0]] = {
                 "interaction_count": row[1],
                 "average_usefulness": row[2] or 0.0
@@ -595,17 +3949,319 @@ class O3EnhancedMemorySystem:
             
         return collaboration_summary
 
+# 本モジュールの読み込み時に import されてはならない重量級依存
+HEAVY_MODULES = ("numpy", "openai", "sklearn", "scipy", "aiohttp")
+
+def check_import_budget(budget_ms: float = 250.0) -> Dict[str, Any]:
+    """新規プロセスで本モジュールを -X importtime 付きで読み込み、読み込み時間と重量級依存の有無を検査"""
+    code = (
+        "import importlib.util, time\n"
+        "started = time.perf_counter()\n"
+        f"spec = importlib.util.spec_from_file_location('o3_memory_system', {str(Path(__file__).resolve())!r})\n"
+        "module = importlib.util.module_from_spec(spec)\n"
+        "spec.loader.exec_module(module)\n"
+        "print((time.perf_counter() - started) * 1000)\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True
+    )
+    import_ms = float(result.stdout.strip().splitlines()[-1])
+
+    # 書式: "import time: <self us> | <cumulative us> | <入れ子で字下げしたモジュール名>"
+    heavy: Dict[str, float] = {}
+    top_level: List[Tuple[str, float]] = []
+    for line in result.stderr.splitlines():
+        parts = line[len("import time:"):].split("|") if line.startswith("import time:") else []
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        cumulative_ms = int(parts[1]) / 1000
+        name = parts[2].strip()
+        if name.split(".")[0] in HEAVY_MODULES:
+            heavy[name.split(".")[0]] = max(heavy.get(name.split(".")[0], 0.0), cumulative_ms)
+        if len(parts[2]) - len(parts[2].lstrip()) == 1:
+            top_level.append((name, cumulative_ms))
+    return {
+        "ok": not heavy and import_ms <= budget_ms,
+        "import_ms": round(import_ms, 1),
+        "budget_ms": budget_ms,
+        "heavy_modules": heavy,
+        "slowest_imports": sorted(top_level, key=lambda item: item[1], reverse=True)[:5],
+    }
+
+class OfflineOpenAIClient:
+    """API呼び出しを行わない AsyncOpenAI 互換クライアント（呼び出しは即座に失敗しローカル分析へフォールバック）"""
+
+    def __init__(self):
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._create))
+        self.embeddings = types.SimpleNamespace(create=self._create)
+
+    @staticmethod
+    async def _create(**kwargs):
+        raise RuntimeError("OpenAI API is disabled (offline client)")
+
+# ローカル埋め込みでの検索検証: (保存する記憶, [(クエリ, 最上位に来るべき記憶の添字)])
+LOCAL_SEARCH_MEMORIES = [
+    "Take a database backup before every deploy",
+    "The UI color scheme uses blue tones",
+    "本番DBのバックアップを毎日取ること",
+    "UIの配色は青系で統一する",
+    "Rebuilt the vector index after archiving cold memories",
+    "o3記憶システムの実装を完了した",
+]
+LOCAL_SEARCH_QUERIES = [
+    ("Take a database backup before each deploy", 0),
+    ("本番DBのバックアップ", 2),
+    ("vector index rebuild", 4),
+    ("記憶システム実装", 5),
+]
+# アーカイブ検索の検証: (アーカイブする記憶, それを返すべきクエリ)。上の各クエリでは返らないこと
+LOCAL_SEARCH_ARCHIVED = ("Water the tomato seedlings in the greenhouse", "tomato seedlings greenhouse")
+
+async def check_local_search() -> Dict[str, Any]:
+    """一時ディレクトリにローカル埋め込みで記憶を保存し、関連記憶検索で期待した記憶が最上位に来るか検査
+
+    保存したインスタンスに加え、保存前の空のストアで行列を読み込んだ別インスタンス（別プロセス相当）でも検索する。
+    アーカイブ込みの検索では、無関係なアーカイブ済み記憶が類似度下限で除外されることも確認する。
+    """
+    previous_level = logger.level
+    # 偽クライアントの呼び出し失敗（o3分析のフォールバック）は想定どおりのため出力しない
+    logger.setLevel(logging.CRITICAL)
+    with tempfile.TemporaryDirectory(prefix="o3-memory-search-check-") as base_path:
+        memory_system, other = [
+            O3EnhancedMemorySystem(
+                base_path=base_path, embedding_backend="local", openai_client=OfflineOpenAIClient()
+            )
+            for _ in range(2)
+        ]
+        try:
+            await other.search_relevant_memories(LOCAL_SEARCH_QUERIES[0][0], limit=3)
+            archived_content, archived_query = LOCAL_SEARCH_ARCHIVED
+            memory_ids = await memory_system.save_memories_bulk(
+                [{"content": content} for content in LOCAL_SEARCH_MEMORIES + [archived_content]], "search-check"
+            )
+            archived_id = memory_ids[-1]
+            # 古い低重要度の記憶としてアーカイブへ移す
+            await memory_system.db.execute(
+                "UPDATE enhanced_memories SET importance = ?, timestamp = ?, last_accessed = NULL WHERE id = ?",
+                (MemoryImportance.LOW.value, (datetime.now() - timedelta(days=365)).isoformat(), archived_id)
+            )
+            await memory_system.archive_cold_memories()
+            await memory_system.flush()
+            queries = []
+            for instance, system in [("保存側", memory_system), ("別インスタンス", other)]:
+                for query, expected in LOCAL_SEARCH_QUERIES:
+                    results = await system.search_relevant_memories(query, limit=3, include_archive=True)
+                    queries.append({
+                        "query": f"[{instance}] {query}",
+                        "ok": bool(results) and results[0].id == memory_ids[expected]
+                        and all(memory.id != archived_id for memory in results),
+                        "results": [(memory.content, round(memory.relevance_score, 3)) for memory in results],
+                    })
+                results = await system.search_relevant_memories(archived_query, limit=3, include_archive=True)
+                queries.append({
+                    "query": f"[{instance}/アーカイブ] {archived_query}",
+                    "ok": any(memory.id == archived_id for memory in results),
+                    "results": [(memory.content, round(memory.relevance_score, 3)) for memory in results],
+                })
+        finally:
+            memory_system.close()
+            other.close()
+            logger.setLevel(previous_level)
+    return {
+        "ok": all(query["ok"] for query in queries),
+        "min_similarity": memory_system.embedding_backend.min_similarity,
+        "queries": queries,
+    }
+
+def parse_args() -> argparse.Namespace:
+    """CLI引数解析"""
+    parser = argparse.ArgumentParser(description="o3 Enhanced Memory System")
+    parser.add_argument(
+        "--action",
+        default="self_test",
+        choices=[
+            "self_test", "update_search_index", "migrate_embeddings",
+            "backfill_embeddings", "check_query_plans", "reembed", "importance_stats",
+            "inherit_session", "close_session", "dedupe_report", "archive_old_memories",
+            "import_budget", "search_check"
+        ],
+        help="実行するアクション（デフォルト: システムテスト）"
+    )
+    parser.add_argument("--base-path", help="記憶データディレクトリ")
+    parser.add_argument("--session-id", help="対象セッションID")
+    parser.add_argument(
+        "--mode",
+        default="auto",
+        choices=["auto", "full"],
+        help="inherit_session: auto=有効なスナップショットを使用 / full=常に再計算"
+    )
+    parser.add_argument(
+        "--idle-days",
+        type=int,
+        default=30,
+        help="archive_old_memories: この日数以上参照のない低重要度記憶をアーカイブ"
+    )
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=250.0,
+        help="import_budget: モジュール読み込み時間の上限（ミリ秒）"
+    )
+    parser.add_argument(
+        "--embedding-backend",
+        choices=sorted(EMBEDDING_BACKENDS),
+        help="埋め込みバックエンド（既定: 環境変数 O3_MEMORY_EMBEDDING_BACKEND または openai）"
+    )
+    return parser.parse_args()
+
+def create_memory_system(args: argparse.Namespace,
+                         api_key: str = None,
+                         openai_client=None) -> "O3EnhancedMemorySystem":
+    """CLI引数からシステム初期化"""
+    # 保守系アクションはAPIを呼ばないため、キー未設定でもクライアント生成を通す
+    api_key = api_key or os.getenv("OPENAI_API_KEY") or "offline"
+    if args.base_path:
+        return O3EnhancedMemorySystem(
+            base_path=args.base_path, openai_api_key=api_key,
+            embedding_backend=args.embedding_backend, openai_client=openai_client
+        )
+    return O3EnhancedMemorySystem(
+        openai_api_key=api_key, embedding_backend=args.embedding_backend, openai_client=openai_client
+    )
+
 # 使用例
 async def main():
     """システムテスト"""
+    args = parse_args()
+
+    if args.action == "inherit_session" and args.mode == "auto":
+        # 軽量経路: 有効なスナップショットはSQLiteから直接返す（numpy・openai・sklearnを読み込まない）
+        args.session_id = args.session_id or f"session-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        context = read_startup_snapshot(
+            Path(args.base_path or DEFAULT_BASE_PATH) / DATABASE_FILENAME, args.session_id
+        )
+        if context is not None:
+            print(json.dumps(context, ensure_ascii=False, indent=2))
+            return
+
+    if args.action == "import_budget":
+        result = check_import_budget(args.budget_ms)
+        status = "✅" if result["ok"] else "❌"
+        print(f"{status} モジュール読み込み: {result['import_ms']} ms（予算 {result['budget_ms']} ms）")
+        for name, elapsed in result["heavy_modules"].items():
+            print(f"❌ 読み込み時に {name} を import: {elapsed} ms")
+        for name, elapsed in result["slowest_imports"]:
+            print(f"   {name}: {elapsed} ms")
+        if not result["ok"]:
+            sys.exit(1)
+        return
+
+    if args.action == "search_check":
+        result = await check_local_search()
+        for query in result["queries"]:
+            status = "✅" if query["ok"] else "❌"
+            print(f"{status} {query['query']}: {query['results']}")
+        print(f"   類似度下限（local）: {result['min_similarity']}")
+        if not result["ok"]:
+            sys.exit(1)
+        return
+
+    if args.action == "update_search_index":
+        memory_system = create_memory_system(args)
+        count = await memory_system.rebuild_vector_index()
+        memory_system.close()
+        print(f"✅ 検索インデックス再構築完了: {count} 件")
+        return
+
+    if args.action == "check_query_plans":
+        memory_system = create_memory_system(args)
+        results = await memory_system.check_query_plans()
+        memory_system.close()
+        for name, result in results.items():
+            status = "✅" if result["ok"] else "❌"
+            print(f"{status} {name}: {' / '.join(result['plan'])}")
+        if not all(result["ok"] for result in results.values()):
+            sys.exit(1)
+        return
+
+    if args.action == "migrate_embeddings":
+        memory_system = create_memory_system(args)
+        migrated = await memory_system.migrate_embeddings_to_binary()
+        await memory_system.db.run_write(lambda conn: conn.execute("VACUUM"))
+        memory_system.close()
+        print(f"✅ 埋め込みバイナリ変換完了: {migrated} 件")
+        return
+
+    if args.action == "importance_stats":
+        memory_system = create_memory_system(args)
+        stats = await memory_system.get_importance_classifier_stats()
+        memory_system.close()
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+        return
+
+    if args.action == "dedupe_report":
+        memory_system = create_memory_system(args)
+        report = await memory_system.near_duplicate_report()
+        memory_system.close()
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+
+    if args.action == "archive_old_memories":
+        memory_system = create_memory_system(args)
+        archived = await memory_system.archive_cold_memories(idle_days=args.idle_days)
+        memory_system.close()
+        print(f"✅ アーカイブ完了: {archived} 件")
+        return
+
+    if args.action == "reembed":
+        memory_system = create_memory_system(args)
+        reembedded = await memory_system.reembed_memories()
+        memory_system.close()
+        print(f"✅ 埋め込み再計算完了（{memory_system.embedding_backend.model}）: {reembedded} 件")
+        return
+
     # 環境変数からAPIキー取得
     api_key = os.getenv("OPENAI_API_KEY")
+
+    if args.action == "backfill_embeddings":
+        # キーが必要なのはAPIで埋め込みを計算する openai バックエンドのみ
+        # （未設定時のo3分析はオフラインクライアントで即座に失敗し、ローカル分類器・ルールベースの判定になる）
+        backend_name = args.embedding_backend or os.getenv("O3_MEMORY_EMBEDDING_BACKEND", "openai")
+        if backend_name == "openai" and not api_key:
+            print("❌ OPENAI_API_KEY環境変数が設定されていません")
+            return
+        memory_system = create_memory_system(args, api_key, None if api_key else OfflineOpenAIClient())
+        enriched = await memory_system.backfill_missing_embeddings()
+        memory_system.close()
+        print(f"✅ 埋め込みバックフィル完了: {enriched} 件")
+        return
+
     if not api_key:
         print("❌ OPENAI_API_KEY環境変数が設定されていません")
         return
-        
+
+    if args.action == "inherit_session":
+        memory_system = create_memory_system(args, api_key)
+        session_id = args.session_id or f"session-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        context = await memory_system.generate_startup_context(
+            session_id, use_snapshot=args.mode == "auto"
+        )
+        memory_system.close()
+        print(json.dumps(context, ensure_ascii=False, indent=2))
+        return
+
+    if args.action == "close_session":
+        if not args.session_id:
+            print("❌ --session-id が必要です")
+            sys.exit(1)
+        memory_system = create_memory_system(args, api_key)
+        saved = await memory_system.close_session(args.session_id)
+        memory_system.close()
+        print("✅ 起動時スナップショット保存完了" if saved else "⚠️ 記憶がないためスナップショット未作成")
+        return
+
     # システム初期化
-    memory_system = O3EnhancedMemorySystem(openai_api_key=api_key)
+    memory_system = create_memory_system(args, api_key)
     
     # テスト用セッションID
     test_session_id = f"test-session-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
@@ -631,6 +4287,8 @@ async def main():
     )
     print(f"✅ 関連記憶検索完了: {len(relevant)} 件")
     
+    print(f"📦 キャッシュ: {json.dumps(await memory_system.get_cache_stats(), ensure_ascii=False)}")
+    memory_system.close()
     print("🎯 o3 Enhanced Memory System テスト完了")
 
 if __name__ == "__main__":